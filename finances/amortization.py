@@ -0,0 +1,183 @@
+"""
+Month by month amortization schedules of fixed rate loans, for many loans and scenarios at once.
+
+All parameters are NumPy arrays broadcast together (e.g. one row per scenario, one column per loan), and each
+result has one more axis, the months. There is no loop over the months: with a constant monthly rate m and
+g = 1 + m, the balance after month k is a closed form of the cumulative sum of the (discounted) payments:
+    - keep="payment" (prepayments shorten the loan): B_k = g^k (P - sum_{j<=k} (A + X_j) g^-j)
+    - keep="duration" (prepayments lower the payment): B_k = D_k (P / D_0 - sum_{j<=k} X_j / D_j),
+      with D_k = (g^N - g^k) / m, proportional to the balance of an annuity ending at month N
+where P is the amount, A the monthly payment, N the duration and X_j the prepayment at the end of month j.
+The month where the balance reaches 0 gets the remainder, later months are empty.
+
+Prepayments can have a penalty (French law: the lowest of 6 months of interest on the amount repaid early and 3% of
+the balance before the prepayment).
+
+Several loans are combined exactly by adding their schedules (see combine_schedules), instead of averaging them into
+one loan (see mortgage_vs_market.get_average_interest).
+
+Run with:
+python amortization.py
+
+"""
+import numpy as np
+
+from mortgage_vs_market import get_periodic_interest
+
+# Early repayment penalty: months of interest on the amount repaid early, capped to a percentage of the balance
+PENALTY_MONTHS = 6
+PENALTY_RATE = 3
+
+
+def get_annuity(total, duration, interest):
+    """
+    Same as mortgage_vs_market.get_monthly_payment, for arrays and 0% loans
+
+    :param total: in euros
+    :param duration: number of months
+    :param interest: in percentage, yearly interest
+    :return: monthly payment
+    :rtype: ndarray
+    """
+
+    return _get_annuity(total, duration, get_periodic_interest(np.asarray(interest, dtype=float)))
+
+
+def _get_annuity(total, duration, rate):
+    # rate: monthly, as a decimal
+    duration = np.asarray(duration, dtype=float)
+
+    zero = rate == 0
+    safe_rate = np.where(zero, 1., rate)
+    denominator = np.where(zero, 1., -np.expm1(-duration * np.log1p(rate)))
+    payment = total * safe_rate / denominator
+
+    return np.where(zero, total / duration, payment)
+
+
+def get_schedule(total, interest, duration, prepayments=None, keep="payment", penalty_months=PENALTY_MONTHS,
+                 penalty_rate=PENALTY_RATE):
+    """
+    Amortization schedule of fixed rate loans
+
+    :param total: amount of the loan, in euros
+    :param interest: yearly interest rate in percentage
+    :param duration: number of months
+    :param prepayments: [optional] extra repayment at the end of each month (..., months), mostly zeros. An amount
+                        above the balance repays the loan, with no more.
+    :param str keep: [optional] after a prepayment, keep the "payment" (the loan ends earlier, default) or the
+                     "duration" (the payment is lower)
+    :param float penalty_months: [optional] penalty of the prepayments, in months of interest on the amount repaid
+                                 early. 0 for no penalty.
+    :param float penalty_rate: [optional] maximum penalty, in percentage of the balance before the prepayment
+    :return: monthly arrays (..., months), months is the longest duration:
+             - payment: regular payment, interest included
+             - interest, principal: parts of the regular payment
+             - prepayment, penalty
+             - balance: remaining at the end of the month
+             - cost: interest and penalties paid since the start
+    :rtype: dict(str, ndarray)
+    """
+
+    if keep not in ("payment", "duration"):
+        raise ValueError(f"keep must be 'payment' or 'duration', not '{keep}'")
+
+    total = np.asarray(total, dtype=float)[..., np.newaxis]
+    rate = get_periodic_interest(np.asarray(interest, dtype=float))[..., np.newaxis]
+    duration = np.asarray(duration)[..., np.newaxis]
+
+    nb_months = int(np.max(duration))
+    months = np.arange(1, nb_months + 1)
+    if prepayments is None:
+        prepayments = np.zeros(nb_months)
+    prepayments = np.asarray(prepayments, dtype=float)[..., :nb_months]
+    if prepayments.shape[-1] < nb_months:
+        prepayments = np.concatenate(
+            [prepayments, np.zeros(prepayments.shape[:-1] + (nb_months - prepayments.shape[-1],))], axis=-1)
+
+    log_growth = np.log1p(rate)
+    if keep == "payment":
+        payment = _get_annuity(total, duration, rate)
+        discount = np.exp(-months * log_growth)
+        balance = np.exp(months * log_growth) * (total - np.cumsum((payment + prepayments) * discount, axis=-1))
+    else:
+        # D_k = (g^N - g^k) / m, N - k for a 0% loan
+        zero = rate == 0
+        safe_rate = np.where(zero, 1., rate)
+        remaining = np.where(zero, duration - months,
+                             np.exp(months * log_growth) * np.expm1((duration - months) * log_growth) / safe_rate)
+        remaining_start = np.where(zero, duration, np.expm1(duration * log_growth) / safe_rate)
+        # D_N is 0, the last month can't have a prepayment term
+        safe_remaining = np.where(remaining > 0, remaining, 1.)
+        ratios = np.where(remaining > 0, prepayments / safe_remaining, 0.)
+        balance = remaining * (total / remaining_start - np.cumsum(ratios, axis=-1))
+
+    shape = np.broadcast_shapes(balance.shape, prepayments.shape)
+    balance = np.broadcast_to(balance, shape)
+    previous = np.concatenate([np.broadcast_to(total, shape[:-1] + (1,)), balance[..., :-1]], axis=-1)
+
+    # Running at the start of the month, and ending this month
+    tolerance = 1e-9 * total
+    running = (previous > tolerance) & (months <= duration)
+    last = running & ((balance <= tolerance) | (months == duration))
+
+    interest_paid = np.where(running, rate * previous, 0.)
+    due = previous + interest_paid
+    regular = due - balance - prepayments
+    # The last month, everything that is due is paid, the prepayment being what's above the regular payment
+    regular = np.where(last, np.minimum(regular, due), regular)
+    regular = np.where(running, regular, 0.)
+    prepaid = np.where(last, due - regular, np.where(running, prepayments, 0.))
+    balance = np.where(running & ~last, balance, 0.)
+
+    # The penalty is computed on the balance after the regular payment of the month
+    penalty = np.minimum(prepaid * rate * penalty_months, 0.01 * penalty_rate * (due - regular))
+    penalty = np.where(prepaid > 0, penalty, 0.)
+
+    return {
+        "payment": regular,
+        "interest": interest_paid,
+        "principal": regular - interest_paid,
+        "prepayment": prepaid,
+        "penalty": penalty,
+        "balance": balance,
+        "cost": np.cumsum(interest_paid + penalty, axis=-1),
+    }
+
+
+def combine_schedules(schedule, axis=0):
+    """
+    Combine several loans into one schedule, month by month (all the fields add up, cost included)
+
+    :param dict schedule: as returned by get_schedule, with the loans along one axis
+    :param int axis: [optional] axis of the loans (not the months)
+    :return: schedule of all the loans together
+    :rtype: dict(str, ndarray)
+    """
+
+    if axis < 0:
+        # The months are the last axis of the fields, not of the parameters
+        axis -= 1
+
+    return {field: values.sum(axis=axis) for (field, values) in schedule.items()}
+
+
+if __name__ == "__main__":
+    # My loans (see mortgage_vs_market.py)
+    totals = np.array([144000, 16000])  # euros
+    interests = np.array([1.45, 0])  # percent per year
+    duration = 240  # months
+
+    schedule = combine_schedules(get_schedule(totals, interests, duration))
+    print(f"Monthly payment: {schedule['payment'][0]:.2f}€, total cost: {schedule['cost'][-1]:.2f}€")
+
+    # 20 000€ repaid after 5 years, same payment (the loan ends earlier) or same duration (lower payment)
+    prepayments = np.zeros((2, duration))
+    prepayments[0, 59] = 20000
+    for keep in ("payment", "duration"):
+        schedules = get_schedule(totals, interests, duration, prepayments=prepayments, keep=keep)
+        nb_months = np.count_nonzero(schedules["payment"][0])
+        schedule = combine_schedules(schedules)
+        print(f"Prepayment, keep {keep}: first loan repaid in {nb_months} months "
+              f"(last payment {schedules['payment'][0, nb_months - 1]:.2f}€), "
+              f"penalty {schedule['penalty'].sum():.2f}€, total cost {schedule['cost'][-1]:.2f}€")
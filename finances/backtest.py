@@ -0,0 +1,131 @@
+"""
+Historical version of the comparison of mortgage_vs_market.py: instead of a constant market interest, both strategies
+are evaluated on the actual monthly returns of an index, for every historical start date (a window of normal_repay
+years starting at each month of the series), which shows the sequence risk:
+    - invest: repay the loan in normal_repay years, and invest the difference with an early repayment every month
+    - early: repay the loan in early_repay years, then invest the whole early monthly payment until normal_repay
+
+With P the prefix products of 1 + r (P[i] is the growth of the first i months), a contribution at the start of month
+t of the window starting at s is worth P[s + W] / P[s + t] at the end of the window (W months). The schedules of
+the strategies are made of a few segments of constant contribution, so the sum over a segment [a, b[ is a difference
+of the prefix sums S of 1 / P: c * P[s + W] * (S[s + b] - S[s + a]). On zero-copy rolling windows of P and S
+(sliding_window_view), each segment is one column difference for all the start dates, all windows cost O(N) in total
+instead of O(N * W).
+
+Run with:
+python backtest.py
+
+"""
+import csv
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from monte_carlo import get_strategies, get_summary, print_summary
+
+
+def load_history(filename, column, date_column="date", prices=False):
+    """
+    Read historical monthly data from a CSV file with a header line (see monte_carlo.load_returns)
+
+    :param str filename: CSV file, one line per month in chronological order
+    :param str column: name of the column to read
+    :param str date_column: [optional] name of the column with the month of each line
+    :param bool prices: [optional] If True, the column is an index level (or price), else monthly returns in
+                        percentage
+    :return: month of each return, and monthly returns as decimals
+    :rtype: tuple(list(str), ndarray)
+    """
+
+    with open(filename, newline="", encoding="utf-8") as f:
+        rows = [(row[date_column], float(row[column])) for row in csv.DictReader(f) if row[column].strip()]
+
+    dates = [date for (date, value) in rows]
+    values = np.array([value for (date, value) in rows])
+    if prices:
+        # A return is the growth between two lines, dated by the second one
+        return dates[1:], values[1:] / values[:-1] - 1
+
+    return dates, 0.01 * values
+
+
+def get_segments(contributions):
+    """
+    :param ndarray contributions: contribution at the start of each month
+    :return: start, end (excluded) and value of each segment of constant non-zero contributions
+    :rtype: list(tuple(int, int, float))
+    """
+
+    contributions = np.asarray(contributions, dtype=float)
+    changes = np.flatnonzero(np.diff(contributions)) + 1
+    bounds = np.concatenate([[0], changes, [contributions.size]])
+
+    return [(int(start), int(end), float(contributions[start])) for (start, end) in zip(bounds[:-1], bounds[1:])
+            if contributions[start] != 0]
+
+
+def get_final_wealth(returns, contributions):
+    """
+    Final wealth of a schedule of contributions, for every start date of the returns
+
+    :param ndarray returns: historical monthly returns as decimals (N months)
+    :param ndarray contributions: contribution at the start of each month of the window (W months)
+    :return: wealth at the end of each window (N - W + 1), the window starting at each month
+    :rtype: ndarray
+    """
+
+    returns = np.asarray(returns, dtype=float)
+    nb_months = len(contributions)
+    if returns.size < nb_months:
+        raise ValueError(f"{returns.size} months of history, less than the {nb_months} months of a window")
+
+    # Prefix products P and prefix sums S of 1 / P, computed in log space
+    log_growth = np.concatenate([[0.], np.cumsum(np.log1p(returns))])
+    growth = np.exp(log_growth)
+    discounted = np.concatenate([[0.], np.cumsum(np.exp(-log_growth[:-1]))])
+
+    # Rolling windows of W + 1 values (views, nothing is copied)
+    growth_windows = sliding_window_view(growth, nb_months + 1)
+    discounted_windows = sliding_window_view(discounted, nb_months + 1)
+
+    wealth = np.zeros(growth_windows.shape[0])
+    for (start, end, value) in get_segments(contributions):
+        wealth += value * (discounted_windows[:, end] - discounted_windows[:, start])
+
+    return growth_windows[:, -1] * wealth
+
+
+def backtest(strategies, returns):
+    """
+    :param dict strategies: monthly contributions of each strategy (see monte_carlo.get_strategies)
+    :param ndarray returns: historical monthly returns as decimals
+    :return: final wealth of each strategy, one value per start date
+    :rtype: dict(str, ndarray)
+    """
+
+    return {name: get_final_wealth(returns, contributions) for (name, contributions) in strategies.items()}
+
+
+if __name__ == "__main__":
+    total = 160000  # euros
+    interest = 1.3187  # percent per year, average of the loans (see mortgage_vs_market.py)
+    early_repay = 10
+    normal_repay = 20
+
+    returns_file = "index_returns.csv"  # CSV file with historical monthly returns of an index
+    returns_column = "return"  # Column of the CSV file, monthly returns in percentage (see prices)
+    date_column = "date"
+    prices = False  # True if the column is the level of the index instead of its returns
+
+    (dates, returns) = load_history(returns_file, returns_column, date_column=date_column, prices=prices)
+    strategies = get_strategies(total, interest, early_repay=early_repay, normal_repay=normal_repay)
+    wealth = backtest(strategies, returns)
+
+    nb_starts = wealth["invest"].size
+    print(f"Sum at your disposal after {normal_repay} years, {nb_starts} start dates from {dates[0]} to "
+          f"{dates[nb_starts - 1]}:")
+    print_summary(get_summary(wealth))
+
+    difference = wealth["invest"] - wealth["early"]
+    for (label, idx) in (("Worst", np.argmin(difference)), ("Best", np.argmax(difference))):
+        print(f"{label} start date for investing: {dates[idx]}, {difference[idx]:+.0f}€ compared to repaying early")
@@ -0,0 +1,81 @@
+"""
+Break-even market rate between the two strategies of mortgage_vs_market.py, without reading it on the plot:
+    - invest: repay the loan in normal_repay years, and invest the difference with an early repayment every month
+    - early: repay the loan in early_repay years, then invest the whole early monthly payment until normal_repay
+Below the break-even market rate, repaying early gives more money after normal_repay years, above it investing does.
+
+The break-even market rate is the loan rate itself, whatever the amount, the horizons or any extra savings invested
+by both strategies. With g the growth of a year at the loan rate, a payment over n years is proportional to
+1 / (1 - g^-n), and a year of contributions invested for k years grows by g^k, so at the loan rate:
+    - invest: (1 / (1 - g^-E) - 1 / (1 - g^-N)) * sum_{k=1..N} g^k = g (g^(N-E) - 1) / ((g - 1) (1 - g^-E))
+    - early: 1 / (1 - g^-E) * sum_{k=1..N-E} g^k = g (g^(N-E) - 1) / ((g - 1) (1 - g^-E))
+(N, E: normal and early horizons). The same holds month by month when compounding monthly: both strategies repay
+the same loan, and a market paying the loan rate values their payments the same way.
+
+Run with:
+python break_even.py
+
+"""
+import numpy as np
+
+from amortization import get_annuity
+from mortgage_vs_market import get_interest_on_regular_investment
+
+
+def get_wealth_difference(market_interest, total, interest, early_repay, normal_repay, contribution=0, monthly=False):
+    """
+    :param market_interest: market interest rate in percentage per year (NumPy arrays are broadcast)
+    :param total: loan amount in euros
+    :param interest: yearly interest of the loan in percentage
+    :param early_repay: duration of the early repayment, in years
+    :param normal_repay: duration of the loan, in years
+    :param contribution: [optional] extra monthly savings, invested by both strategies
+    :param bool monthly: [optional] If True, compound monthly (see get_interest_on_regular_investment)
+    :return: final wealth of the invest strategy minus the one of the early strategy, after normal_repay years
+    :rtype: ndarray
+    """
+
+    early_repay = np.asarray(early_repay)
+    normal_repay = np.asarray(normal_repay)
+    monthly_normal = get_annuity(total, normal_repay * 12, interest)
+    monthly_early = get_annuity(total, early_repay * 12, interest)
+
+    invest = get_interest_on_regular_investment(0, monthly_early - monthly_normal + contribution, market_interest,
+                                                normal_repay, monthly=monthly)
+    # Contributions during the early repayment, then everything until the end
+    early = get_interest_on_regular_investment(
+        get_interest_on_regular_investment(0, contribution, market_interest, early_repay, monthly=monthly),
+        monthly_early + contribution, market_interest, normal_repay - early_repay, monthly=monthly)
+
+    return invest - early
+
+
+def get_break_even(interest, early_repay, normal_repay):
+    """
+    :param interest: yearly interest of the loan in percentage (NumPy arrays are broadcast)
+    :param early_repay: duration of the early repayment, in years
+    :param normal_repay: duration of the loan, in years
+    :return: break-even market rate in percentage per year, NaN if early_repay is not before normal_repay (the
+             strategies are the same)
+    :rtype: ndarray
+    """
+
+    (interest, early_repay, normal_repay) = np.broadcast_arrays(np.asarray(interest, dtype=float),
+                                                                np.asarray(early_repay), np.asarray(normal_repay))
+
+    return np.where(early_repay < normal_repay, interest, np.nan)
+
+
+if __name__ == "__main__":
+    total = 160000  # euros
+    interest = 1.3187  # percent per year, average of the loans (see mortgage_vs_market.py)
+    early_repay = 10
+    normal_repay = 20
+
+    break_even = float(get_break_even(interest, early_repay, normal_repay))
+    print(f"Loan at {interest}% repaid in {early_repay} years instead of {normal_repay}: investing wins above a "
+          f"market rate of {break_even:.4f}%")
+
+    for market_interest in (break_even - 1, break_even, break_even + 1):
+        difference = get_wealth_difference(market_interest, total, interest, early_repay, normal_repay)
+        print(f"Market at {market_interest:.4f}%: investing gives {difference:+.2f}€ compared to repaying early")
@@ -0,0 +1,244 @@
+"""
+Monte Carlo version of the comparison of mortgage_vs_market.py: instead of a constant market interest, the market
+returns are random, month by month, and both strategies are evaluated on the same paths:
+    - invest: repay the loan in normal_repay years, and invest the difference with an early repayment every month
+    - early: repay the loan in early_repay years, then invest the whole early monthly payment until normal_repay
+
+Monthly returns are either log-normal (yearly mean and volatility), or bootstrapped from a CSV file of historical
+monthly returns (blocks of consecutive months, to keep some of their autocorrelation).
+
+Each strategy is a schedule of monthly contributions. On a path of monthly returns r, a contribution at the start of
+month t is worth the product of (1 + r) from t to the end, so the final wealth of all strategies is one product of
+the suffix products of the path (a cumulative product) with the contributions. Paths are drawn and evaluated in
+chunks, so memory is bounded whatever the number of paths, and chunks can be spread on a pool of processes. Each chunk
+has its own random generator (spawned from the seed), results don't depend on the number of processes.
+
+Run with:
+python monte_carlo.py
+
+"""
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mortgage_vs_market import get_monthly_payment, get_periodic_interest
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+CHUNK_SIZE = 20000
+
+
+def get_lognormal_returns(rng, nb_paths, nb_months, interest=7, volatility=15):
+    """
+    :param numpy.random.Generator rng:
+    :param int nb_paths:
+    :param int nb_months:
+    :param float interest: [optional] mean yearly return in percentage
+    :param float volatility: [optional] yearly volatility (standard deviation of the log returns) in percentage
+    :return: monthly returns as decimals (nb_paths, nb_months), their mean compounds to interest per year
+    :rtype: ndarray
+    """
+
+    sigma = 0.01 * volatility / np.sqrt(12)
+    mu = np.log1p(get_periodic_interest(interest)) - sigma ** 2 / 2
+
+    return np.expm1(rng.normal(mu, sigma, size=(nb_paths, nb_months)))
+
+
+def load_returns(filename, column, prices=False):
+    """
+    Read historical monthly data from a CSV file with a header line
+
+    :param str filename: CSV file, one line per month in chronological order
+    :param str column: name of the column to read
+    :param bool prices: [optional] If True, the column is an index level (or price), else monthly returns in
+                        percentage
+    :return: monthly returns as decimals
+    :rtype: ndarray
+    """
+
+    with open(filename, newline="", encoding="utf-8") as f:
+        values = [float(row[column]) for row in csv.DictReader(f) if row[column].strip()]
+
+    values = np.array(values)
+    if prices:
+        return values[1:] / values[:-1] - 1
+
+    return 0.01 * values
+
+
+def get_bootstrap_returns(rng, nb_paths, nb_months, returns, block_size=12):
+    """
+    Paths made of blocks of consecutive historical months, taken at random (circular block bootstrap)
+
+    :param numpy.random.Generator rng:
+    :param int nb_paths:
+    :param int nb_months:
+    :param ndarray returns: historical monthly returns as decimals (see load_returns)
+    :param int block_size: [optional] number of consecutive months of each block, 1 draws independent months
+    :return: monthly returns as decimals (nb_paths, nb_months)
+    :rtype: ndarray
+    """
+
+    returns = np.asarray(returns, dtype=float)
+    nb_blocks = -(-nb_months // block_size)
+
+    starts = rng.integers(0, returns.size, size=(nb_paths, nb_blocks, 1))
+    indices = (starts + np.arange(block_size)) % returns.size
+
+    return returns[indices.reshape(nb_paths, -1)[:, :nb_months]]
+
+
+RETURN_MODELS = {
+    "lognormal": get_lognormal_returns,
+    "bootstrap": get_bootstrap_returns,
+}
+
+
+def get_strategies(total, interest, early_repay=10, normal_repay=20):
+    """
+    :param float total: loan amount in euros
+    :param float interest: yearly interest of the loan in percentage
+    :param int early_repay: [optional] duration of the early repayment, in years
+    :param int normal_repay: [optional] duration of the loan, in years
+    :return: monthly contributions of each strategy, over normal_repay years
+    :rtype: dict(str, ndarray)
+    """
+
+    monthly_normal = get_monthly_payment(total, normal_repay * 12, interest)
+    monthly_early = get_monthly_payment(total, early_repay * 12, interest)
+
+    invest = np.full(normal_repay * 12, monthly_early - monthly_normal)
+    early = np.zeros(normal_repay * 12)
+    early[early_repay * 12:] = monthly_early
+
+    return {"invest": invest, "early": early}
+
+
+def get_final_wealth(returns, contributions):
+    """
+    :param ndarray returns: monthly returns as decimals (nb_paths, nb_months)
+    :param ndarray contributions: contribution at the start of each month, for each strategy (nb_strategies,
+                                  nb_months)
+    :return: wealth at the end of the last month (nb_paths, nb_strategies)
+    :rtype: ndarray
+    """
+
+    # Growth from the start of each month to the end: suffix products of 1 + r
+    growth = np.cumprod((1 + returns)[:, ::-1], axis=1)[:, ::-1]
+
+    return growth @ contributions.T
+
+
+def simulate_chunk(seed, nb_paths, contributions, model="lognormal", model_kwargs=None):
+    """
+    :param numpy.random.SeedSequence seed: seed of this chunk
+    :param int nb_paths:
+    :param ndarray contributions: (nb_strategies, nb_months)
+    :param str model: [optional] one of RETURN_MODELS
+    :param dict model_kwargs: [optional] parameters of the model
+    :return: final wealth (nb_paths, nb_strategies)
+    :rtype: ndarray
+    """
+
+    rng = np.random.default_rng(seed)
+    returns = RETURN_MODELS[model](rng, nb_paths, contributions.shape[1], **(model_kwargs or {}))
+
+    return get_final_wealth(returns, contributions)
+
+
+def simulate(strategies, nb_paths=1000000, model="lognormal", chunk_size=CHUNK_SIZE, workers=1, seed=0,
+             **model_kwargs):
+    """
+    :param dict strategies: monthly contributions of each strategy (see get_strategies), same number of months
+    :param int nb_paths: [optional] number of return paths
+    :param str model: [optional] one of RETURN_MODELS
+    :param int chunk_size: [optional] number of paths evaluated at once, memory is about 3 * 8 * chunk_size * months
+                           bytes per process
+    :param int workers: [optional] Number of processes. 1 (default) runs in this process, None use all CPUs
+    :param int seed: [optional] seed of the random generator
+    :param model_kwargs: parameters of the model (e.g. interest and volatility, or returns and block_size)
+    :return: final wealth of each strategy, one value per path
+    :rtype: dict(str, ndarray)
+    """
+
+    if model not in RETURN_MODELS:
+        raise ValueError(f"Unknown model '{model}' (available: {', '.join(RETURN_MODELS)})")
+
+    names = list(strategies)
+    contributions = np.array([strategies[name] for name in names], dtype=float)
+
+    sizes = [min(chunk_size, nb_paths - start) for start in range(0, nb_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([contributions] * len(sizes), [model] * len(sizes), [model_kwargs] * len(sizes))
+
+    if workers == 1:
+        chunks = list(map(simulate_chunk, seeds, sizes, *args))
+    else:
+        if workers is None:
+            workers = os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(simulate_chunk, seeds, sizes, *args))
+
+    wealth = np.concatenate(chunks)
+
+    return {name: wealth[:, idx] for (idx, name) in enumerate(names)}
+
+
+def get_summary(wealth, percentiles=PERCENTILES):
+    """
+    :param dict wealth: final wealth of each strategy, as returned by simulate
+    :param percentiles: [optional] percentiles of the bands
+    :type percentiles: tuple(float)
+    :return: for each strategy, its percentiles ("percentiles") and the probability that it ends with the most money
+             ("win_probability")
+    :rtype: dict
+    """
+
+    names = list(wealth)
+    values = np.stack([wealth[name] for name in names])
+    winners = np.argmax(values, axis=0)
+
+    summary = {}
+    for (idx, name) in enumerate(names):
+        summary[name] = {"percentiles": dict(zip(percentiles, np.percentile(values[idx], percentiles))),
+                         "win_probability": float(np.mean(winners == idx))}
+
+    return summary
+
+
+def print_summary(summary):
+    """
+    :param dict summary: as returned by get_summary
+    """
+
+    percentiles = list(next(iter(summary.values()))["percentiles"])
+    print(f"{'Strategy':10s} {'P(win)':>7s} " + " ".join(f"{f'p{p:g}':>10s}" for p in percentiles))
+    for (name, result) in summary.items():
+        print(f"{name:10s} {result['win_probability']:7.1%} "
+              + " ".join(f"{value:10.0f}" for value in result["percentiles"].values()))
+
+
+if __name__ == "__main__":
+    total = 160000  # euros
+    interest = 1.3187  # percent per year, average of the loans (see mortgage_vs_market.py)
+    early_repay = 10
+    normal_repay = 20
+
+    nb_paths = 1000000
+    workers = None  # Number of processes, None means all CPUs, 1 means serial
+    returns_file = None  # CSV file with historical monthly returns, to bootstrap them instead of log-normal returns
+    returns_column = "return"  # Column of the CSV file, monthly returns in percentage
+
+    strategies = get_strategies(total, interest, early_repay=early_repay, normal_repay=normal_repay)
+
+    if returns_file is None:
+        wealth = simulate(strategies, nb_paths=nb_paths, workers=workers, interest=7, volatility=15)
+    else:
+        wealth = simulate(strategies, nb_paths=nb_paths, workers=workers, model="bootstrap",
+                          returns=load_returns(returns_file, returns_column), block_size=12)
+
+    print(f"Sum at your disposal after {normal_repay} years, {nb_paths} market paths:")
+    print_summary(get_summary(wealth))
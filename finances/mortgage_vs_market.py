@@ -9,7 +9,6 @@ equivalent to one loan with
 """
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy import optimize
 
 
 def sample_function(func, x_bounds):
@@ -80,98 +79,210 @@ def get_average_interest(total, duration, payment):
     :return:
     """
 
-    def func(montly_interest):
-
-        return total * montly_interest * (1 + montly_interest) ** duration / \
-               ((1 + montly_interest) ** duration - 1) - payment
-
-    x0 = get_periodic_interest(15)
-    result = optimize.root_scalar(func, bracket=(1e-4, x0))
-
-    num_month = result.root
-    num_year = get_interest(num_month)
+    num_year = float(get_average_interests(total, duration, payment))
+    num_month = get_periodic_interest(num_year)
     print(f"Numerical solution: Average month interest rate = {num_month * 100:.4f}% ; "
           f"average year interest rate = {num_year:.4f}%")
 
     return num_year
 
 
-def get_interest_on_regular_investment(start, monthly_contribution, interest, duration):
+def _get_payment_error(total, duration, payment, montly_interest):
+    """
+    :return: monthly payment at this rate minus the payment, and its derivative with respect to the rate
+    :rtype: tuple(ndarray, ndarray)
+    """
+
+    # 1 - (1 + i)**-n, accurate for small rates
+    log_growth = np.log1p(montly_interest)
+    remaining = -np.expm1(-duration * log_growth)
+
+    # Close to 0, limit of the annuity and of its derivative
+    small = np.abs(montly_interest * duration) < 1e-8
+    safe_remaining = np.where(small, 1., remaining)
+
+    value = np.where(small, total / duration * (1 + montly_interest * (duration + 1) / 2),
+                     total * montly_interest / safe_remaining)
+    derivative = np.where(small, total * (duration + 1) / (2 * duration),
+                          total / safe_remaining - total * montly_interest * duration
+                          * np.exp(-(duration + 1) * log_growth) / safe_remaining ** 2)
+
+    return value - payment, derivative
+
+
+def get_average_interests(total, duration, payment, tol=1e-13, max_iter=100):
     """
+    Vectorized version of get_average_interest: solve for the rates of many loans at once, without printing.
+
+    Newton steps with the analytic derivative of the annuity, kept inside a bracket of the root that shrinks at each
+    iteration: steps that leave it are replaced by a bisection. The payment is an increasing function of the rate, so
+    this converges whenever the root is in the initial bracket, a monthly rate between -50% and payment / total.
+
+    :param total: in euros (NumPy arrays are broadcast)
+    :param duration: number of months
+    :param payment: monthly payment
+    :param float tol: [optional] tolerance on the monthly rate
+    :param int max_iter: [optional] maximum number of iterations
+    :return: yearly interest rate in percentage (negative if the payments don't cover the total), NaN if the monthly
+             rate is below -50% (payments far too small) or if the payment is not positive
+    :rtype: ndarray
+    """
+
+    (total, duration, payment) = np.broadcast_arrays(np.asarray(total, dtype=float),
+                                                     np.asarray(duration, dtype=float),
+                                                     np.asarray(payment, dtype=float))
+
+    if np.any(total <= 0):
+        raise ValueError("The total of the loans must be positive")
+    if np.any(duration <= 0):
+        raise ValueError("The duration must be at least one month")
+
+    # The payment at a monthly rate of payment / total is above the payment. At -1/2, it's usually below.
+    low = np.full(total.shape, -0.5)
+    high = np.maximum(payment / total, 1e-6)
+    # Loans whose payment is out of the bracket have no solution there
+    valid = ((_get_payment_error(total, duration, payment, low)[0] <= 0)
+             & (_get_payment_error(total, duration, payment, high)[0] >= 0))
+
+    # First order approximation around 0
+    rate = np.clip(2 * (payment - total / duration) / (total * (duration + 1) / duration), low, high)
+
+    for _ in range(max_iter):
+        (error, derivative) = _get_payment_error(total, duration, payment, rate)
+
+        low = np.where(error < 0, rate, low)
+        high = np.where(error > 0, rate, high)
+
+        newton = rate - error / np.where(derivative > 0, derivative, 1.)
+        inside = (derivative > 0) & (newton > low) & (newton < high)
+        new_rate = np.where(inside, newton, (low + high) / 2)
+        new_rate = np.where(error == 0, rate, new_rate)
+
+        converged = np.abs(new_rate - rate) <= tol * (1 + np.abs(rate))
+        rate = new_rate
+        if converged.all():
+            break
+
+    return get_interest(np.where(valid, rate, np.nan))
+
+
+def get_growth_sum(rate, periods):
+    """
+    Sum of the geometric series (1 + rate) + (1 + rate)**2 + ... + (1 + rate)**periods, i.e. what a contribution of 1
+    at the start of each period is worth at the end. Stays accurate for rates close to 0.
+
+    :param rate: rate per period as a decimal (NumPy arrays are broadcast)
+    :param periods: number of periods
+    :return: sum of the series
+    :rtype: ndarray
+    """
+
+    rate = np.asarray(rate, dtype=float)
+    periods = np.asarray(periods, dtype=float)
+
+    zero = rate == 0
+    safe_rate = np.where(zero, 1., rate)
+    series = np.expm1(periods * np.log1p(rate)) / safe_rate
+
+    return np.where(zero, periods, series * (1 + rate))
+
+
+def get_interest_on_regular_investment(start, monthly_contribution, interest, duration, monthly=False):
+    """
+    Value of an investment after some years, with a contribution every month.
+
+    Closed form of the geometric series, all parameters can be NumPy arrays and are broadcast together, so that a
+    whole grid of scenarios is a single call (e.g. interest[:, None] and duration[None, :] give a 2D table).
 
     :param float start: initial sum
     :param float monthly_contribution:
     :param float interest: interest rate in percentage per year
     :param int duration: Duration, in years, of this investment
-    :return:
+    :param bool monthly: [optional] By default, a year of contributions is added at the start of each year, then
+                         interests are paid at the end of the year. If True, each contribution is added at the start
+                         of its month, and interests are compounded monthly (same yearly rate).
+    :return: total at the end of the duration, a float if all parameters are scalars
+    :rtype: float or ndarray
     """
 
-    total = start
-    for i in range(duration):
-        total += (monthly_contribution * 12)
-        total *= 1 + interest/100
+    start = np.asarray(start, dtype=float)
+    monthly_contribution = np.asarray(monthly_contribution, dtype=float)
+    duration = np.asarray(duration, dtype=float)
+
+    if monthly:
+        rate = get_periodic_interest(np.asarray(interest, dtype=float))
+        periods = 12 * duration
+        contribution = monthly_contribution
+    else:
+        rate = 0.01 * np.asarray(interest, dtype=float)
+        periods = duration
+        contribution = 12 * monthly_contribution
+
+    total = start * (1 + rate) ** periods + contribution * get_growth_sum(rate, periods)
+
+    if total.ndim == 0:
+        return float(total)
 
     return total
 
-mortgage_total = 144000  # euros
-mortgage_interest = 1.45  # percent per year
 
-early_repay = 10
-normal_repay = 20
+if __name__ == "__main__":
+    mortgage_total = 144000  # euros
+    mortgage_interest = 1.45  # percent per year
+
+    early_repay = 10
+    normal_repay = 20
 
-# market_interest = 7  # percent per year
+    # market_interest = 7  # percent per year
 
-# Average for both loans
-total = 160000
-duration = 240
-payment = 758.230
+    # Average for both loans
+    total = 160000
+    duration = 240
+    payment = 758.230
 
 
-average_interest_rate = get_average_interest(total, duration, payment)
-print(f"Average interest rate: {average_interest_rate:.4f}%")
+    average_interest_rate = get_average_interest(total, duration, payment)
+    print(f"Average interest rate: {average_interest_rate:.4f}%")
 
-monthly_normal = get_monthly_payment(total, normal_repay*12, average_interest_rate)
-monthly_early = get_monthly_payment(total, early_repay*12, average_interest_rate)
-print(f"Repay your loan in {normal_repay} years with: {monthly_normal:.2f}€/month")
-print(f"Repay your loan in {early_repay} years with: {monthly_early:.2f}€/month")
+    monthly_normal = get_monthly_payment(total, normal_repay*12, average_interest_rate)
+    monthly_early = get_monthly_payment(total, early_repay*12, average_interest_rate)
+    print(f"Repay your loan in {normal_repay} years with: {monthly_normal:.2f}€/month")
+    print(f"Repay your loan in {early_repay} years with: {monthly_early:.2f}€/month")
 
-# Sum at your disposal each month if you pay your mortgage for 20 years rather than 10 years
-monthly_delta = monthly_early - monthly_normal
-print(f"Difference to invest each month: {monthly_delta:.2f}€")
+    # Sum at your disposal each month if you pay your mortgage for 20 years rather than 10 years
+    monthly_delta = monthly_early - monthly_normal
+    print(f"Difference to invest each month: {monthly_delta:.2f}€")
 
-# Check how the market return influence this balance
-market_interests = np.linspace(1, 10, 500)
-normal_benefits = []
-early_benefits = []
-for interest in market_interests:
-    normal_benefits.append(get_interest_on_regular_investment(0, monthly_delta, interest, normal_repay))
-    early_benefits.append(get_interest_on_regular_investment(0, monthly_early, interest, normal_repay - early_repay))
+    # Check how the market return influence this balance
+    market_interests = np.linspace(1, 10, 500)
+    normal_benefits = get_interest_on_regular_investment(0, monthly_delta, market_interests, normal_repay)
+    early_benefits = get_interest_on_regular_investment(0, monthly_early, market_interests, normal_repay - early_repay)
 
-fig, ax = plt.subplots(figsize=(10, 7.5))
-ax.plot(market_interests, normal_benefits, label=f"Invest leftovers for {normal_repay} years")
-ax.plot(market_interests, early_benefits, label=f"Pay loan in {early_repay} years, then invest for {normal_repay-early_repay} years")
-ax.set_xlabel("Average market interest rate [%]")
-ax.set_ylabel(f"Sum at your disposal after {normal_repay} years [€]")
-ax.legend()
-ax.xaxis.grid(True, which='minor', color='#000000', linestyle=':')
-ax.yaxis.grid(True, which='minor', color='#000000', linestyle=':')
-ax.xaxis.grid(True, which='major', color='#000000', linestyle='--')
-ax.yaxis.grid(True, which='major', color='#000000', linestyle='--')
-fig.suptitle(f"Loan for {normal_repay} years vs paid early in {early_repay} years.")
+    fig, ax = plt.subplots(figsize=(10, 7.5))
+    ax.plot(market_interests, normal_benefits, label=f"Invest leftovers for {normal_repay} years")
+    ax.plot(market_interests, early_benefits, label=f"Pay loan in {early_repay} years, then invest for {normal_repay-early_repay} years")
+    ax.set_xlabel("Average market interest rate [%]")
+    ax.set_ylabel(f"Sum at your disposal after {normal_repay} years [€]")
+    ax.legend()
+    ax.xaxis.grid(True, which='minor', color='#000000', linestyle=':')
+    ax.yaxis.grid(True, which='minor', color='#000000', linestyle=':')
+    ax.xaxis.grid(True, which='major', color='#000000', linestyle='--')
+    ax.yaxis.grid(True, which='major', color='#000000', linestyle='--')
+    fig.suptitle(f"Loan for {normal_repay} years vs paid early in {early_repay} years.")
 
-# normal_benefits = get_interest_on_regular_investment(monthly_delta, 7, 20)
-# fast_loan_benefits = get_interest_on_regular_investment(monthly_early, 7, 10)
-# print(f"Reimburse your loan normally, and invest the left for 20 years gets you : {normal_benefits:.2f} €")
-# print(f"Reimburse your loan early, then invest for 10 years gets you: {fast_loan_benefits:.2f} €")
+    # normal_benefits = get_interest_on_regular_investment(monthly_delta, 7, 20)
+    # fast_loan_benefits = get_interest_on_regular_investment(monthly_early, 7, 10)
+    # print(f"Reimburse your loan normally, and invest the left for 20 years gets you : {normal_benefits:.2f} €")
+    # print(f"Reimburse your loan early, then invest for 10 years gets you: {fast_loan_benefits:.2f} €")
 
-# Check if average interest is correct
-# print(get_monthly_payment(160000, mortgage_duration*12, 1.3187))
+    # Check if average interest is correct
+    # print(get_monthly_payment(160000, mortgage_duration*12, 1.3187))
 
-# compare taking a loan at CASDEN for 21500€ over 7 years then repaying 279.08€ per month for 7 years
-loan_benefits = get_interest_on_regular_investment(21500, 0, 7, 7) - 23472.26 + 21500
-normal_benefits = get_interest_on_regular_investment(0, 279.08, 7, 7)
+    # compare taking a loan at CASDEN for 21500€ over 7 years then repaying 279.08€ per month for 7 years
+    loan_benefits = get_interest_on_regular_investment(21500, 0, 7, 7) - 23472.26 + 21500
+    normal_benefits = get_interest_on_regular_investment(0, 279.08, 7, 7)
 
-print(f"If you take the 21500€ loan, you get after 7 years: {loan_benefits:.2f}€")
-print(f"If you invest normally 279.08€ for 7 years: {normal_benefits:.2f}€")
+    print(f"If you take the 21500€ loan, you get after 7 years: {loan_benefits:.2f}€")
+    print(f"If you invest normally 279.08€ for 7 years: {normal_benefits:.2f}€")
 
-plt.show()
+    plt.show()
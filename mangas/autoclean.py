@@ -0,0 +1,288 @@
+"""
+NumPy version of gimp-autoclean.py, without GIMP.
+
+Grayscale pages get the same treatment as gimp-autoclean.process():
+    1. gimp_levels_stretch: auto levels, the darkest and brightest 0.6% of the pixels are clipped
+    2. gimp_levels(drawable, 0, 20, 220, 1.0, 0, 255)
+    3. saved as JPEG, quality 0.85
+Both levels are 256 entries lookup tables, composed into one, so each page is transformed with a single indexing.
+Other pages are copied.
+
+Run with:
+python autoclean.py
+
+"""
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import imageio
+import numpy as np
+
+from outputs import FolderOutput
+import page_cache
+from library import get_pages, scan_library
+from preview import read_header
+from sources import read_image
+import timing
+
+# Prefix of the subdirectories we want to search into
+FOLDER_PREFIX = "Tome"
+
+# Fraction of pixels clipped on each side by the auto levels of GIMP (gimp_levels_config_stretch)
+STRETCH_CLIP = 0.006
+
+# Manual correction of levels, after the auto levels: (low_input, high_input, gamma, low_output, high_output)
+LEVELS = (20, 220, 1.0, 0, 255)
+
+JPEG_QUALITY = 85
+
+
+def get_stretch_levels(image, clip=STRETCH_CLIP):
+    """
+    Input levels chosen by the GIMP auto levels: for the low input, the first value such that more than
+    clip of the pixels are darker or equal, and likewise for the high input.
+
+    :param ndarray image: uint8 grayscale image
+    :param float clip: [optional] fraction of the pixels clipped on each side
+    :return: low_input, high_input
+    :rtype: tuple(int, int)
+    """
+
+    histogram = np.bincount(image.ravel(), minlength=256)
+    count = histogram.sum()
+    if count == 0:
+        return 0, 255
+
+    # Same loops as GIMP: low is i+1 for the first i where the fraction of pixels <= i+1 is above clip
+    cumulative = np.cumsum(histogram) / count
+    above = np.nonzero(cumulative[1:] > clip)[0]
+    low = int(above[0]) + 1 if above.size else 0
+
+    cumulative = np.cumsum(histogram[::-1]) / count
+    above = np.nonzero(cumulative[1:] > clip)[0]
+    high = 255 - (int(above[0]) + 1) if above.size else 255
+
+    return low, high
+
+
+def get_levels_lut(low_input, high_input, gamma=1.0, low_output=0, high_output=255):
+    """
+    Lookup table equivalent to gimp_levels on a 8 bits drawable
+
+    :param int low_input:
+    :param int high_input:
+    :param float gamma:
+    :param int low_output:
+    :param int high_output:
+    :return: 256 values, lut[old_value] = new_value
+    :rtype: ndarray(uint8)
+    """
+
+    values = np.arange(256) / 255.
+    low_input /= 255.
+    high_input /= 255.
+
+    if high_input != low_input:
+        values = (values - low_input) / (high_input - low_input)
+    else:
+        values = values - low_input
+    values = np.clip(values, 0, 1)
+
+    if gamma != 1.0:
+        values = values ** (1 / gamma)
+
+    values = low_output + values * (high_output - low_output)
+
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def get_autoclean_lut(image, levels=LEVELS, clip=STRETCH_CLIP):
+    """
+    Auto levels, then manual levels, composed into a single lookup table
+
+    :param ndarray image: uint8 grayscale image, used for the auto levels
+    :param tuple levels: [optional] (low_input, high_input, gamma, low_output, high_output) of the manual correction
+    :param float clip: [optional] fraction of the pixels clipped on each side by the auto levels
+    :return: 256 values, lut[old_value] = new_value
+    :rtype: ndarray(uint8)
+    """
+
+    stretch = get_levels_lut(*get_stretch_levels(image, clip=clip))
+
+    # Each GIMP operation writes back into the 8 bits image, hence the composition of the two uint8 tables
+    return get_levels_lut(*levels)[stretch]
+
+
+def autoclean(image, levels=LEVELS, clip=STRETCH_CLIP):
+    """
+    :param ndarray image: uint8 grayscale image
+    :param tuple levels: [optional] (low_input, high_input, gamma, low_output, high_output) of the manual correction
+    :param float clip: [optional] fraction of the pixels clipped on each side by the auto levels
+    :return: cleaned image
+    :rtype: ndarray(uint8)
+    """
+
+    return get_autoclean_lut(image, levels=levels, clip=clip)[image]
+
+
+def get_output_folder(infile, processed_dir="processed"):
+    """
+    Same structure as gimp-autoclean.py:
+    infile: path/lastdir/filename.png
+    outfile: path/processed/lastdir/filename.png
+
+    :param str infile: path to an image
+    :param str processed_dir: [optional] Directory that will contains all output file
+    :return: output folder
+    :rtype: str
+    """
+
+    full_path = os.path.dirname(infile)
+    base_path, parent_dir = os.path.split(full_path)
+
+    return os.path.join(base_path, processed_dir, parent_dir)
+
+
+def process(infile, processed_dir=None):
+    """
+    Auto clean the file given in parameter, then save it in another folder
+
+    :param str infile: path to an image
+    :param str processed_dir: [optional] Directory that will contains all output file (reproducing the same structure
+                              only 1st dir level)
+    :return: output file
+    :rtype: str
+    """
+
+    if processed_dir is None:
+        processed_dir = 'processed'
+
+    out_folder = get_output_folder(infile, processed_dir=processed_dir)
+    os.makedirs(out_folder, exist_ok=True)
+
+    (basename, ext) = os.path.splitext(os.path.basename(infile))
+
+    # Only autoclean images that are in grayscale
+    (width, height, mode, image_format) = read_header(infile)
+    output = FolderOutput(out_folder)
+    if mode == "L":
+        image = read_image(infile)
+
+        with timing.span("autoclean", page=infile):
+            image = autoclean(image)
+
+        name = basename + '.jpg'
+        output.write_image(name, image, quality=JPEG_QUALITY, optimize=True)
+    else:
+        name = os.path.basename(infile)
+        output.copy_file(name, infile)
+
+    return output.get_path(name)
+
+
+def get_input_files(directory):
+    """
+    :param str directory: Directory containing the volumes
+    :return: .jpg files of the subdirectories containing FOLDER_PREFIX, in natural order
+    :rtype: list(str)
+    """
+
+    index = scan_library(directory, volume_pattern=f".*{re.escape(FOLDER_PREFIX)}.*", extensions=(".jpg",),
+                         max_depth=1, archives=False)
+    pages = get_pages(index)
+    print(f"{len(pages)} pages in {len(index)} volumes")
+
+    return pages
+
+
+def run(directory, workers=None, processed_dir=None):
+    """
+    Process all .jpg files of the subdirectories starting with FOLDER_PREFIX
+
+    :param str directory: Directory containing the volumes
+    :param int workers: [optional] Number of processes. By default, use all CPUs. 1 means serial processing.
+    :param str processed_dir: [optional] Directory that will contains all output file
+    :return: output files
+    :rtype: list(str)
+    """
+
+    start = time.time()
+    print("Running on directory '%s'" % directory)
+    infiles = get_input_files(directory)
+
+    if workers == 1:
+        outfiles = [process(infile, processed_dir) for infile in infiles]
+    else:
+        if workers is None:
+            workers = os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers, **page_cache.get_pool_kwargs()) as executor:
+            outfiles = list(executor.map(process, infiles, [processed_dir] * len(infiles),
+                                         chunksize=max(1, len(infiles) // (4 * workers))))
+
+    end = time.time()
+    print("Finished %d files, total processing time: %.2f seconds" % (len(infiles), end - start))
+
+    return outfiles
+
+
+def compare_folders(reference_folder, folder, threshold=2):
+    """
+    Compare the images of two folders, e.g. the output of gimp-autoclean.py (reference) with the one of this module
+
+    :param str reference_folder: folder with the reference images
+    :param str folder: folder with the same image names
+    :param int threshold: [optional] pixels that differ by more than this value are counted
+    :return: per file statistics: filename, max absolute difference, mean absolute difference,
+             fraction of pixels above threshold
+    :rtype: list(tuple(str, int, float, float))
+    """
+
+    results = []
+    for reference_file in sorted(glob.glob(os.path.join(reference_folder, "*"))):
+        filename = os.path.join(folder, os.path.basename(reference_file))
+        if not os.path.isfile(filename):
+            print(f"{os.path.basename(reference_file)}: missing")
+            continue
+
+        reference = imageio.imread(reference_file).astype(np.int16)
+        image = imageio.imread(filename).astype(np.int16)
+        if reference.shape != image.shape:
+            print(f"{os.path.basename(reference_file)}: shape {image.shape} instead of {reference.shape}")
+            continue
+
+        diff = np.abs(reference - image)
+        results.append((os.path.basename(reference_file), int(diff.max()), float(diff.mean()),
+                        float(np.count_nonzero(diff > threshold) / diff.size)))
+
+    print(f"{'File':30s} {'max':>5s} {'mean':>7s} {f'>{threshold}':>8s}")
+    for (name, max_diff, mean_diff, fraction) in results:
+        print(f"{name:30s} {max_diff:5d} {mean_diff:7.3f} {fraction:8.2%}")
+
+    return results
+
+
+if __name__ == "__main__":
+    directory = "G:/Manga/Dragon_Ball_tmp"
+    workers = None  # Number of processes, None means all CPUs, 1 means serial
+    profile = False  # If True, print the time spent in each step and save a trace (see timing.py)
+    cache_folder = None  # If set, decoded pages are cached in this folder, to try other levels faster
+
+    if profile:
+        # Steps are only recorded in the current process
+        workers = 1
+        timing.enable()
+
+    if cache_folder is not None:
+        page_cache.enable(cache_folder)
+
+    run(directory, workers=workers)
+
+    if profile:
+        timing.print_summary()
+        timing.save_trace("autoclean_trace.json")
+
+    # To compare with GIMP, process a few pages with both, e.g.:
+    # compare_folders("G:/Manga/gimp/processed/Tome01", "G:/Manga/Dragon_Ball_tmp/processed/Tome01")
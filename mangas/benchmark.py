@@ -0,0 +1,586 @@
+"""
+Benchmark of the manga scripts on a synthetic corpus, to know if a change makes things faster or slower.
+
+The corpus is deterministic (same seed, same pages): volumes of single pages (1063 x 650) and double pages
+(1061 x 1292), in grayscale (2D), in gray stored as RGB (as many scans are) and in colour, written in PNG and
+in JPEG. It is generated once, then reused as long as its parameters don't change.
+
+Each stage runs in its own process, so that the peak RSS measured is the one of that stage only. For each stage:
+    - pages/s: input pages (files or decoded images) per second
+    - MB/s: input bytes per second, file size for stages that read files, array size for in-memory stages
+    - peak RSS (MiB) of the process, and the RSS after the setup of the stage (imports, decoded pages)
+    - output bytes, for the encoding stages (to compare the size of the files against encoding time)
+The best of several repeats is kept. Results are saved as JSON, compare two runs with compare_results.
+
+Run with:
+python benchmark.py
+
+"""
+import contextlib
+import datetime
+import glob
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import imageio
+import numpy as np
+
+from autoclean import autoclean
+from grayscale import is_grayscale, to_grayscale
+from jpg_to_grayscale import save_to_grayscale
+from outputs import encode_image
+import page_cache
+from pipeline import process_volume
+from preview import guess_grayscale
+from quantize import get_bits, quantize
+from sources import list_pages, read_image
+from split_doublepages import prepare_page, split_volume_pages
+
+# (height, width) of the pages of the scans
+SINGLE_PAGE = (1063, 650)
+DOUBLE_PAGE = (1061, 1292)
+
+CORPUS_PARAMS = {"seed": 0, "nb_volumes": 2, "nb_pages": 16, "formats": ["png", "jpg"], "jpeg_quality": 90}
+
+CORPUS_INFO = "corpus.json"
+
+# Page kinds, in the order they repeat in a volume (the first page is a colour cover)
+PAGE_KINDS = ("gray", "gray_rgb_double", "gray_rgb", "gray_double", "gray_rgb", "color_double", "gray", "color")
+
+
+def draw_page(rng, shape, color=False):
+    """
+    Synthetic manga page: paper with a little noise, panels with black borders, screentone and ink shapes
+
+    :param rng: numpy.random.Generator
+    :param tuple shape: (height, width)
+    :param bool color: [optional] If True, panels are tinted (height, width, 3), else (height, width)
+    :return: page
+    :rtype: ndarray(uint8)
+    """
+
+    (height, width) = shape
+    page = 235 + rng.integers(0, 12, size=shape, dtype=np.uint8)
+    tint = np.ones((height, width, 3), dtype=np.float32)
+
+    (y, x) = np.ogrid[:height, :width]
+    margin = 40
+    rows = np.linspace(margin, height - margin, rng.integers(3, 5) + 1).astype(int)
+    for (top, bottom) in zip(rows[:-1], rows[1:]):
+        columns = np.linspace(margin, width - margin, rng.integers(1, 3 if width < 1000 else 5) + 1).astype(int)
+        for (left, right) in zip(columns[:-1], columns[1:]):
+            (top_in, bottom_in, left_in, right_in) = (top + 6, bottom - 6, left + 6, right - 6)
+            panel = page[top_in:bottom_in, left_in:right_in]
+
+            # Screentone: regular dots on part of the panel
+            tone = rng.integers(0, panel.shape[0] // 2)
+            panel[tone::4, ::4] = 90
+
+            # Ink: a few filled ellipses
+            for _ in range(rng.integers(2, 6)):
+                cy = rng.integers(top_in, bottom_in)
+                cx = rng.integers(left_in, right_in)
+                (ry, rx) = rng.integers(10, 80, size=2)
+                inside = ((y - cy) / ry) ** 2 + ((x - cx) / rx) ** 2 <= 1
+                page[inside] = rng.integers(0, 60)
+
+            # Panel border
+            page[top_in:top_in + 3, left_in:right_in] = 0
+            page[bottom_in - 3:bottom_in, left_in:right_in] = 0
+            page[top_in:bottom_in, left_in:left_in + 3] = 0
+            page[top_in:bottom_in, right_in - 3:right_in] = 0
+
+            tint[top:bottom, left:right] = rng.uniform(0.6, 1, size=3)
+
+    if not color:
+        return page
+
+    return (page[..., np.newaxis] * tint).astype(np.uint8)
+
+
+def make_page(rng, kind):
+    """
+    :param rng: numpy.random.Generator
+    :param str kind: one of PAGE_KINDS, or 'cover'
+    :return: page
+    :rtype: ndarray(uint8)
+    """
+
+    shape = DOUBLE_PAGE if kind.endswith("double") else SINGLE_PAGE
+
+    if kind == "cover" or kind.startswith("color"):
+        return draw_page(rng, shape, color=True)
+
+    page = draw_page(rng, shape)
+    if kind.startswith("gray_rgb"):
+        page = np.stack([page] * 3, axis=2)
+
+    return page
+
+
+def make_corpus(folder, params=None):
+    """
+    Write the corpus, unless the folder already has one with the same parameters
+
+    Layout: folder/<format>/T<volume>/page_<page>.<format>
+
+    :param str folder:
+    :param dict params: [optional] see CORPUS_PARAMS
+    :return: corpus information (params, number of pages and bytes per format)
+    :rtype: dict
+    """
+
+    params = dict(CORPUS_PARAMS, **(params or {}))
+    info_file = os.path.join(folder, CORPUS_INFO)
+    if os.path.isfile(info_file):
+        with open(info_file, encoding="utf-8") as f:
+            info = json.load(f)
+        if info["params"] == params:
+            return info
+
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+
+    rng = np.random.default_rng(params["seed"])
+    info = {"params": params, "formats": {}}
+    for image_format in params["formats"]:
+        info["formats"][image_format] = {"pages": 0, "bytes": 0}
+
+    for volume_number in range(1, params["nb_volumes"] + 1):
+        for page_number in range(params["nb_pages"]):
+            kind = "cover" if page_number == 0 else PAGE_KINDS[(page_number - 1) % len(PAGE_KINDS)]
+            page = make_page(rng, kind)
+
+            # Same page in all formats
+            for image_format in params["formats"]:
+                volume_folder = os.path.join(folder, image_format, f"T{volume_number}")
+                os.makedirs(volume_folder, exist_ok=True)
+                filename = os.path.join(volume_folder, f"page_{page_number:03d}.{image_format}")
+
+                kwargs = {"quality": params["jpeg_quality"]} if image_format == "jpg" else {}
+                imageio.imwrite(filename, page, **kwargs)
+
+                info["formats"][image_format]["pages"] += 1
+                info["formats"][image_format]["bytes"] += os.path.getsize(filename)
+
+    with open(info_file, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+    return info
+
+
+def get_peak_rss():
+    """
+    :return: peak resident memory of the current process in MiB, None if unknown on this platform
+    :rtype: float
+    """
+
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def get_volumes(folder, image_format):
+    """
+    :param str folder: corpus folder
+    :param str image_format:
+    :return: pages of each volume of the corpus, in reading order
+    :rtype: list(list(str))
+    """
+
+    volumes = sorted(glob.glob(os.path.join(folder, image_format, "T*")))
+
+    return [list_pages(volume, extensions=(f".{image_format}",)) for volume in volumes]
+
+
+def get_files_size(files):
+    """
+    :param files: list of filenames
+    :return: total size in bytes
+    :rtype: int
+    """
+
+    return sum(os.path.getsize(f) for f in files)
+
+
+# Each stage is a function(volumes, work_folder) that does its setup and returns (run, reset, nb_pages, nb_bytes).
+# run() is timed, it may return the number of bytes written. reset() is called before each run, untimed
+# (None if not needed).
+
+def decode_stage(volumes, work_folder):
+    files = [f for volume in volumes for f in volume]
+
+    def run():
+        for filename in files:
+            read_image(filename)
+
+    return run, None, len(files), get_files_size(files)
+
+
+def decode_cached_stage(volumes, work_folder):
+    files = [f for volume in volumes for f in volume]
+
+    # Pages decoded once into the cache, then memory-mapped
+    page_cache.enable(os.path.join(work_folder, "cache"))
+    for filename in files:
+        read_image(filename)
+
+    def run():
+        for filename in files:
+            # Copied to actually read the pixels of the memory map
+            np.array(read_image(filename))
+
+    return run, None, len(files), get_files_size(files)
+
+
+def preview_stage(volumes, work_folder):
+    files = [f for volume in volumes for f in volume]
+
+    def run():
+        for filename in files:
+            guess_grayscale(filename)
+
+    return run, None, len(files), get_files_size(files)
+
+
+def is_grayscale_stage(volumes, work_folder):
+    images = [read_image(f) for volume in volumes for f in volume]
+
+    def run():
+        for image in images:
+            is_grayscale(image)
+
+    return run, None, len(images), sum(image.nbytes for image in images)
+
+
+def to_grayscale_stage(volumes, work_folder):
+    images = [read_image(f) for volume in volumes for f in volume]
+    images = [(image, is_grayscale(image)) for image in images if image.ndim == 3]
+
+    def run():
+        for (image, grayscale) in images:
+            to_grayscale(image, lossless=grayscale)
+
+    return run, None, len(images), sum(image.nbytes for (image, grayscale) in images)
+
+
+def autoclean_stage(volumes, work_folder):
+    images = [read_image(f) for volume in volumes for f in volume]
+    images = [image for image in images if image.ndim == 2]
+
+    def run():
+        for image in images:
+            autoclean(image)
+
+    return run, None, len(images), sum(image.nbytes for image in images)
+
+
+def _split_stage(volumes, work_folder, archive=False):
+    files = [f for volume in volumes for f in volume]
+    output_folder = os.path.join(work_folder, "split")
+
+    def reset():
+        if os.path.isdir(output_folder):
+            shutil.rmtree(output_folder)
+
+    def run():
+        for (volume_number, volume) in enumerate(volumes, 1):
+            split_volume_pages(volume, volume_number, os.path.join(output_folder, f"T{volume_number:02d}"),
+                               archive=archive)
+
+    return run, reset, len(files), get_files_size(files)
+
+
+def split_stage(volumes, work_folder):
+    return _split_stage(volumes, work_folder)
+
+
+def split_archive_stage(volumes, work_folder):
+    return _split_stage(volumes, work_folder, archive=True)
+
+
+def save_to_grayscale_stage(volumes, work_folder):
+    files = [f for volume in volumes for f in volume]
+    copies = [os.path.join(work_folder, "grayscale", f"{idx:04d}_{os.path.basename(f)}")
+              for (idx, f) in enumerate(files)]
+
+    def reset():
+        os.makedirs(os.path.join(work_folder, "grayscale"), exist_ok=True)
+        for (filename, copy) in zip(files, copies):
+            shutil.copyfile(filename, copy)
+
+    def run():
+        save_to_grayscale(copies, workers=1)
+
+    return run, reset, len(files), get_files_size(files)
+
+
+def pipeline_stage(volumes, work_folder):
+    files = [f for volume in volumes for f in volume]
+    output_folder = os.path.join(work_folder, "pipeline")
+
+    def reset():
+        if os.path.isdir(output_folder):
+            shutil.rmtree(output_folder)
+
+    def run():
+        for (volume_number, volume) in enumerate(volumes, 1):
+            process_volume(volume, volume_number, os.path.join(output_folder, f"T{volume_number:02d}"))
+
+    return run, reset, len(files), get_files_size(files)
+
+
+# PNG encoding settings of grayscale pages: (levels, dither, zlib compression level). None is 8 bits (256 levels).
+PNG_SETTINGS = [
+    (None, False, 1),
+    (None, False, 6),
+    (None, False, 9),
+    (16, False, 1),
+    (16, False, 6),
+    (16, False, 9),
+    (16, True, 9),
+    (4, False, 9),
+    (4, True, 9),
+]
+
+
+def get_png_stage(levels=None, dither=False, compress_level=6):
+    """
+    :param int levels: [optional] number of gray levels (16 or 4), None for 8 bits
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level
+    :return: stage that quantizes (if needed) then encodes the grayscale pages
+    """
+
+    kwargs = {"compress_level": compress_level}
+    if levels is not None:
+        kwargs["bits"] = get_bits(levels)
+
+    def png_stage(volumes, work_folder):
+        images = [prepare_page(read_image(f))[0] for volume in volumes for f in volume]
+        images = [image for image in images if image.ndim == 2]
+
+        def run():
+            nb_bytes = 0
+            for image in images:
+                if levels is not None:
+                    image = quantize(image, levels=levels, dither=dither)
+                nb_bytes += len(encode_image(image, "page.png", **kwargs))
+
+            return nb_bytes
+
+        return run, None, len(images), sum(image.nbytes for image in images)
+
+    return png_stage
+
+
+def get_png_stage_name(levels=None, dither=False, compress_level=6):
+    """
+    :return: name of the stage of a PNG setting, e.g. png_16_dither_z9
+    :rtype: str
+    """
+
+    return f"png_{levels or 256}{'_dither' if dither else ''}_z{compress_level}"
+
+
+STAGES = {
+    "decode": decode_stage,
+    "decode_cached": decode_cached_stage,
+    "preview": preview_stage,
+    "is_grayscale": is_grayscale_stage,
+    "to_grayscale": to_grayscale_stage,
+    "autoclean": autoclean_stage,
+    "split": split_stage,
+    "split_archive": split_archive_stage,
+    "save_to_grayscale": save_to_grayscale_stage,
+    "pipeline": pipeline_stage,
+}
+for (levels, dither, compress_level) in PNG_SETTINGS:
+    STAGES[get_png_stage_name(levels, dither, compress_level)] = get_png_stage(levels, dither, compress_level)
+
+
+def run_stage(name, corpus_folder, image_format, repeat=3):
+    """
+    Time one stage on one format of the corpus, in the current process
+
+    :param str name: one of STAGES
+    :param str corpus_folder:
+    :param str image_format: 'png' or 'jpg'
+    :param int repeat: [optional] number of runs, the best one is kept
+    :return: result of the stage
+    :rtype: dict
+    """
+
+    volumes = get_volumes(corpus_folder, image_format)
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as work_folder:
+        (run, reset, nb_pages, nb_bytes) = STAGES[name](volumes, work_folder)
+        setup_rss = get_peak_rss()
+
+        times = []
+        output_bytes = None
+        for _ in range(repeat):
+            if reset is not None:
+                reset()
+
+            # The scripts print their progress
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                output_bytes = run()
+                times.append(time.perf_counter() - start)
+
+    best = min(times)
+
+    return {
+        "stage": name,
+        "format": image_format,
+        "pages": nb_pages,
+        "bytes": nb_bytes,
+        "seconds": best,
+        "times": times,
+        "pages_per_s": nb_pages / best if best else None,
+        "mb_per_s": nb_bytes / 1e6 / best if best else None,
+        "peak_rss_mib": get_peak_rss(),
+        "setup_rss_mib": setup_rss,
+        "output_bytes": output_bytes,
+    }
+
+
+def _run_stage_in_child(queue, *args):
+    try:
+        queue.put(run_stage(*args))
+    except BaseException as e:
+        queue.put(e)
+        raise
+
+
+def benchmark(corpus_folder, stages=None, formats=None, repeat=3, output_file=None):
+    """
+    Run the stages on the corpus, each stage and format in a new process
+
+    :param str corpus_folder: Folder of the corpus, created if needed (see make_corpus)
+    :param stages: [optional] names of the stages to run, all of STAGES by default
+    :type stages: list(str)
+    :param formats: [optional] formats of the corpus to use, all by default
+    :type formats: list(str)
+    :param int repeat: [optional] number of runs of each stage, the best one is kept
+    :param str output_file: [optional] JSON file where results are saved
+    :return: results
+    :rtype: dict
+    """
+
+    if stages is None:
+        stages = list(STAGES)
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}' (available: {', '.join(STAGES)})")
+
+    corpus = make_corpus(corpus_folder)
+    if formats is None:
+        formats = corpus["params"]["formats"]
+
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "imageio": imageio.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus,
+        "results": [],
+    }
+
+    # A new interpreter per stage (spawn), so that the peak RSS is not the one of a previous stage
+    context = multiprocessing.get_context("spawn")
+
+    print(f"{'Stage':18s} {'format':6s} {'pages':>5s} {'pages/s':>8s} {'MB/s':>8s} {'peak RSS':>9s} {'output':>9s}")
+    for name in stages:
+        for image_format in formats:
+            queue = context.Queue()
+            process = context.Process(target=_run_stage_in_child,
+                                      args=(queue, name, corpus_folder, image_format, repeat))
+            process.start()
+            result = queue.get()
+            process.join()
+            if isinstance(result, BaseException):
+                raise result
+
+            results["results"].append(result)
+            rss = "" if result["peak_rss_mib"] is None else f"{result['peak_rss_mib']:6.0f} MiB"
+            size = "" if result["output_bytes"] is None else f"{result['output_bytes'] / 2**20:5.1f} MiB"
+            print(f"{name:18s} {image_format:6s} {result['pages']:5d} {result['pages_per_s']:8.2f} "
+                  f"{result['mb_per_s']:8.2f} {rss:>9s} {size:>9s}")
+
+    if output_file is not None:
+        folder = os.path.dirname(output_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved in {output_file}")
+
+    return results
+
+
+def compare_results(reference_file, filename):
+    """
+    Compare two benchmark runs (saved by benchmark)
+
+    :param str reference_file: JSON file of the reference run
+    :param str filename: JSON file of the new run
+    :return: per stage and format: speedup (reference time / new time) and ratio of peak RSS (new / reference)
+    :rtype: dict
+    """
+
+    runs = []
+    for name in (reference_file, filename):
+        with open(name, encoding="utf-8") as f:
+            runs.append({(r["stage"], r["format"]): r for r in json.load(f)["results"]})
+    (reference, new) = runs
+
+    comparison = {}
+    print(f"{'Stage':18s} {'format':6s} {'speedup':>8s} {'RSS':>6s}")
+    for key in reference:
+        if key not in new:
+            continue
+        speedup = reference[key]["seconds"] / new[key]["seconds"]
+        rss_ratio = None
+        if reference[key]["peak_rss_mib"] and new[key]["peak_rss_mib"]:
+            rss_ratio = new[key]["peak_rss_mib"] / reference[key]["peak_rss_mib"]
+        comparison[key] = (speedup, rss_ratio)
+
+        rss = "" if rss_ratio is None else f"{rss_ratio:6.2f}"
+        print(f"{key[0]:18s} {key[1]:6s} {speedup:8.2f} {rss:>6s}")
+
+    return comparison
+
+
+if __name__ == "__main__":
+    corpus_folder = os.path.join(tempfile.gettempdir(), "manga_benchmark_corpus")
+    results_folder = "benchmarks"
+    stages = None  # Names of the stages to run (see STAGES), None means all
+    repeat = 3  # Runs of each stage, the best one is kept
+
+    output_file = os.path.join(results_folder, f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    benchmark(corpus_folder, stages=stages, repeat=repeat, output_file=output_file)
+
+    # To compare with a previous run:
+    # compare_results("benchmarks/benchmark_20240101_120000.json", output_file)
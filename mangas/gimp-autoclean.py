@@ -17,9 +17,16 @@ HOW TO :
 NOTE : pygimp is the name of a bash script that contain:
 #!/bin/bash
 gimp -idf --batch-interpreter python-fu-eval -b "import sys; sys.path=['.']+sys.path;import ${1%.py};${1%.py}.run('.')" -b "pdb.gimp_quit(1)"
+
+NOTE : autoclean.py does the same processing with NumPy only, without GIMP.
+
+NOTE : gimp_batch.py runs several GIMP processes in parallel, each one calling run_shard() on a part of the files.
 """
 from __future__ import print_function
 
+import errno
+import io
+import json
 import os
 import glob
 import time
@@ -69,9 +76,13 @@ def process(infile, processed_dir=None):
     # We recreate the same structure in another folder in the parent dir of all volumes
     out_folder = os.path.join(base_path, processed_dir, parent_dir)
 
-    # We create a parent_dir in the output directory if it doesn't exist yet.
-    if not os.path.exists(out_folder):
+    # We create a parent_dir in the output directory if it doesn't exist yet. Another worker can create it at the
+    # same time (see gimp_batch.make_output_folders), and Python 2 has no exist_ok
+    try:
         os.makedirs(out_folder)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
 
     # Only autoclean images that are in grayscale
     if pdb.gimp_drawable_is_gray(drawable):
@@ -144,6 +155,34 @@ def run(directory):
     end = time.time()
     print("Finished, total processing time: %.2f seconds" % (end - start))
 
+def run_shard(shard_file, result_file, processed_dir=None):
+    """
+    Process the files listed in shard_file, in a single GIMP instance (see gimp_batch.py)
+
+    One JSON line is appended to result_file per file, as soon as it's done: {"file": infile, "error": None}, or
+    the error message if the file failed. The other files are still processed.
+
+    :param str shard_file: text file (UTF-8), one image path per line
+    :param str result_file: JSON Lines file where results are appended
+    :param str processed_dir: [optional] Directory that will contains all output file (see process)
+    """
+
+    with io.open(shard_file, encoding="utf-8") as f:
+        infiles = [line.rstrip("\n") for line in f if line.strip()]
+
+    with io.open(result_file, "a", encoding="utf-8") as results:
+        for infile in infiles:
+            try:
+                process(infile, processed_dir)
+                error = None
+            except Exception as e:
+                error = "%s: %s" % (type(e).__name__, e)
+
+            # Written right away, so that a crash of GIMP only loses the current file
+            results.write(u"%s\n" % json.dumps({"file": infile, "error": error}))
+            results.flush()
+
+
 if __name__ == "__main__":
     # print("Running as __main__ with args: %s" % sys.argv)
     run("G:/Manga/Dragon_Ball_tmp")
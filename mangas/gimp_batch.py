@@ -0,0 +1,230 @@
+"""
+Run gimp-autoclean.py on several cores: the files are split into shards, and each shard is processed by one
+long-lived GIMP batch process (one interpreter for all its files, instead of one GIMP per script invocation).
+
+Each worker calls gimp-autoclean.run_shard(), which uses the same process() as before and writes one result per
+file as soon as it's done. Once all workers exit, results are collected: files that raised an error, and files that
+were never reported (GIMP crashed or was killed) are returned as failures.
+
+With stub = True, workers are run with this Python interpreter and gimp_stub/gimpfu.py instead of GIMP, so that
+the driver can be checked without GIMP installed.
+
+Run with (Python 3, outside of GIMP):
+python gimp_batch.py
+
+"""
+import heapq
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from autoclean import get_input_files
+
+GIMP = "gimp-console-2.10"
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STUB_FOLDER = os.path.join(SCRIPT_FOLDER, "gimp_stub")
+
+
+def get_shards(filenames, nb_shards):
+    """
+    Split files into shards of about the same total size (largest files first, each one into the smallest shard)
+
+    :param filenames: list of filenames
+    :type filenames: list(str)
+    :param int nb_shards:
+    :return: shards, files in their original order inside each shard. Empty shards are removed.
+    :rtype: list(list(str))
+    """
+
+    order = {filename: idx for (idx, filename) in enumerate(filenames)}
+    sizes = sorted(((os.path.getsize(f), f) for f in filenames), key=lambda item: (-item[0], order[item[1]]))
+
+    # (total size, shard index)
+    heap = [(0, idx) for idx in range(nb_shards)]
+    shards = [[] for _ in range(nb_shards)]
+    for (size, filename) in sizes:
+        (total, idx) = heapq.heappop(heap)
+        shards[idx].append(filename)
+        heapq.heappush(heap, (total + size, idx))
+
+    return [sorted(shard, key=order.get) for shard in shards if shard]
+
+
+def make_output_folders(filenames, processed_dir=None):
+    """
+    Create the output folder of each file (see gimp-autoclean.process) before the workers start: workers processing
+    pages of the same volume at the same time would race to create it
+
+    :param filenames: images to process
+    :type filenames: list(str)
+    :param str processed_dir: [optional] Directory that will contains all output file (see gimp-autoclean.process)
+    """
+
+    if processed_dir is None:
+        processed_dir = "processed"
+
+    folders = set()
+    for filename in filenames:
+        (base_path, parent_dir) = os.path.split(os.path.dirname(filename))
+        folders.add(os.path.join(base_path, processed_dir, parent_dir))
+
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+
+def get_command(shard_file, result_file, processed_dir=None, gimp=GIMP, stub=False):
+    """
+    :param str shard_file: text file with one image path per line
+    :param str result_file: JSON Lines file where the worker writes its results
+    :param str processed_dir: [optional] Directory that will contains all output file (see gimp-autoclean.process)
+    :param str gimp: [optional] GIMP console executable
+    :param bool stub: [optional] If True, run with this Python interpreter and the gimpfu stub instead of GIMP
+    :return: command line of a worker
+    :rtype: list(str)
+    """
+
+    # The module name has a dash, hence __import__
+    code = (f"import sys; sys.path = [{SCRIPT_FOLDER!r}] + sys.path; "
+            f"__import__('gimp-autoclean').run_shard({shard_file!r}, {result_file!r}, {processed_dir!r})")
+
+    if stub:
+        return [sys.executable, "-c", code]
+
+    return [gimp, "-idf", "--batch-interpreter", "python-fu-eval", "-b", code, "-b", "pdb.gimp_quit(1)"]
+
+
+def read_results(result_file):
+    """
+    :param str result_file: JSON Lines file written by gimp-autoclean.run_shard
+    :return: error of each file reported (None if it succeeded)
+    :rtype: dict
+    """
+
+    results = {}
+    if not os.path.isfile(result_file):
+        return results
+
+    with open(result_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a worker that was killed
+                continue
+            results[result["file"]] = result["error"]
+
+    return results
+
+
+def run_workers(filenames, workers=None, processed_dir=None, gimp=GIMP, stub=False, timeout=None):
+    """
+    Process files with several GIMP workers, one shard of files each
+
+    :param filenames: images to process
+    :type filenames: list(str)
+    :param int workers: [optional] Number of GIMP processes. By default, use all CPUs.
+    :param str processed_dir: [optional] Directory that will contains all output file (see gimp-autoclean.process)
+    :param str gimp: [optional] GIMP console executable
+    :param bool stub: [optional] If True, run with this Python interpreter and the gimpfu stub instead of GIMP
+    :param float timeout: [optional] Time (s) after which the remaining workers are killed
+    :return: files processed, and the error of each file that failed
+    :rtype: tuple(list(str), dict)
+    """
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    shards = get_shards(filenames, workers)
+    make_output_folders(filenames, processed_dir=processed_dir)
+
+    env = dict(os.environ)
+    if stub:
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (STUB_FOLDER, SCRIPT_FOLDER, env.get("PYTHONPATH")) if p)
+
+    processed = []
+    failures = {}
+    with tempfile.TemporaryDirectory(prefix="gimp_batch_") as tmp_folder:
+        processes = []
+        for (idx, shard) in enumerate(shards):
+            shard_file = os.path.join(tmp_folder, f"shard_{idx:03d}.txt")
+            result_file = os.path.join(tmp_folder, f"shard_{idx:03d}.jsonl")
+            log_file = os.path.join(tmp_folder, f"shard_{idx:03d}.log")
+            with open(shard_file, "w", encoding="utf-8") as f:
+                f.write("".join(f"{filename}\n" for filename in shard))
+
+            with open(log_file, "w", encoding="utf-8") as log:
+                process = subprocess.Popen(get_command(shard_file, result_file, processed_dir=processed_dir,
+                                                       gimp=gimp, stub=stub),
+                                           stdout=log, stderr=subprocess.STDOUT, env=env)
+            processes.append((process, shard, result_file, log_file))
+
+        print(f"Started {len(processes)} workers for {len(filenames)} files")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for (process, shard, result_file, log_file) in processes:
+            try:
+                returncode = process.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                returncode = process.wait()
+
+            results = read_results(result_file)
+            for filename in shard:
+                if filename not in results:
+                    failures[filename] = f"not processed, worker exited with code {returncode}"
+                elif results[filename] is not None:
+                    failures[filename] = results[filename]
+                else:
+                    processed.append(filename)
+
+            if any(filename in failures for filename in shard):
+                with open(log_file, encoding="utf-8", errors="replace") as f:
+                    log = f.read().splitlines()
+                print(f"Worker {process.pid} (exit code {returncode}), last lines of its output:")
+                print("\n".join(log[-10:]))
+
+    return processed, failures
+
+
+def run(directory, workers=None, processed_dir=None, gimp=GIMP, stub=False, timeout=None):
+    """
+    Process all .jpg files of the subdirectories starting with FOLDER_PREFIX (see autoclean.get_input_files)
+
+    :param str directory: Directory containing the volumes
+    :param int workers: [optional] Number of GIMP processes. By default, use all CPUs.
+    :param str processed_dir: [optional] Directory that will contains all output file
+    :param str gimp: [optional] GIMP console executable
+    :param bool stub: [optional] If True, run with this Python interpreter and the gimpfu stub instead of GIMP
+    :param float timeout: [optional] Time (s) after which the remaining workers are killed
+    :return: files processed, and the error of each file that failed
+    :rtype: tuple(list(str), dict)
+    """
+
+    start = time.time()
+    print("Running on directory '%s'" % directory)
+    infiles = get_input_files(directory)
+
+    (processed, failures) = run_workers(infiles, workers=workers, processed_dir=processed_dir, gimp=gimp, stub=stub,
+                                        timeout=timeout)
+
+    for (filename, error) in sorted(failures.items()):
+        print(f"Failed: {filename}: {error}")
+
+    end = time.time()
+    print("Finished %d files (%d failed), total processing time: %.2f seconds"
+          % (len(processed), len(failures), end - start))
+
+    return processed, failures
+
+
+if __name__ == "__main__":
+    directory = "G:/Manga/Dragon_Ball_tmp"
+    workers = None  # Number of GIMP processes, None means all CPUs
+    gimp = "E:/GIMP 2/bin/gimp-console-2.10.exe"
+    stub = False  # If True, don't use GIMP but gimp_stub/gimpfu.py, to check this script
+
+    run(directory, workers=workers, gimp=gimp, stub=stub)
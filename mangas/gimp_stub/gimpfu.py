@@ -0,0 +1,78 @@
+"""
+Stand-in for the gimpfu module of GIMP, with only what gimp-autoclean.py uses, done with NumPy (see autoclean.py).
+
+It's meant to run gimp-autoclean.py and gimp_batch.py without GIMP installed, e.g. to check the batch driver:
+python gimp_batch.py, with stub = True. Outputs are close to those of GIMP, not identical.
+
+"""
+import sys
+
+import imageio
+import numpy as np
+from PIL import Image
+
+from autoclean import get_levels_lut, get_stretch_levels
+
+__all__ = ["pdb", "EXPAND_AS_NECESSARY", "CLIP_TO_IMAGE", "CLIP_TO_BOTTOM_LAYER"]
+
+EXPAND_AS_NECESSARY = 0
+CLIP_TO_IMAGE = 1
+CLIP_TO_BOTTOM_LAYER = 2
+
+
+class StubImage:
+    """
+    Image with a single layer, that is also its drawable
+    """
+
+    def __init__(self, filename):
+        with Image.open(filename) as im:
+            self.mode = im.mode
+        self.pixels = imageio.imread(filename)
+        self.filename = filename
+
+
+class StubPdb:
+    """
+    Procedures of the GIMP database used by gimp-autoclean.py
+    """
+
+    @staticmethod
+    def gimp_file_load(filename, raw_filename):
+        return StubImage(filename)
+
+    @staticmethod
+    def gimp_image_get_active_layer(image):
+        return image
+
+    @staticmethod
+    def gimp_drawable_is_gray(drawable):
+        return drawable.mode == "L"
+
+    @staticmethod
+    def gimp_levels_stretch(drawable):
+        drawable.pixels = get_levels_lut(*get_stretch_levels(drawable.pixels))[drawable.pixels]
+
+    @staticmethod
+    def gimp_levels(drawable, channel, low_input, high_input, gamma, low_output, high_output):
+        drawable.pixels = get_levels_lut(low_input, high_input, gamma, low_output, high_output)[drawable.pixels]
+
+    @staticmethod
+    def gimp_image_merge_visible_layers(image, merge_type):
+        return image
+
+    @staticmethod
+    def file_jpeg_save(image, drawable, filename, raw_filename, quality, smoothing, optimize, *args):
+        imageio.imwrite(filename, np.asarray(drawable.pixels), format="JPEG-PIL",
+                        quality=int(round(float(quality) * 100)), optimize=bool(optimize))
+
+    @staticmethod
+    def gimp_image_delete(image):
+        image.pixels = None
+
+    @staticmethod
+    def gimp_quit(force):
+        sys.exit(0)
+
+
+pdb = StubPdb()
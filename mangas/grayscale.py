@@ -0,0 +1,97 @@
+"""
+Grayscale detection and conversion shared by the manga scripts.
+
+Both functions work on blocks of rows so that they never allocate a temporary as large as the page
+(np.diff and mean(axis=2) used to create full size int and float64 copies for each page).
+
+"""
+import numpy as np
+
+# Number of rows processed at once. 64 rows of a 1292 px wide RGB page is ~250 kB
+CHUNK_ROWS = 64
+
+
+def is_grayscale(image, tolerance=0, chunk_rows=CHUNK_ROWS):
+    """
+    If RGB, will test if this can safely be saved into grayscale without loss
+
+    Channels are compared block by block, and the test stops at the first block with a difference.
+
+    :param ndarray image:
+    :param int tolerance: [optional] Maximum difference allowed between channels of a pixel. 0 (default) means
+                          lossless, a few units accept the chroma noise of JPEG files.
+    :param int chunk_rows: [optional] Number of rows compared at once
+    :return: if the image can be saved as grayscale or not
+    :rtype: bool
+    """
+
+    if image.ndim == 2:
+        return True
+
+    (height, width, nb_channels) = image.shape
+    if nb_channels == 1:
+        return True
+
+    if tolerance:
+        # Signed buffer for the differences, reused for all blocks
+        buffer = np.empty((min(chunk_rows, height), width), dtype=np.int16)
+
+    for row in range(0, height, chunk_rows):
+        block = image[row:row + chunk_rows]
+        reference = block[:, :, 0]
+        for channel in range(1, nb_channels):
+            other = block[:, :, channel]
+            if not tolerance:
+                if not np.array_equal(reference, other):
+                    return False
+            else:
+                diff = buffer[:block.shape[0]]
+                np.subtract(reference, other, out=diff, dtype=np.int16)
+                np.abs(diff, out=diff)
+                if diff.max() > tolerance:
+                    return False
+
+    return True
+
+
+def to_grayscale(image, lossless=False, chunk_rows=CHUNK_ROWS):
+    """
+    Collapse the channels of an image into a (height, width) image.
+
+    The result is the mean of the channels, rounded down, i.e. the same as im.mean(axis=2).astype("uint8"),
+    but computed in integers, block by block.
+
+    :param ndarray image: uint8 image (any type if lossless)
+    :param bool lossless: [optional] If True, the caller knows all channels are equal (see is_grayscale),
+                          the first channel is simply copied.
+    :param int chunk_rows: [optional] Number of rows converted at once
+    :return: grayscale image
+    :rtype: ndarray
+    """
+
+    if image.ndim == 2:
+        return image
+
+    (height, width, nb_channels) = image.shape
+
+    if lossless or nb_channels == 1:
+        return np.ascontiguousarray(image[:, :, 0])
+
+    if image.dtype != np.uint8:
+        raise ValueError(f"Only uint8 images can be averaged (got {image.dtype})")
+
+    gray = np.empty((height, width), dtype=np.uint8)
+    # uint16 is enough to sum the channels of uint8 images
+    buffer = np.empty((min(chunk_rows, height), width), dtype=np.uint16)
+
+    for row in range(0, height, chunk_rows):
+        block = image[row:row + chunk_rows]
+        total = buffer[:block.shape[0]]
+        # Channel by channel is much faster than a sum over the last (contiguous) axis
+        np.add(block[:, :, 0], block[:, :, 1], out=total, dtype=np.uint16)
+        for channel in range(2, nb_channels):
+            np.add(total, block[:, :, channel], out=total)
+        total //= nb_channels
+        gray[row:row + block.shape[0]] = total
+
+    return gray
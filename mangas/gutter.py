@@ -0,0 +1,114 @@
+"""
+Detection of the gutter (the transition between the two pages) of a double page scan.
+
+The page is downsampled, then each column is summarised by its variance: the gutter is a band of columns
+with almost uniform intensity (white margin, or the shadow of the binding), so the gutter is searched as the
+band of minimum variance near the centre of the image.
+
+"""
+import numpy as np
+
+# Ratio between the width and the height of a single page (JapFlap scantrad ratio ; old: 0.6857142857142857)
+PAGE_RATIO = 0.68518518518
+
+# Minimum confidence for the detected gutter to be used
+MIN_CONFIDENCE = 0.5
+
+
+def get_column_variance(image, step=4):
+    """
+    Variance of each column of a downsampled version of the image
+
+    :param ndarray image: grayscale image (height, width)
+    :param int step: [optional] downsampling factor, in both directions
+    :return: variance of each column of the downsampled image, width // step values (approximately)
+    :rtype: ndarray
+    """
+
+    # Strided view, only the selected pixels are converted to float
+    small = image[::step, ::step].astype(np.float32)
+
+    return small.var(axis=0)
+
+
+def find_gutter(image, search=0.15, band=8, step=4):
+    """
+    Find the column where a double page should be split
+
+    The confidence compares the variance in the gutter band with the typical (median) variance of the
+    columns of the page: 1 for a perfectly uniform band on a busy page, 0 if the band is as busy as the page.
+
+    :param ndarray image: grayscale image (height, width)
+    :param float search: [optional] Half-width of the search window around the centre, as a fraction of the width
+    :param int band: [optional] Width of the gutter band, in pixels of the full image
+    :param int step: [optional] downsampling factor, in both directions
+    :return: column of the gutter in the full image, confidence between 0 and 1
+    :rtype: tuple(int, float)
+    """
+
+    width = image.shape[1]
+    variance = get_column_variance(image, step=step)
+    nb_columns = variance.size
+
+    # Mean variance over a sliding band, from the cumulative sum to stay O(width)
+    band = max(1, min(band // step, nb_columns))
+    cumsum = np.concatenate(([0.], np.cumsum(variance, dtype=np.float64)))
+    band_variance = (cumsum[band:] - cumsum[:-band]) / band
+
+    # Only look near the centre. band_variance[i] is the band starting at column i
+    centre = nb_columns / 2
+    first = max(0, int(centre - search * nb_columns - band / 2))
+    last = min(band_variance.size, int(centre + search * nb_columns - band / 2) + 1)
+    if first >= last:
+        return width // 2, 0.
+
+    window = band_variance[first:last]
+    idx = int(np.argmin(window))
+
+    # A wide gutter gives several equivalent minima, take the middle of the run
+    is_minimum = window <= window[idx] * (1 + 1e-6)
+    end = idx
+    while end + 1 < window.size and is_minimum[end + 1]:
+        end += 1
+    idx = first + (idx + end) // 2
+
+    reference = np.median(variance)
+    if reference <= 0:
+        # Uniform image, no way to tell where the gutter is
+        return width // 2, 0.
+
+    confidence = float(np.clip(1 - band_variance[idx] / reference, 0, 1))
+
+    # Middle of the band, in columns of the full image
+    column = int(round((idx + band / 2) * step))
+
+    return min(max(column, 1), width - 1), confidence
+
+
+def get_split_columns(image, detect=True, min_confidence=MIN_CONFIDENCE, ratio=PAGE_RATIO, step=4):
+    """
+    Columns delimiting the two pages of a double page: the left page is image[:, :left_end],
+    the right page is image[:, right_start:].
+
+    Without detection (or with a low confidence), each page is as wide as height * ratio, from the edges of the
+    image (the two pages can overlap).
+
+    :param ndarray image: grayscale image (height, width)
+    :param bool detect: [optional] If False, always use the ratio
+    :param float min_confidence: [optional] Below this confidence, the ratio is used
+    :param float ratio: [optional] Ratio between the width and the height of a single page
+    :param int step: [optional] downsampling factor of the gutter detection (see find_gutter)
+    :return: left_end, right_start
+    :rtype: tuple(int, int)
+    """
+
+    (height, width) = image.shape[:2]
+
+    if detect:
+        (column, confidence) = find_gutter(image, step=step)
+        if confidence >= min_confidence:
+            return column, column
+
+    new_width = int(height * ratio)
+
+    return new_width, width - new_width
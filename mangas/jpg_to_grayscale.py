@@ -3,89 +3,325 @@ Script to open scans that have 2 pages, and will split them into single pages, u
 of the transition between one page and the other
 
 """
-import imageio
 import os
-import glob
-import numpy as np
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
+from grayscale import is_grayscale, to_grayscale
+from library import get_pages, scan_library
+from manifest import Manifest
+from outputs import encode_image
+from preview import read_header, read_jpeg_components
+from sources import ArchivePage, close_archive, get_size_mtime, list_archive_pages, read_image
+import timing
 
-def is_grayscale(image):
+# PIL modes that imageio reads as (height, width) arrays
+_2D_MODES = ("1", "L", "I", "I;16", "F")
+
+
+def needs_conversion(filename):
     """
-    If RGB, will test if this can safely be saved into grayscale without loss
+    Test from the header only if an image is not already in grayscale (height, width).
+
+    For JPEG files, this is the number of components in the Start Of Frame segment, without decoding anything.
 
-    :param ndarray image:
-    :return: if the image can be saved as grayscale or not
+    :param filename: path or sources.ArchivePage
+    :return: True if the image has several channels
     :rtype: bool
     """
 
-    if image.ndim == 2:
-        return True
-    else:
-        # All diffs must be 0 for the image to be grayscale
-        diff = np.diff(image, axis=2)
-        return not np.any(diff)
+    components = read_jpeg_components(filename)
+    if components is not None:
+        return components != 1
+
+    (width, height, mode, image_format) = read_header(filename)
+
+    return mode not in _2D_MODES
 
 
-def save_to_grayscale(filenames, overwrite=True):
+def write_atomic(filename, im):
     """
+    Save an image through a temporary file in the same folder, then rename it, so that the original file is never
+    lost, even if the script is interrupted.
 
-    :param filenames: list of filenames
-    :type filenames: list(str)
-    :param int volume_number:
-    :param str output_folder:
-    :param bool japan_read: If True, the first page of the double page will be the one on the right
-    :param bool overwrite: By default, any existing image will be overwritten
-    :return:
+    :param str filename: output file, replaced if it exists
+    :param ndarray im: image
     """
 
-    nb_files = len(filenames)
-    idx = 0
-    for filename in filenames:
-        idx += 1
-        # print(f"Process {filename}")
-        # print(f"\rProcessing page {filename}      ", end="\n")
-        im = imageio.imread(filename)
+    # The extension gives the format
+    data = encode_image(im, filename)
+
+    (root, ext) = os.path.splitext(filename)
+    (fd, tmp_file) = tempfile.mkstemp(suffix=ext, prefix=os.path.basename(root) + ".",
+                                      dir=os.path.dirname(filename) or ".")
+
+    try:
+        with timing.span("write", page=filename):
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        timing.add_bytes("written", len(data))
+
+        if os.path.isfile(filename):
+            shutil.copymode(filename, tmp_file)
+        os.replace(tmp_file, filename)
+    except BaseException:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def convert_to_grayscale(filename):
+    """
+    Rewrite an image in grayscale (height, width), if it's not already
+
+    :param str filename:
+    :return: True if the file was converted
+    :rtype: bool
+    """
+
+    # Already gray files are not decoded
+    if not needs_conversion(filename):
+        return False
+
+    im = read_grayscale(filename)
+    if im is None:
+        return False
+
+    write_atomic(filename, im)
 
+    return True
+
+
+def read_grayscale(filename):
+    """
+    :param filename: path or sources.ArchivePage
+    :return: image in grayscale (height, width), None if the decoded image is already 2D
+    :rtype: ndarray
+    """
+
+    im = read_image(filename)
+
+    with timing.span("grayscale_test", page=filename):
         grayscale = is_grayscale(im)
 
-        # Convert into greyscale (height, width)
-        # if grayscale and im.ndim == 3:
-        if im.ndim == 3:
-            print(f"Conversion of {filename} ({idx}/{nb_files})")
-            im = im.mean(axis=2).astype("uint8")
-            os.remove(filename)
-            imageio.imsave(filename, im)
+    # Convert into greyscale (height, width)
+    # if grayscale and im.ndim == 3:
+    if im.ndim != 3:
+        return None
+
+    with timing.span("conversion", page=filename):
+        return to_grayscale(im, lossless=grayscale)
+
+
+def convert_archive_to_grayscale(archive, names=None):
+    """
+    Rewrite the members of a .cbz/.zip archive in grayscale. The archive is written into a temporary file in the same
+    folder then renamed, and only if at least one member was converted. Other members are copied as is.
+
+    :param str archive: path of the archive
+    :param names: [optional] members to convert, by default all the images of the archive
+    :type names: list(str)
+    :return: for each name, True if the member was converted
+    :rtype: list(bool)
+    """
+
+    if names is None:
+        names = [page.name for page in list_archive_pages(archive)]
+
+    # Members are decoded from memory, the archive is only rewritten at the end
+    images = {}
+    for name in names:
+        page = ArchivePage(archive, name)
+        if needs_conversion(page):
+            im = read_grayscale(page)
+            if im is not None:
+                images[name] = encode_image(im, name)
+
+    if images:
+        (root, ext) = os.path.splitext(archive)
+        (fd, tmp_file) = tempfile.mkstemp(suffix=ext, prefix=os.path.basename(root) + ".",
+                                          dir=os.path.dirname(archive) or ".")
+        os.close(fd)
+
+        try:
+            with timing.span("write", page=archive), \
+                    zipfile.ZipFile(archive) as source, zipfile.ZipFile(tmp_file, "w") as destination:
+                # Same members, in the same order, with the same dates and compression
+                for info in source.infolist():
+                    new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    new_info.compress_type = info.compress_type
+                    new_info.external_attr = info.external_attr
+                    if info.filename in images:
+                        destination.writestr(new_info, images[info.filename])
+                    else:
+                        destination.writestr(new_info, source.read(info))
+            timing.add_bytes("written", os.path.getsize(tmp_file))
+            shutil.copymode(archive, tmp_file)
+            close_archive(archive)
+            os.replace(tmp_file, archive)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    return [name in images for name in names]
+
+
+def convert_task(task):
+    """
+    :param task: a filename, or (archive, member names)
+    :type task: str or tuple(str, list(str))
+    :return: for each file of the task, True if it was converted
+    :rtype: list(bool)
+    """
+
+    if isinstance(task, str):
+        return [convert_to_grayscale(task)]
+
+    return convert_archive_to_grayscale(*task)
+
+
+def get_tasks(filenames):
+    """
+    Group the pages of the same archive, so that each archive is rewritten only once
+
+    :param filenames: files and archive pages
+    :type filenames: list(str or sources.ArchivePage)
+    :return: tasks (see convert_task) and, for each task, its files
+    :rtype: tuple(list, list(list))
+    """
+
+    tasks = []
+    files = []
+    archives = {}
+    for filename in filenames:
+        if isinstance(filename, ArchivePage):
+            if filename.archive not in archives:
+                archives[filename.archive] = len(tasks)
+                tasks.append((filename.archive, []))
+                files.append([])
+            idx = archives[filename.archive]
+            tasks[idx][1].append(filename.name)
+            files[idx].append(filename)
         else:
-            continue
-
-    #     # Force conversion to uint8 because the mean transform it into float
-    #     # For an unknown reason, adding dtype into the mean mess things up
-    #     im = im.astype("uint8")
-    #
-    #
-    #     out_file = os.path.join(output_folder, f"T{volume_number:02d}_page_{page_number:03d}.png")
-    #     # https://imageio.readthedocs.io/en/stable/format_png-pil.html
-    #
-    #     if os.path.isfile(out_file) and overwrite:
-    #         os.remove(out_file)
-    #
-    #     imageio.imsave(out_file, im)
-    #     page_number += 1
-    #
-    # print(f"\rFinished writting {page_number-1} pages.                       ")
-
-japan_read = False  # If false, first page is the left one, else it's the right one
-input_folder = "G:/Manga/Dragon Ball Z"
-output_folder = "G:/Manga/Dragon_Ball_tmp"
-
-# for volume_number in range(1, 43):
-# print(f"Processing Volume {volume_number:02d}")
-files = glob.glob(os.path.join(input_folder, f"**", "*.jpg"))
-
-# Get rid of all first pages
-files = [f for f in files if "-000" not in f]
-
-save_to_grayscale(files)
+            tasks.append(filename)
+            files.append([filename])
+
+    return tasks, files
+
+
+def save_to_grayscale(filenames, manifest_folder=None, workers=1, dry_run=False, exclude=None):
+    """
+
+    :param filenames: list of filenames. Pages of a .cbz/.zip archive (see sources.list_pages) are converted
+                      inside the archive, which is rewritten once.
+    :type filenames: list(str or sources.ArchivePage)
+    :param str manifest_folder: [optional] If given, files are recorded in a manifest in this folder, and files
+                                already processed (and not modified since) are skipped on the next run.
+    :param int workers: [optional] Number of processes. 1 (default) converts files one after the other,
+                        None use all CPUs
+    :param bool dry_run: [optional] If True, nothing is written, only count the files (from their header) that
+                         would be converted
+    :param exclude: [optional] files whose path contains one of these strings are ignored (e.g. '-000' for the
+                    first pages)
+    :type exclude: list(str)
+    :return: number of files converted (or to convert) and their total size in bytes before conversion
+    :rtype: tuple(int, int)
+    """
+
+    manifest = None
+    if manifest_folder is not None:
+        manifest = Manifest(manifest_folder, params={"operation": "grayscale"})
+
+    if exclude:
+        filenames = [f for f in filenames if not any(pattern in str(f) for pattern in exclude)]
+
+    nb_files = len(filenames)
+    nb_converted = 0
+    nb_bytes = 0
+    try:
+        todo = [f for f in filenames if manifest is None or manifest.get(f) is None]
+
+        if dry_run:
+            for filename in todo:
+                if needs_conversion(filename):
+                    nb_converted += 1
+                    nb_bytes += get_size_mtime(filename)[0]
+
+            print(f"Dry run: {nb_converted}/{nb_files} files would be converted "
+                  f"({nb_bytes / 2**20:.1f} MiB rewritten), {nb_files - len(todo)} already done.")
+            return nb_converted, nb_bytes
+
+        sizes = {f: get_size_mtime(f)[0] for f in todo}
+        (tasks, task_files) = get_tasks(todo)
+        # The archives were opened (and cached) here to read their sizes. They are rewritten by the workers, and an
+        # archive still open in this process can't be replaced on Windows
+        for task in tasks:
+            if not isinstance(task, str):
+                close_archive(task[0])
+
+        if workers == 1:
+            results = map(convert_task, tasks)
+            executor = None
+        else:
+            if workers is None:
+                workers = os.cpu_count()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(convert_task, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+
+        try:
+            idx = 0
+            for (files, converted_files) in zip(task_files, results):
+                for (filename, converted) in zip(files, converted_files):
+                    idx += 1
+                    # print(f"Process {filename}")
+                    # print(f"\rProcessing page {filename}      ", end="\n")
+                    if converted:
+                        print(f"Conversion of {filename} ({idx}/{len(todo)})")
+                        nb_converted += 1
+                        nb_bytes += sizes[filename]
+
+                    if manifest is not None:
+                        # For an archive, the output is the archive itself
+                        output = filename.archive if isinstance(filename, ArchivePage) else filename
+                        manifest.record(filename, [output])
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    print(f"Converted {nb_converted}/{nb_files} files ({nb_bytes / 2**20:.1f} MiB before conversion).")
+
+    return nb_converted, nb_bytes
+
+
+if __name__ == "__main__":
+    japan_read = False  # If false, first page is the left one, else it's the right one
+    input_folder = "G:/Manga/Dragon Ball Z"
+    output_folder = "G:/Manga/Dragon_Ball_tmp"
+    state_folder = "G:/Manga/jpg_to_grayscale_state"  # Manifest of the converted files, kept out of the library
+    workers = None  # Number of processes, None means all CPUs, 1 means serial
+    dry_run = False  # If True, only report what would be converted
+    profile = False  # If True, print the time spent in each step and save a trace (see timing.py)
+
+    if profile:
+        # Steps are only recorded in the current process
+        workers = 1
+        timing.enable()
+
+    # All .jpg pages of the library. Volumes stored as archives are converted in place too.
+    # Get rid of all first pages
+    files = get_pages(scan_library(input_folder, extensions=(".jpg",), exclude=["*-000*"]))
+
+    save_to_grayscale(files, manifest_folder=state_folder, workers=workers, dry_run=dry_run)
+
+    if profile:
+        timing.print_summary()
+        timing.save_trace("jpg_to_grayscale_trace.json")
 
 # Double page: (1061, 1292)
 # single page: (1063, 650)
\ No newline at end of file
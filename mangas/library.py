@@ -0,0 +1,239 @@
+"""
+Index of a manga library: volumes (folders or .cbz/.zip archives) and their pages, found in a single walk.
+
+The library is walked once with os.scandir, whose entries already know if they are files or folders, instead of a
+glob per volume and a stat per file. Volumes are found by a pattern on their name (e.g. T12 or T12.cbz), pages are
+sorted in natural order (page_9 before page_10), and include/exclude rules (glob patterns on the path relative to
+the library) select the pages.
+
+The index can be saved in a JSON file. It's reused as long as the folders and archives it was built from are
+unchanged: a folder modification time changes when a file is added, removed or renamed in it, so checking the index
+takes one stat per folder and archive, not one per page.
+
+Usage:
+    index = scan_library("G:/Manga/Dragon Ball", volume_pattern=r"T(\\d+)", extensions=(".png",), max_depth=1)
+    for (name, pages) in index.items():
+        split_volume_pages(pages, get_volume_number(name, r"T(\\d+)"), ...)
+
+"""
+import fnmatch
+import json
+import os
+import re
+import tempfile
+
+from sources import ARCHIVE_EXTENSIONS, IMAGE_EXTENSIONS, ArchivePage, list_archive_pages, natural_sort_key
+
+# Version of the format of the index file
+INDEX_VERSION = 1
+
+
+def is_selected(path, include=None, exclude=None):
+    """
+    :param str path: path relative to the library, with '/' separators
+    :param include: [optional] glob patterns (fnmatch), the path must match one of them. All paths by default.
+    :type include: list(str)
+    :param exclude: [optional] glob patterns, the path must match none of them
+    :type exclude: list(str)
+    :return: True if the path is selected by the rules
+    :rtype: bool
+    """
+
+    if include and not any(fnmatch.fnmatch(path, pattern) for pattern in include):
+        return False
+
+    return not (exclude and any(fnmatch.fnmatch(path, pattern) for pattern in exclude))
+
+
+def get_volume_number(name, volume_pattern):
+    """
+    :param str name: name of the volume in the index (see scan_library)
+    :param str volume_pattern: regular expression used to find the volumes, its first group is the number
+    :return: volume number
+    :rtype: int
+    """
+
+    (stem, ext) = os.path.splitext(os.path.basename(name))
+    if ext.lower() not in ARCHIVE_EXTENSIONS:
+        stem = os.path.basename(name)
+
+    match = re.fullmatch(volume_pattern, stem)
+    if match is None or not match.groups():
+        raise ValueError(f"No volume number in '{name}' for the pattern '{volume_pattern}'")
+
+    return int(match.group(1))
+
+
+def _join(folder, name):
+    return name if folder == "." else f"{folder}/{name}"
+
+
+def _walk(root, volume_pattern=None, extensions=IMAGE_EXTENSIONS, include=None, exclude=None, max_depth=None,
+          archives=True):
+    """
+    Walk the library once
+
+    :return: index (volume name: relative paths of the pages, or [archive, member] for archive pages), and the
+             modification time of each folder and archive read
+    :rtype: tuple(dict, dict)
+    """
+
+    volumes = {}
+    stamps = {}
+
+    def is_volume(name):
+        return volume_pattern is None or re.fullmatch(volume_pattern, name) is not None
+
+    # (path relative to the root, depth)
+    folders = [(".", 0)]
+    while folders:
+        (folder, depth) = folders.pop()
+        path = os.path.join(root, folder)
+        stamps[folder] = os.stat(path).st_mtime_ns
+
+        pages = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                relpath = _join(folder, entry.name)
+                if entry.is_dir():
+                    if (max_depth is None or depth < max_depth) and is_selected(relpath, exclude=exclude):
+                        folders.append((relpath, depth + 1))
+                elif not entry.is_file():
+                    continue
+                elif entry.name.lower().endswith(extensions):
+                    if is_volume(os.path.basename(folder)) and is_selected(relpath, include, exclude):
+                        pages.append(relpath)
+                elif archives and entry.name.lower().endswith(ARCHIVE_EXTENSIONS):
+                    if (max_depth is None or depth < max_depth) and is_volume(os.path.splitext(entry.name)[0]):
+                        stat = entry.stat()
+                        stamps[relpath] = [stat.st_size, stat.st_mtime_ns]
+                        members = [[relpath, page.name] for page in
+                                   list_archive_pages(entry.path, extensions=extensions)
+                                   if is_selected(f"{relpath}/{page.name}", include, exclude)]
+                        if members:
+                            volumes[relpath] = members
+
+        # The root is only a volume if no pattern is given
+        if pages and (folder != "." or volume_pattern is None):
+            volumes[folder] = sorted(pages, key=natural_sort_key)
+
+    return {name: volumes[name] for name in sorted(volumes, key=natural_sort_key)}, stamps
+
+
+def _is_unchanged(root, stamps):
+    """
+    :param str root: library folder
+    :param dict stamps: modification time of the folders and archives, as returned by _walk
+    :return: True if none of them changed
+    :rtype: bool
+    """
+
+    for (relpath, stamp) in stamps.items():
+        try:
+            stat = os.stat(os.path.join(root, relpath))
+        except FileNotFoundError:
+            return False
+
+        if isinstance(stamp, list):
+            if [stat.st_size, stat.st_mtime_ns] != stamp:
+                return False
+        elif stat.st_mtime_ns != stamp:
+            return False
+
+    return True
+
+
+def _load_index(index_file, params):
+    """
+    :return: cached index and stamps, None if there is no index file for these parameters
+    :rtype: dict
+    """
+
+    try:
+        with open(index_file, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cache.get("version") != INDEX_VERSION or cache.get("params") != params:
+        return None
+
+    return cache
+
+
+def _save_index(index_file, cache):
+    folder = os.path.dirname(os.path.abspath(index_file))
+    os.makedirs(folder, exist_ok=True)
+
+    # Written under another name then renamed, a concurrent run never reads a partial index
+    (fd, tmp_file) = tempfile.mkstemp(suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, index_file)
+    except BaseException:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def scan_library(root, volume_pattern=None, extensions=IMAGE_EXTENSIONS, include=None, exclude=None,
+                 max_depth=None, archives=True, index_file=None):
+    """
+    Find the volumes of a library and their pages
+
+    :param str root: library folder
+    :param str volume_pattern: [optional] regular expression that the whole name of a volume folder (or archive,
+                               without extension) must match, e.g. r"T(\\d+)". By default, every folder with pages
+                               and every archive is a volume.
+    :param extensions: [optional] extensions of the pages (case insensitive)
+    :type extensions: tuple(str)
+    :param include: [optional] glob patterns on the path of the pages relative to root (with '/' separators, archive
+                    pages are 'T1.cbz/page_001.png'), only matching pages are kept
+    :type include: list(str)
+    :param exclude: [optional] glob patterns on the path of the pages, matching pages are removed. Matching
+                    folders are not walked into (e.g. "processed").
+    :type exclude: list(str)
+    :param int max_depth: [optional] Maximum depth of the volumes below root (1: only its subfolders and archives)
+    :param bool archives: [optional] If False, archives are ignored
+    :param str index_file: [optional] JSON file where the index is saved, and reused while the library is unchanged.
+                           Keep it out of the library, or writing it would change the library.
+    :return: volume name (path relative to root, '.' for the root itself): pages in natural order, volumes in
+             natural order of their name
+    :rtype: dict(str, list(str or sources.ArchivePage))
+    """
+
+    params = {"volume_pattern": volume_pattern, "extensions": [ext.lower() for ext in extensions],
+              "include": include, "exclude": exclude, "max_depth": max_depth, "archives": archives,
+              "root": os.path.abspath(root)}
+    params = json.loads(json.dumps(params))
+
+    cache = None
+    if index_file is not None:
+        cache = _load_index(index_file, params)
+        if cache is not None and not _is_unchanged(root, cache["stamps"]):
+            cache = None
+
+    if cache is None:
+        (volumes, stamps) = _walk(root, volume_pattern=volume_pattern, extensions=extensions, include=include,
+                                  exclude=exclude, max_depth=max_depth, archives=archives)
+        cache = {"version": INDEX_VERSION, "params": params, "stamps": stamps, "volumes": volumes}
+        if index_file is not None:
+            _save_index(index_file, cache)
+
+    index = {}
+    for (name, pages) in cache["volumes"].items():
+        index[name] = [ArchivePage(os.path.join(root, page[0]), page[1]) if isinstance(page, list)
+                       else os.path.join(root, page) for page in pages]
+
+    return index
+
+
+def get_pages(index):
+    """
+    :param dict index: as returned by scan_library
+    :return: pages of all volumes, in order
+    :rtype: list(str or sources.ArchivePage)
+    """
+
+    return [page for pages in index.values() for page in pages]
@@ -0,0 +1,203 @@
+"""
+Manifest of the pages already processed, so that a rerun only process the pages that changed.
+
+The manifest is a JSON Lines file in the output folder: one JSON object per input file, appended as soon as
+its outputs are written, so that an interrupted run resumes where it stopped. When loading, the last line
+of each input wins. The file is compacted when the manifest is closed.
+
+Each entry records the input path (absolute), size, modification time and content hash, the processing parameters
+and the outputs produced (relative to the output folder).
+
+When an input is processed again, the outputs of its previous entry that are no longer written by any input (e.g. the
+last page of a volume, after a double page became a single page) are deleted when the manifest is closed.
+
+"""
+import hashlib
+import json
+import os
+import threading
+
+from sources import get_size_mtime, open_binary
+
+MANIFEST_NAME = ".manifest.jsonl"
+
+
+def get_key(filename):
+    """
+    :param filename: path or sources.ArchivePage
+    :return: key of the file in the manifest, the same whatever the working directory
+    :rtype: str
+    """
+
+    return os.path.abspath(str(filename))
+
+
+def get_file_hash(filename):
+    """
+    :param filename: path or sources.ArchivePage
+    :return: hexadecimal BLAKE2 hash of the content of the file
+    :rtype: str
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open_binary(filename) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_file_signature(filename):
+    """
+    :param filename: path or sources.ArchivePage
+    :return: size, modification time (ns) and hash of the file
+    :rtype: dict
+    """
+
+    (size, mtime) = get_size_mtime(filename)
+
+    return {"size": size, "mtime": mtime, "hash": get_file_hash(filename)}
+
+
+class Manifest:
+    """
+    Record of the inputs already processed into a folder
+
+    Can be used as a context manager. record() is thread safe.
+    """
+
+    def __init__(self, folder, params=None):
+        """
+        :param str folder: Output folder, where the manifest is stored
+        :param dict params: [optional] Processing parameters. Entries recorded with other parameters are ignored.
+                            Must be JSON serializable.
+        """
+
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        # Normalise through JSON so that e.g. tuples compare equal to the lists read from the file
+        self.params = json.loads(json.dumps(params or {}, sort_keys=True))
+        self.entries = {}
+        # Outputs of the entries replaced during this run, deleted on close if nothing writes them anymore
+        self._replaced_outputs = set()
+        self._lock = threading.Lock()
+        self._file = None
+
+        self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of an interrupted run
+                    continue
+                self.entries[entry["input"]] = entry
+
+    def get(self, filename):
+        """
+        Entry of a file, if it was already processed with the same parameters, its content did not change and all
+        its outputs still exist
+
+        :param filename: input file (path or sources.ArchivePage)
+        :return: entry (keys: input, size, mtime, hash, params, outputs, page_number) or None
+        :rtype: dict
+        """
+
+        entry = self.entries.get(get_key(filename))
+        if entry is None or entry["params"] != self.params:
+            return None
+
+        try:
+            (size, mtime) = get_size_mtime(filename)
+        except (OSError, KeyError):
+            # Missing file, or missing archive member
+            return None
+
+        if size != entry["size"]:
+            return None
+
+        for output in entry["outputs"]:
+            if not os.path.isfile(os.path.join(self.folder, output)):
+                return None
+
+        if mtime != entry["mtime"]:
+            # Same size, touched or copied, only the content can tell
+            if get_file_hash(filename) != entry["hash"]:
+                return None
+
+            # Same content, the new modification time is recorded so that it's not hashed again next time
+            entry = dict(entry, mtime=mtime)
+            self._write(entry)
+
+        return entry
+
+    def record(self, filename, outputs, page_number=None):
+        """
+        Record that a file was processed. Must be called once all outputs are written.
+
+        :param filename: input file (path or sources.ArchivePage)
+        :param outputs: output files (paths, or relative to the output folder)
+        :type outputs: list(str)
+        :param int page_number: [optional] number of the first output page, when it depends on the previous files
+        """
+
+        entry = {"input": get_key(filename)}
+        entry.update(get_file_signature(filename))
+        entry["params"] = self.params
+        entry["outputs"] = [os.path.relpath(output, self.folder) for output in outputs]
+        entry["page_number"] = page_number
+
+        self._write(entry)
+
+    def _write(self, entry):
+        line = json.dumps(entry) + "\n"
+
+        with self._lock:
+            previous = self.entries.get(entry["input"])
+            if previous is not None:
+                self._replaced_outputs.update(set(previous["outputs"]) - set(entry["outputs"]))
+
+            self.entries[entry["input"]] = entry
+            if self._file is None:
+                os.makedirs(self.folder, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            # Flushed at each entry so that an interrupted run can resume from there
+            self._file.flush()
+
+    def close(self):
+        """
+        Close the manifest, rewriting it with only the latest entry of each input, and delete the outputs that were
+        replaced during this run and that no input writes anymore
+        """
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.close()
+            self._file = None
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+
+            written = {output for entry in self.entries.values() for output in entry["outputs"]}
+            for output in self._replaced_outputs - written:
+                path = os.path.join(self.folder, output)
+                if os.path.isfile(path):
+                    os.remove(path)
+            self._replaced_outputs.clear()
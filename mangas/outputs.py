@@ -0,0 +1,246 @@
+"""
+Where the pages of a volume are written: loose files in a folder, or a single .cbz (ZIP) archive.
+
+Writing one archive per volume is much faster than creating thousands of small files on network or
+FAT/exFAT drives. Pages are encoded in memory and streamed into the archive, without temporary files.
+PNG and JPEG are already compressed, so pages are stored by default.
+
+Both outputs have the same methods, and can be used as context managers. Their write methods are thread safe.
+Pages written by several threads arrive in any order; give their index in the volume to keep the archive in
+reading order (some readers don't sort the pages by name).
+
+"""
+import os
+import threading
+import zipfile
+
+import imageio
+
+from quantize import encode_png_gray
+import timing
+from sources import read_bytes
+
+COMPRESSIONS = {
+    "store": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+
+def encode_image(image, name, **kwargs):
+    """
+    Encode an image in memory
+
+    :param ndarray image:
+    :param str name: filename, its extension gives the format
+    :param kwargs: passed to imageio (e.g. quality for JPEG, compress_level for PNG). For PNG, bits (1, 2 or 4)
+                   writes grayscale images with that many bits per pixel (see quantize.py), other images ignore it.
+    :return: encoded image
+    :rtype: bytes
+    """
+
+    image_format = os.path.splitext(name)[1][1:].lower()
+    bits = kwargs.pop("bits", None)
+
+    with timing.span("encode", page=name):
+        if bits is not None and image_format == "png" and image.ndim == 2:
+            return encode_png_gray(image, bits, compress_level=kwargs.get("compress_level"))
+
+        return imageio.imwrite("<bytes>", image, format=image_format, **kwargs)
+
+
+class FolderOutput:
+    """
+    Pages written as files in a folder
+    """
+
+    def __init__(self, folder, overwrite=True):
+        """
+        :param str folder: created if it doesn't exist
+        :param bool overwrite: By default, any existing image will be overwritten
+        """
+
+        self.folder = folder
+        self.overwrite = overwrite
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_path(self, name):
+        """
+        :param str name: page filename
+        :return: path of the page
+        :rtype: str
+        """
+
+        return os.path.join(self.folder, name)
+
+    def _prepare(self, name):
+        out_file = self.get_path(name)
+        if os.path.isfile(out_file) and self.overwrite:
+            os.remove(out_file)
+
+        return out_file
+
+    def write_image(self, name, image, index=None, **kwargs):
+        """
+        :param str name: page filename, its extension gives the format
+        :param ndarray image:
+        :param int index: [optional] unused, see CbzOutput
+        :param kwargs: passed to imageio
+        """
+
+        # https://imageio.readthedocs.io/en/stable/format_png-pil.html
+        # Encoded in memory first, same bytes as imageio.imsave, to measure encoding and writing apart
+        self.write_bytes(name, encode_image(image, name, **kwargs))
+
+    def write_bytes(self, name, data, index=None):
+        """
+        :param str name: page filename
+        :param bytes data: encoded page
+        :param int index: [optional] unused, see CbzOutput
+        """
+
+        with timing.span("write", page=name):
+            with open(self._prepare(name), "wb") as f:
+                f.write(data)
+
+        timing.add_bytes("written", len(data))
+
+    def copy_file(self, name, filename, index=None):
+        """
+        :param str name: page filename
+        :param filename: file copied as is (path or sources.ArchivePage)
+        :param int index: [optional] unused, see CbzOutput
+        """
+
+        self.write_bytes(name, read_bytes(filename))
+
+    def close(self):
+        pass
+
+
+class CbzOutput:
+    """
+    Pages written in a .cbz (ZIP) archive, replaced if it exists
+    """
+
+    def __init__(self, filename, compression="store", compresslevel=None):
+        """
+        :param str filename: archive filename
+        :param str compression: [optional] one of COMPRESSIONS. store (default) is best for PNG and JPEG
+        :param int compresslevel: [optional] for deflate (0-9) and bzip2 (1-9)
+        """
+
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}' (available: {', '.join(COMPRESSIONS)})")
+
+        self.filename = filename
+
+        folder = os.path.dirname(filename)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        self._archive = zipfile.ZipFile(filename, "w", compression=COMPRESSIONS[compression],
+                                        compresslevel=compresslevel)
+        self._lock = threading.Lock()
+
+        # Pages that arrived before the previous ones, by index
+        self._pending = {}
+        self._next_index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+        # Don't leave a partial archive that looks complete
+        if exc_type is not None and os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def get_path(self, name):
+        """
+        :param str name: page filename
+        :return: path of the page, inside the archive
+        :rtype: str
+        """
+
+        return f"{self.filename}/{name}"
+
+    def write_image(self, name, image, index=None, **kwargs):
+        """
+        :param str name: page filename, its extension gives the format
+        :param ndarray image:
+        :param int index: [optional] index of the page (0, 1, ...), pages are added to the archive in this order
+        :param kwargs: passed to imageio
+        """
+
+        # Encoding is done outside of the lock, so that several threads can encode at the same time
+        self.write_bytes(name, encode_image(image, name, **kwargs), index=index)
+
+    def write_bytes(self, name, data, index=None):
+        """
+        :param str name: page filename
+        :param bytes data: encoded page
+        :param int index: [optional] index of the page (0, 1, ...), pages are added to the archive in this order.
+                          Without index, the page is added right away.
+        """
+
+        timing.add_bytes("written", len(data))
+
+        with self._lock:
+            if index is None:
+                self._writestr(name, data)
+                return
+
+            self._pending[index] = (name, data)
+            while self._next_index in self._pending:
+                self._writestr(*self._pending.pop(self._next_index))
+                self._next_index += 1
+
+    def _writestr(self, name, data):
+        with timing.span("write", page=name):
+            self._archive.writestr(name, data)
+
+    def copy_file(self, name, filename, index=None):
+        """
+        :param str name: page filename
+        :param filename: file copied as is (path or sources.ArchivePage)
+        :param int index: [optional] index of the page (see write_bytes)
+        """
+
+        self.write_bytes(name, read_bytes(filename), index=index)
+
+    def close(self):
+        with self._lock:
+            # Pages after a missing index
+            for index in sorted(self._pending):
+                self._writestr(*self._pending.pop(index))
+
+            self._archive.close()
+
+
+def open_output(output_folder, archive=False, overwrite=True, compression="store", compresslevel=None):
+    """
+    :param str output_folder: Folder of the volume. For an archive, the archive is output_folder + '.cbz'
+    :param bool archive: [optional] If True, write a .cbz archive instead of a folder
+    :param bool overwrite: [optional] Folder only, by default any existing image will be overwritten
+    :param str compression: [optional] Archive only, one of COMPRESSIONS
+    :param int compresslevel: [optional] Archive only, compression level
+    :return: output
+    :rtype: FolderOutput or CbzOutput
+    """
+
+    if archive:
+        return CbzOutput(os.path.normpath(output_folder) + ".cbz", compression=compression,
+                         compresslevel=compresslevel)
+    else:
+        return FolderOutput(output_folder, overwrite=overwrite)
@@ -0,0 +1,226 @@
+"""
+Cache of decoded pages, to try other parameters (split ratio, levels, tolerance...) without decoding the JPEG/PNG
+files again.
+
+Pages are stored as raw uint8 .npy files and memory-mapped when read back, so a cached page is read at the speed
+of the OS page cache, and only the parts used are loaded. Entries are keyed by the input path, size and
+modification time (see sources.read_image), a modified file is decoded again.
+
+The total size is capped: least recently used entries are removed first (each read updates the modification time
+of the entry). The size is tracked per process, and the folder is scanned again when the cap seems reached, so
+several processes can share a cache.
+
+Usage:
+    page_cache.enable("G:/Manga/cache", max_size=8 * 2**30)
+    split_volume_pages(...)  # sources.read_image now goes through the cache
+
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import timing
+
+# Default size cap, in bytes
+MAX_SIZE = 4 * 2**30
+
+EXTENSION = ".npy"
+
+_cache = None
+
+
+class PageCache:
+    """
+    Decoded pages stored as .npy files in a folder
+    """
+
+    def __init__(self, folder, max_size=MAX_SIZE):
+        """
+        :param str folder: created if it doesn't exist
+        :param int max_size: [optional] maximum total size of the entries, in bytes
+        """
+
+        self.folder = folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        # The cap may have been lowered since the last run
+        self._size = self.evict()
+
+    def get_path(self, key):
+        """
+        :param str key: identifies the decoded page (e.g. path, size and modification time of the file)
+        :return: path of the entry
+        :rtype: str
+        """
+
+        name = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+        return os.path.join(self.folder, name + EXTENSION)
+
+    def _list_entries(self):
+        """
+        :return: path, size and last use of each entry
+        :rtype: list(tuple(str, int, int))
+        """
+
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Removed by another process
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+
+        return entries
+
+    def get_size(self):
+        """
+        :return: total size of the entries, in bytes
+        :rtype: int
+        """
+
+        return sum(size for (path, size, mtime) in self._list_entries())
+
+    def get(self, key):
+        """
+        :param str key:
+        :return: memory-mapped page (read only), None if it's not in the cache
+        :rtype: ndarray
+        """
+
+        path = self.get_path(key)
+        try:
+            with timing.span("cache", key=key):
+                image = np.load(path, mmap_mode="r")
+            # Last use, for the eviction
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Not cached, or truncated
+            return None
+
+        # Plain array on the memory map (np.memmap is a subclass that some operations propagate)
+        return np.asarray(image)
+
+    def put(self, key, image):
+        """
+        Add a page, then remove the least recently used entries if the cache is too large
+
+        :param str key:
+        :param ndarray image: decoded page
+        """
+
+        image = np.ascontiguousarray(image)
+        path = self.get_path(key)
+
+        # Written under another name then renamed, so that another process never reads a partial entry
+        (fd, tmp_file) = tempfile.mkstemp(suffix=".tmp", dir=self.folder)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, image, allow_pickle=False)
+            os.replace(tmp_file, path)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self._size = self.evict()
+
+    def evict(self, max_size=None):
+        """
+        Remove the least recently used entries until the cache fits
+
+        :param int max_size: [optional] size to fit in, the cap of the cache by default
+        :return: size of the cache after eviction, in bytes
+        :rtype: int
+        """
+
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = self._list_entries()
+        size = sum(entry[1] for entry in entries)
+
+        for (path, entry_size, mtime) in sorted(entries, key=lambda entry: entry[2]):
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still memory-mapped (on Windows), removed next time
+                continue
+            size -= entry_size
+
+        return size
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+
+        with self._lock:
+            self._size = self.evict(max_size=0)
+
+
+def enable(folder, max_size=MAX_SIZE):
+    """
+    Cache the pages decoded by sources.read_image in this process
+
+    :param str folder: folder of the cache
+    :param int max_size: [optional] maximum total size of the entries, in bytes
+    :return: the cache
+    :rtype: PageCache
+    """
+
+    global _cache
+    _cache = PageCache(folder, max_size=max_size)
+
+    return _cache
+
+
+def disable():
+    """
+    Stop using the cache (entries are kept on disk)
+    """
+
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    """
+    :return: the cache in use, None if disabled
+    :rtype: PageCache
+    """
+
+    return _cache
+
+
+def _init_worker(folder, max_size):
+    enable(folder, max_size=max_size)
+
+
+def get_pool_kwargs():
+    """
+    Processes started with spawn (e.g. on Windows) don't inherit the cache, this enables it in each worker
+
+    :return: keyword arguments for ProcessPoolExecutor (initializer), empty if the cache is disabled
+    :rtype: dict
+    """
+
+    if _cache is None:
+        return {}
+
+    return {"initializer": _init_worker, "initargs": (_cache.folder, _cache.max_size)}
@@ -0,0 +1,361 @@
+"""
+Single pass manga pipeline: each page is decoded once, goes through all the stages in memory, and is encoded once.
+
+This replaces the chain jpg_to_grayscale.py -> split_doublepages.py -> gimp-autoclean.py, which decode and write
+every page three times, with intermediate files on disk.
+
+The pipeline is described by a declarative config (a dict, or a JSON file), e.g.:
+{
+    "stages": [
+        {"stage": "grayscale", "tolerance": 0},
+        {"stage": "split", "japan_read": false, "detect_gutter": false},
+        {"stage": "autoclean", "levels": [20, 220, 1.0, 0, 255]},
+        {"stage": "trim", "margin": 8, "consistent": true},
+        {"stage": "quantize", "levels": 16, "dither": false}
+    ],
+    "output": {"format": "png", "archive": false, "bits": 4, "compress_level": 9}
+}
+
+Each stage is a function(image, info, **options) that returns a list of images (one, or two for a split page).
+info is a dict shared by the stages of a page, with at least "filename", "cover_page" and "grayscale"
+(None until a stage knows).
+
+Put the autoclean stage after the split stage, as in the chain it replaces: the auto levels are computed on each
+single page, not on the whole double page. Put the trim stage after the split stage too: the split by page ratio
+expects pages with their margins. With "consistent", trimmed pages of the same orientation get the same size, from the
+content of the whole volume, found before processing it (see trim.get_trim_sizes). Pages with more content (e.g. full
+bleed illustrations) are left larger, the trim never cuts content.
+
+"bits" in the output config writes grayscale pages as 1, 2 or 4 bits PNG files, it goes with the quantize stage.
+
+Run with:
+python pipeline.py
+
+"""
+import json
+import os
+
+from autoclean import autoclean
+from grayscale import is_grayscale, to_grayscale
+from library import get_volume_number, scan_library
+from outputs import open_output
+import page_cache
+from quantize import quantize
+from sources import read_image
+from split_doublepages import VOLUME_PATTERN, is_double_page, split_page
+from streaming import stream
+import timing
+from trim import MARGIN, THRESHOLD, get_orientation, get_trim_sizes, trim
+
+DEFAULT_CONFIG = {
+    "stages": [
+        {"stage": "grayscale"},
+        {"stage": "split"},
+        {"stage": "autoclean"},
+    ],
+    "output": {"format": "png", "archive": False},
+}
+
+
+def grayscale_stage(image, info, tolerance=0, force=False):
+    """
+    Convert the page to grayscale (height, width) if it can be done without loss
+
+    :param ndarray image:
+    :param dict info: page information, "grayscale" is set
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param bool force: [optional] If True, colour pages are converted too (as jpg_to_grayscale.py does)
+    :return: [image]
+    """
+
+    with timing.span("grayscale_test", page=info["filename"]):
+        grayscale = is_grayscale(image, tolerance=tolerance)
+
+    if image.ndim == 3 and (grayscale or force):
+        with timing.span("conversion", page=info["filename"]):
+            image = to_grayscale(image, lossless=grayscale and not tolerance)
+        grayscale = True
+
+    info["grayscale"] = grayscale
+
+    return [image.astype("uint8", copy=False)]
+
+
+def trim_stage(image, info, margin=MARGIN, threshold=THRESHOLD, consistent=False):
+    """
+    Crop the white or black margins of the page (see trim.py)
+
+    :param ndarray image:
+    :param dict info: page information
+    :param int margin: [optional] pixels kept on each side of the content
+    :param int threshold: [optional] Difference with the background above which a pixel is content
+    :param bool consistent: [optional] If True, pages are enlarged (or padded) to the common size of the pages of the
+                            volume with the same orientation ("trim_sizes" in info, see process_volume)
+    :return: [image], a view of the page
+    """
+
+    size = None
+    if consistent:
+        size = info.get("trim_sizes", {}).get(get_orientation(image.shape))
+
+    with timing.span("trim", page=info["filename"]):
+        return [trim(image, margin=margin, size=size, threshold=threshold)]
+
+
+def autoclean_stage(image, info, levels=None, clip=None):
+    """
+    Auto levels then manual levels (see autoclean.py), only on grayscale pages
+
+    :param ndarray image:
+    :param dict info: page information
+    :param list levels: [optional] (low_input, high_input, gamma, low_output, high_output)
+    :param float clip: [optional] fraction of the pixels clipped on each side by the auto levels
+    :return: [image]
+    """
+
+    if image.ndim != 2:
+        return [image]
+
+    kwargs = {}
+    if levels is not None:
+        kwargs["levels"] = tuple(levels)
+    if clip is not None:
+        kwargs["clip"] = clip
+
+    with timing.span("autoclean", page=info["filename"]):
+        return [autoclean(image, **kwargs)]
+
+
+def split_stage(image, info, japan_read=False, detect_gutter=False):
+    """
+    Split double pages (see split_doublepages.py)
+
+    :param ndarray image:
+    :param dict info: page information
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param bool detect_gutter: If True, split where the gutter is detected instead of the page ratio
+    :return: one or two pages
+    """
+
+    if info["grayscale"] is None:
+        with timing.span("grayscale_test", page=info["filename"]):
+            info["grayscale"] = is_grayscale(image)
+
+    double_page = is_double_page(image, info["grayscale"], info["cover_page"])
+
+    return split_page(image, double_page, japan_read=japan_read, detect_gutter=detect_gutter)
+
+
+def quantize_stage(image, info, levels=16, dither=False):
+    """
+    Reduce the number of gray levels (see quantize.py), only on grayscale pages
+
+    :param ndarray image:
+    :param dict info: page information
+    :param int levels: [optional] number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, use ordered dithering
+    :return: [image]
+    """
+
+    if image.ndim != 2:
+        return [image]
+
+    with timing.span("quantize", page=info["filename"]):
+        return [quantize(image, levels=levels, dither=dither)]
+
+
+STAGES = {
+    "grayscale": grayscale_stage,
+    "trim": trim_stage,
+    "autoclean": autoclean_stage,
+    "split": split_stage,
+    "quantize": quantize_stage,
+}
+
+
+def load_config(filename):
+    """
+    :param str filename: JSON file
+    :return: pipeline config
+    :rtype: dict
+    """
+
+    with open(filename, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_pipeline(config):
+    """
+    Check the config and get the list of stages
+
+    :param dict config: pipeline config (see DEFAULT_CONFIG)
+    :return: list of (stage function, options)
+    :rtype: list(tuple(function, dict))
+    """
+
+    stages = []
+    for stage_config in config.get("stages", []):
+        options = dict(stage_config)
+        name = options.pop("stage")
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}' (available: {', '.join(STAGES)})")
+        stages.append((STAGES[name], options))
+
+    return stages
+
+
+def run_stages(stages, image, filename="", cover_page=False, volume_info=None):
+    """
+    Apply all stages to a decoded page
+
+    :param stages: list of (stage function, options), see build_pipeline
+    :param ndarray image: decoded page
+    :param str filename: [optional] input file
+    :param bool cover_page: [optional] Cover page is never a double page, even if larger
+    :param dict volume_info: [optional] information on the volume given to the stages (e.g. "trim_sizes")
+    :return: output pages, in reading order
+    :rtype: list(ndarray)
+    """
+
+    info = dict(volume_info or {}, filename=filename, cover_page=cover_page, grayscale=None)
+    if image.ndim not in (2, 3):
+        raise ValueError(f"Unexpected file format for {filename} (ndim = {image.ndim})")
+
+    images = [image]
+    for (stage, options) in stages:
+        images = [new_image for page in images for new_image in stage(page, info, **options)]
+
+    return images
+
+
+def get_page_name(volume_number, page_number, output=None):
+    """
+    :param int volume_number:
+    :param int page_number:
+    :param dict output: [optional] output config, for the extension
+    :return: filename of the output page
+    :rtype: str
+    """
+
+    extension = (output or {}).get("format", "png")
+
+    return f"T{volume_number:02d}_page_{page_number:03d}.{extension}"
+
+
+def get_encode_options(output=None):
+    """
+    :param dict output: [optional] output config. "quality" is used for JPEG, "compress_level" and "bits" for PNG.
+    :return: keyword arguments for imageio
+    :rtype: dict
+    """
+
+    output = output or {}
+    kwargs = {}
+    if output.get("format", "png") in ("jpg", "jpeg"):
+        kwargs["quality"] = output.get("quality", 85)
+        kwargs["optimize"] = True
+    else:
+        if "compress_level" in output:
+            kwargs["compress_level"] = output["compress_level"]
+        if "bits" in output:
+            kwargs["bits"] = output["bits"]
+
+    return kwargs
+
+
+def process_volume(filenames, volume_number, output_folder, config=None, prefetch=4, writers=2):
+    """
+    Run the pipeline on all pages of a volume. Decoding, stages and encoding overlap (see streaming.stream).
+
+    :param filenames: input files, in reading order
+    :type filenames: list(str or sources.ArchivePage)
+    :param int volume_number:
+    :param str output_folder: Output folder. With "archive" in the output config, pages are written in
+                              output_folder + '.cbz' instead (see outputs.open_output)
+    :param dict config: [optional] pipeline config, DEFAULT_CONFIG by default
+    :param int prefetch: [optional] Maximum number of pages waiting to be transformed (and to be written)
+    :param int writers: [optional] Number of writer threads
+    :return: number of pages written
+    :rtype: int
+    """
+
+    if config is None:
+        config = DEFAULT_CONFIG
+
+    stages = build_pipeline(config)
+    output_config = config.get("output", {})
+    encode_options = get_encode_options(output_config)
+
+    volume_info = {}
+    split_options = None
+    for (stage, options) in stages:
+        if stage is split_stage:
+            split_options = options
+        elif stage is trim_stage and options.get("consistent"):
+            # The cover page often has no margin, it would prevent trimming the other pages
+            with timing.span("trim_sizes"):
+                volume_info["trim_sizes"] = get_trim_sizes(
+                    filenames[1:], margin=options.get("margin", MARGIN), threshold=options.get("threshold", THRESHOLD),
+                    split=split_options is not None,
+                    detect_gutter=(split_options or {}).get("detect_gutter", False))
+
+    page_number = 1
+
+    def transform(item, image):
+        nonlocal page_number
+        (idx, filename) = item
+
+        print(f"\rProcessing page {filename}      ", end="")
+        pages = run_stages(stages, image, filename=filename, cover_page=(idx == 0), volume_info=volume_info)
+
+        outputs = []
+        for page in pages:
+            outputs.append((get_page_name(volume_number, page_number, output_config), page, page_number - 1))
+            page_number += 1
+
+        return outputs
+
+    def read(item):
+        return read_image(item[1])
+
+    def write(item):
+        (name, page, index) = item
+        output.write_image(name, page, index=index, **encode_options)
+
+    with timing.volume(volume_number), open_output(output_folder, archive=output_config.get("archive", False),
+                                                   compression=output_config.get("compression", "store")) as output:
+        stream(enumerate(filenames), read, transform, write, prefetch=prefetch, writers=writers)
+
+    print(f"\rFinished writting {page_number-1} pages.                       ")
+
+    return page_number - 1
+
+
+if __name__ == "__main__":
+    input_folder = "G:/Manga/Dragon Ball"
+    output_folder = "G:/Manga/Dragon_Ball_tmp"
+    config_file = None  # JSON file with the pipeline config, DEFAULT_CONFIG if None
+    profile = False  # If True, print the time spent in each step and save a trace (see timing.py)
+    cache_folder = None  # If set, decoded pages are cached in this folder, to try other configs faster
+
+    if profile:
+        timing.enable()
+
+    if cache_folder is not None:
+        page_cache.enable(cache_folder)
+
+    config = DEFAULT_CONFIG if config_file is None else load_config(config_file)
+
+    # Volumes as folders, or as archives (T1.cbz)
+    # The index is kept with the outputs, it's reused while the input folder is unchanged
+    index = scan_library(input_folder, volume_pattern=VOLUME_PATTERN, extensions=(".png",), max_depth=1,
+                         index_file=os.path.join(output_folder, ".library.json"))
+
+    for (name, files) in index.items():
+        volume_number = get_volume_number(name, VOLUME_PATTERN)
+        print(f"Processing Volume {volume_number:02d}")
+        process_volume(files, volume_number, os.path.join(output_folder, f"T{volume_number:02d}"), config=config)
+
+    if profile:
+        timing.print_summary()
+        timing.save_trace("pipeline_trace.json")
@@ -0,0 +1,147 @@
+"""
+Cheap page classification: image size and mode from the file header, colour test on a reduced preview.
+
+JPEG previews use the DCT scaling of the decoder (draft mode), so only 1/8 of the page is decoded in
+each direction. Other formats are fully decoded by PIL, then reduced with a box filter: that's as expensive as
+decoding the page, so guess_grayscale only uses previews of JPEG files.
+
+"""
+import numpy as np
+from PIL import Image
+
+from grayscale import is_grayscale
+from sources import as_file, open_binary
+
+# Size (px) of the longest side of the preview, approximately
+PREVIEW_SIZE = 256
+
+# Draft decoding of JPEG files does not give exactly the same chroma as a full decode. To be sure a page is in
+# color, the differences between channels in the preview must be above the tolerance plus this margin.
+JPEG_MARGIN = 8
+
+
+def read_header(filename):
+    """
+    Read the size of the image without decoding it
+
+    :param filename: path to the image (or sources.ArchivePage)
+    :return: width, height, mode (PIL mode, e.g. 'L', 'RGB') and format (e.g. 'PNG', 'JPEG')
+    :rtype: tuple(int, int, str, str)
+    """
+
+    with Image.open(as_file(filename)) as im:
+        (width, height) = im.size
+        return width, height, im.mode, im.format
+
+
+def read_preview(filename, max_size=PREVIEW_SIZE):
+    """
+    Decode a reduced version of the image
+
+    :param filename: path to the image (or sources.ArchivePage)
+    :param int max_size: [optional] Approximate size of the longest side of the preview
+    :return: preview as (height, width) or (height, width, channels) array
+    :rtype: ndarray
+    """
+
+    with Image.open(as_file(filename)) as im:
+        factor = max(1, max(im.size) // max_size)
+
+        if im.format == "JPEG":
+            # The decoder will pick the largest scale (1/2, 1/4 or 1/8) that is at least the requested size
+            im.draft(im.mode, (im.size[0] // factor, im.size[1] // factor))
+            im.load()
+        elif factor > 1:
+            im = im.reduce(factor)
+
+        return np.asarray(im)
+
+
+def guess_grayscale(filename, tolerance=0, header=None):
+    """
+    Test if a page is in grayscale, without decoding the full page when possible
+
+    A preview with differences between channels means that the full page also has some (a box filter average
+    pixels, it can't create differences). The opposite is not true: a small colour detail can disappear in the
+    preview, so a gray preview is inconclusive. Only JPEG files have a cheap preview, other formats would be decoded
+    twice (for the preview, then for the page), so the full page must be decoded to know.
+
+    :param filename: path to the image (or sources.ArchivePage)
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param tuple header: [optional] Result of read_header, if already known
+    :return: True if the page is gray, False if it's in colour, None if the full page must be decoded to know
+    :rtype: bool or None
+    """
+
+    if header is None:
+        header = read_header(filename)
+
+    (width, height, mode, image_format) = header
+
+    if mode == "L":
+        return True
+    elif mode not in ("RGB", "RGBA") or image_format != "JPEG":
+        return None
+
+    if not is_grayscale(read_preview(filename), tolerance=tolerance + JPEG_MARGIN):
+        return False
+
+    return None
+
+
+# Start Of Frame markers (all JPEG processes), they give the number of components of the image
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Markers without a length field
+_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9}
+
+
+def read_jpeg_components(filename):
+    """
+    Read the number of components of a JPEG file from its Start Of Frame segment, without decoding the image
+    (and usually reading only the first kilobytes of the file)
+
+    :param filename: path to a JPEG file (or sources.ArchivePage)
+    :return: number of components (1 for grayscale, 3 for YCbCr/RGB, 4 for CMYK), None if it's not a JPEG file
+    :rtype: int
+    """
+
+    with open_binary(filename) as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            elif byte != b"\xff":
+                # Not on a marker, the file is corrupted
+                return None
+
+            # A marker can be preceded by any number of 0xFF fill bytes
+            marker = f.read(1)
+            while marker == b"\xff":
+                marker = f.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+
+            if marker in _STANDALONE_MARKERS:
+                continue
+
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            length = int.from_bytes(length, "big")
+
+            if marker in _SOF_MARKERS:
+                # Precision (1 byte), height (2), width (2), then number of components
+                segment = f.read(6)
+                if len(segment) < 6:
+                    return None
+                return segment[5]
+            elif marker == 0xDA:
+                # Start Of Scan before any frame header
+                return None
+
+            f.seek(length - 2, 1)
@@ -0,0 +1,143 @@
+"""
+Grayscale pages with fewer gray levels (16 or 4), written as 4 bits or 2 bits PNG files.
+
+E-readers only display 16 gray levels, so 8 bits pages are twice as large as needed. Quantization is a 256 entries
+lookup table. With dithering (ordered, Bayer matrix), each pixel uses one of 64 lookup tables depending on its
+position, which keeps the aspect of gradients and screentones.
+
+Quantized pages stay uint8 images, with values on the grid of the levels (0, 17, 34, ... 255 for 16 levels), so
+they can go through any other step. encode_png_gray() writes them with 1, 2 or 4 bits per pixel.
+
+"""
+import struct
+import zlib
+
+import numpy as np
+
+# Bits per pixel of the PNG file, for each number of levels
+LEVELS_BITS = {2: 1, 4: 2, 16: 4}
+
+# Same default as Pillow
+COMPRESS_LEVEL = 6
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def get_bits(levels):
+    """
+    :param int levels: number of gray levels (2, 4 or 16)
+    :return: bits per pixel
+    :rtype: int
+    """
+
+    if levels not in LEVELS_BITS:
+        raise ValueError(f"Unsupported number of levels {levels} (available: {', '.join(map(str, LEVELS_BITS))})")
+
+    return LEVELS_BITS[levels]
+
+
+def get_bayer_matrix(size=8):
+    """
+    :param int size: [optional] power of 2
+    :return: ordered dithering matrix, a permutation of 0 .. size**2 - 1
+    :rtype: ndarray(uint8)
+    """
+
+    matrix = np.zeros((1, 1), dtype=np.uint8)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]).astype(np.uint8)
+
+    return matrix
+
+
+def get_quantize_luts(levels, thresholds):
+    """
+    :param int levels: number of gray levels
+    :param ndarray thresholds: fraction of a level step above which a value goes up one level (0.5 rounds)
+    :return: one lookup table per threshold, lut[threshold, old_value] = new_value
+    :rtype: ndarray(uint8)
+    """
+
+    steps = np.arange(256) * (levels - 1) / 255.
+    indices = np.floor(steps + (1 - np.asarray(thresholds, dtype=float))[:, np.newaxis])
+    indices = np.clip(indices, 0, levels - 1)
+
+    return (indices * (255 // (levels - 1))).astype(np.uint8)
+
+
+def get_quantize_lut(levels):
+    """
+    :param int levels: number of gray levels
+    :return: 256 values, lut[old_value] = nearest level
+    :rtype: ndarray(uint8)
+    """
+
+    return get_quantize_luts(levels, [0.5])[0]
+
+
+def quantize(image, levels=16, dither=False):
+    """
+    :param ndarray image: uint8 grayscale image (height, width)
+    :param int levels: [optional] number of gray levels (2, 4 or 16)
+    :param bool dither: [optional] If True, use ordered dithering instead of the nearest level
+    :return: image with values on the levels (0, 255 // (levels - 1), ..., 255)
+    :rtype: ndarray(uint8)
+    """
+
+    get_bits(levels)
+
+    if not dither:
+        return get_quantize_lut(levels)[image]
+
+    bayer = get_bayer_matrix()
+    size = bayer.shape[0]
+    luts = get_quantize_luts(levels, (bayer.ravel() + 0.5) / bayer.size)
+
+    # One lookup table per position in the Bayer matrix: flat index = position * 256 + value
+    (height, width) = image.shape
+    positions = np.tile(np.arange(bayer.size, dtype=np.uint16).reshape(bayer.shape) * 256,
+                        (-(-height // size), -(-width // size)))[:height, :width]
+
+    return luts.ravel()[positions + image]
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def encode_png_gray(image, bits, compress_level=None):
+    """
+    Encode a grayscale image as a PNG file with 1, 2 or 4 bits per pixel. Values are rounded to the nearest
+    level, so the image should be quantized first (see quantize).
+
+    :param ndarray image: uint8 grayscale image (height, width)
+    :param int bits: bits per pixel (1, 2 or 4)
+    :param int compress_level: [optional] zlib compression level (0-9), 6 by default
+    :return: PNG file
+    :rtype: bytes
+    """
+
+    levels = 1 << bits
+    get_bits(levels)
+    if compress_level is None:
+        compress_level = COMPRESS_LEVEL
+
+    # Index of the level of each pixel, 0 .. levels - 1
+    indices = (get_quantize_lut(levels) // (255 // (levels - 1)))[image]
+
+    (height, width) = image.shape
+    pixels_per_byte = 8 // bits
+    padding = -width % pixels_per_byte
+    if padding:
+        indices = np.pad(indices, ((0, 0), (0, padding)))
+
+    # Each row starts with its filter type (0, none), then pixels are packed first pixel in the high bits
+    rows = np.zeros((height, 1 + indices.shape[1] // pixels_per_byte), dtype=np.uint8)
+    for idx in range(pixels_per_byte):
+        rows[:, 1:] |= indices[:, idx::pixels_per_byte] << (8 - bits * (idx + 1))
+
+    # Width, height, bit depth, color type (0: grayscale), compression, filter, interlace
+    header = struct.pack(">IIBBBBB", width, height, bits, 0, 0, 0, 0)
+
+    return (PNG_SIGNATURE + _png_chunk(b"IHDR", header)
+            + _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), compress_level)) + _png_chunk(b"IEND", b""))
@@ -0,0 +1,90 @@
+"""
+Downscaling of pages by area averaging, in NumPy.
+
+Each output pixel is the mean of the input area it covers, including fractions of the pixels on its borders, so
+any ratio works (not only integer ones). Each axis is done in one pass on the cumulative sum of the pixels: the sum
+over an interval is the difference of the cumulative sum at its two ends, interpolated at fractional positions.
+
+"""
+import numpy as np
+
+
+def get_fit_shape(shape, size):
+    """
+    Largest shape that fits in size, keeping the aspect ratio. Pages are never enlarged.
+
+    :param tuple shape: (height, width, ...) of the page
+    :param tuple size: (max_width, max_height), either can be None
+    :return: (height, width)
+    :rtype: tuple(int, int)
+    """
+
+    (height, width) = shape[:2]
+    (max_width, max_height) = size
+
+    scale = 1.
+    if max_width is not None:
+        scale = min(scale, max_width / width)
+    if max_height is not None:
+        scale = min(scale, max_height / height)
+
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def _resize_axis(image, length, axis):
+    size = image.shape[axis]
+    if size == length:
+        return image
+
+    # Cumulative sum with a leading 0, so that cumsum[i] is the sum of the i first pixels
+    cumsum = np.cumsum(image, axis=axis, dtype=np.float64)
+    pad = [(0, 0)] * image.ndim
+    pad[axis] = (1, 0)
+    cumsum = np.pad(cumsum, pad)
+
+    # Borders of the output pixels, in input pixels
+    edges = np.arange(length + 1) * (size / length)
+    index = np.minimum(edges.astype(np.intp), size - 1)
+    fraction = edges - index
+
+    shape = [1] * image.ndim
+    shape[axis] = length + 1
+    fraction = fraction.reshape(shape)
+
+    low = np.take(cumsum, index, axis=axis)
+    high = np.take(cumsum, index + 1, axis=axis)
+    sums = low + fraction * (high - low)
+
+    return np.diff(sums, axis=axis) * (length / size)
+
+
+def resize_area(image, shape):
+    """
+    :param ndarray image: (height, width) or (height, width, channels)
+    :param tuple shape: (height, width) of the output, smaller than the image
+    :return: resized image, same dtype
+    :rtype: ndarray
+    """
+
+    (height, width) = shape
+    if image.shape[:2] == (height, width):
+        return image
+
+    resized = _resize_axis(_resize_axis(image, height, 0), width, 1)
+
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        resized = np.clip(np.rint(resized), info.min, info.max)
+
+    return resized.astype(image.dtype)
+
+
+def resize_to_fit(image, size):
+    """
+    :param ndarray image:
+    :param tuple size: (max_width, max_height), either can be None
+    :return: image reduced to fit in size (see get_fit_shape), the image itself if it already fits
+    :rtype: ndarray
+    """
+
+    return resize_area(image, get_fit_shape(image.shape, size))
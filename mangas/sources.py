@@ -0,0 +1,336 @@
+"""
+Where the pages of a volume are read from: loose files in a folder, or members of a .cbz/.zip archive.
+
+Archive members are decoded from memory, without extracting the archive to disk. A page is either a path (str)
+or an ArchivePage; the functions of this module accept both, so that the scripts can use them the same way.
+
+Each process keeps its archives open (the central directory is parsed once per archive, not once per access), and
+the last members read: the header, the preview and the decoded page are read from the same bytes. Both are
+invalidated when the archive is modified.
+
+"""
+import io
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+import imageio
+
+import page_cache
+import timing
+
+ARCHIVE_EXTENSIONS = (".cbz", ".zip")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+_DIGITS = re.compile(r"(\d+)")
+
+# Number of archive members kept in memory, at least the pages being read at the same time (see streaming.stream)
+MEMBER_CACHE_SIZE = 16
+
+# Number of archives kept open by each process, the least recently used is closed
+MAX_OPEN_ARCHIVES = 32
+
+# Archives open in this process: path: ((size, mtime), ZipFile), and the last members read: key: bytes
+_archives = OrderedDict()
+_members = OrderedDict()
+_archives_pid = None
+_archives_lock = threading.Lock()
+
+
+def natural_sort_key(text):
+    """
+    Key to sort strings with numbers in natural order (page_9 before page_10)
+
+    :param str text:
+    :return: sort key
+    :rtype: tuple
+    """
+
+    parts = _DIGITS.split(str(text))
+
+    # Odd indexes are numbers. The string is kept so that '01' and '1' are still ordered
+    return tuple((int(part), part) if idx % 2 else (part.lower(), part) for (idx, part) in enumerate(parts))
+
+
+class ArchivePage:
+    """
+    A page stored in an archive
+    """
+
+    __slots__ = ("archive", "name")
+
+    def __init__(self, archive, name):
+        """
+        :param str archive: path of the archive
+        :param str name: name of the member in the archive
+        """
+
+        self.archive = archive
+        self.name = name
+
+    def __str__(self):
+        return f"{self.archive}/{self.name}"
+
+    def __repr__(self):
+        return f"ArchivePage({self.archive!r}, {self.name!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, ArchivePage) and (self.archive, self.name) == (other.archive, other.name)
+
+    def __hash__(self):
+        return hash((self.archive, self.name))
+
+    def read_bytes(self):
+        """
+        :return: content of the member
+        :rtype: bytes
+        """
+
+        (archive, stamp) = _get_archive(self.archive)
+        key = (os.path.abspath(self.archive), stamp, self.name)
+
+        with _archives_lock:
+            data = _members.get(key)
+            if data is not None:
+                _members.move_to_end(key)
+                return data
+
+        # Read outside of the lock, ZipFile supports reads from several threads
+        data = archive.read(self.name)
+
+        with _archives_lock:
+            _members[key] = data
+            while len(_members) > MEMBER_CACHE_SIZE:
+                _members.popitem(last=False)
+
+        return data
+
+    def get_info(self):
+        """
+        :return: information of the member (file_size, CRC, ...)
+        :rtype: zipfile.ZipInfo
+        """
+
+        return _get_archive(self.archive)[0].getinfo(self.name)
+
+
+def _get_archive(path):
+    """
+    :param str path: path of an archive
+    :return: the archive open for reading, shared by the threads of this process, and its (size, mtime)
+    :rtype: tuple(zipfile.ZipFile, tuple(int, int))
+    """
+
+    global _archives_pid
+
+    stat = os.stat(path)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    path = os.path.abspath(path)
+
+    with _archives_lock:
+        if _archives_pid != os.getpid():
+            # Inherited from the parent process (fork), the file offsets would be shared with it
+            _archives.clear()
+            _members.clear()
+            _archives_pid = os.getpid()
+
+        (cached_stamp, archive) = _archives.get(path, (None, None))
+        if cached_stamp != stamp:
+            if archive is not None:
+                archive.close()
+            archive = zipfile.ZipFile(path)
+            _archives[path] = (stamp, archive)
+            while len(_archives) > MAX_OPEN_ARCHIVES:
+                _archives.popitem(last=False)[1][1].close()
+        _archives.move_to_end(path)
+
+    return archive, stamp
+
+
+def close_archive(path):
+    """
+    Close an archive kept open by this process (see ArchivePage.read_bytes), before replacing it (an open file can't
+    be replaced on Windows)
+
+    :param str path: path of the archive
+    """
+
+    path = os.path.abspath(path)
+
+    with _archives_lock:
+        (stamp, archive) = _archives.pop(path, (None, None))
+        if archive is not None and _archives_pid == os.getpid():
+            archive.close()
+
+
+def is_archive(path):
+    """
+    :param str path:
+    :return: True if the path is a .cbz/.zip archive
+    :rtype: bool
+    """
+
+    return isinstance(path, str) and path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def list_archive_pages(archive, extensions=IMAGE_EXTENSIONS):
+    """
+    :param str archive: path of a .cbz/.zip archive
+    :param extensions: [optional] extensions of the members to keep (case insensitive)
+    :type extensions: tuple(str)
+    :return: pages of the archive, in natural order
+    :rtype: list(ArchivePage)
+    """
+
+    with zipfile.ZipFile(archive) as f:
+        names = [info.filename for info in f.infolist()
+                 if not info.is_dir() and info.filename.lower().endswith(extensions)]
+
+    names.sort(key=natural_sort_key)
+
+    return [ArchivePage(archive, name) for name in names]
+
+
+def list_folder_pages(folder, extensions=IMAGE_EXTENSIONS):
+    """
+    :param str folder:
+    :param extensions: [optional] extensions of the files to keep (case insensitive)
+    :type extensions: tuple(str)
+    :return: image files of the folder (not recursive), in natural order
+    :rtype: list(str)
+    """
+
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith(extensions)]
+
+    names.sort(key=natural_sort_key)
+
+    return [os.path.join(folder, name) for name in names]
+
+
+def list_pages(source, extensions=IMAGE_EXTENSIONS):
+    """
+    :param str source: folder or archive
+    :param extensions: [optional] extensions of the pages to keep (case insensitive)
+    :type extensions: tuple(str)
+    :return: pages, in natural order
+    :rtype: list(str or ArchivePage)
+    """
+
+    if is_archive(source):
+        return list_archive_pages(source, extensions=extensions)
+    else:
+        return list_folder_pages(source, extensions=extensions)
+
+
+def read_bytes(page):
+    """
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: content of the file
+    :rtype: bytes
+    """
+
+    with timing.span("read", page=page):
+        if isinstance(page, ArchivePage):
+            data = page.read_bytes()
+        else:
+            with open(page, "rb") as f:
+                data = f.read()
+
+    timing.add_bytes("read", len(data))
+
+    return data
+
+
+def open_binary(page):
+    """
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: binary file object (to be closed)
+    """
+
+    if isinstance(page, ArchivePage):
+        return io.BytesIO(page.read_bytes())
+
+    return open(page, "rb")
+
+
+def as_file(page):
+    """
+    Something that imageio and PIL can open
+
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: the path itself, or the content of an archive member
+    :rtype: str or BytesIO
+    """
+
+    if isinstance(page, ArchivePage):
+        return io.BytesIO(page.read_bytes())
+
+    return page
+
+
+def get_cache_key(page):
+    """
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: key of the decoded page in the page cache, changes if the file is modified
+    :rtype: str
+    """
+
+    (size, mtime) = get_size_mtime(page)
+
+    return f"{os.path.abspath(str(page))}|{size}|{mtime}"
+
+
+def read_image(page):
+    """
+    If the page cache is enabled (see page_cache.py), pages already decoded are memory-mapped from the cache
+    (read only) instead of being decoded again.
+
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: decoded image
+    :rtype: ndarray
+    """
+
+    cache = page_cache.get_cache()
+    if cache is not None:
+        key = get_cache_key(page)
+        image = cache.get(key)
+        if image is not None:
+            return image
+
+    # Read then decoded from memory, so that filesystem and decoding time are measured apart (see timing.py)
+    data = read_bytes(page)
+
+    with timing.span("decode", page=page):
+        image = imageio.imread(data)
+
+    if cache is not None:
+        cache.put(key, image)
+
+    return image
+
+
+def get_size_mtime(page):
+    """
+    For an archive member, the modification time is the one of the archive
+
+    :param page: path or ArchivePage
+    :type page: str or ArchivePage
+    :return: size in bytes and modification time in ns
+    :rtype: tuple(int, int)
+    """
+
+    if isinstance(page, ArchivePage):
+        (archive, (size, mtime)) = _get_archive(page.archive)
+        return archive.getinfo(page.name).file_size, mtime
+
+    stat = os.stat(page)
+
+    return stat.st_size, stat.st_mtime_ns
@@ -3,118 +3,921 @@ Script to open scans that have 2 pages, and will split them into single pages, u
 of the transition between one page and the other
 
 """
-import imageio
 import os
-import glob
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 
+from grayscale import is_grayscale, to_grayscale
+from manifest import Manifest
+from outputs import FolderOutput, open_output
+import page_cache
+from gutter import get_split_columns
+from library import get_volume_number, scan_library
+from preview import guess_grayscale, read_header
+from quantize import get_bits, quantize
+from resize import resize_to_fit
+from sources import read_image
+from streaming import stream
+import timing
 
-def is_grayscale(image):
+# Name of the volumes in the input folder: folders T1, T2... or archives T1.cbz...
+VOLUME_PATTERN = r"T(\d+)"
+
+# Output written when no output spec is given: full size PNG pages in the output folder
+DEFAULT_OUTPUT = {"folder": "", "size": None, "format": "png"}
+
+
+def read_page(filename, tolerance=0, levels=None, dither=False):
+    """
+    Read a page and convert it to grayscale (height, width) when this can be done without loss
+
+    :param str filename: path to the image
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param int levels: [optional] If given, grayscale pages are quantized to this number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :return: image (uint8), grayscale flag
+    :rtype: tuple(ndarray, bool)
+    """
+
+    return prepare_page(read_image(filename), filename, tolerance=tolerance, levels=levels, dither=dither)
+
+
+def prepare_page(im, filename="", tolerance=0, levels=None, dither=False):
+    """
+    Convert a decoded page to grayscale (height, width) when this can be done without loss
+
+    :param ndarray im: image as read by imageio
+    :param str filename: [optional] Only used in error messages
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+                          (see grayscale.is_grayscale). Default is lossless.
+    :param int levels: [optional] If given, grayscale pages are quantized to this number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :return: image (uint8), grayscale flag
+    :rtype: tuple(ndarray, bool)
+    """
+
+    if im.ndim not in (2, 3):
+        raise ValueError(f"Unexpected file format for {filename} (ndim = {im.ndim})")
+
+    with timing.span("grayscale_test", page=filename):
+        grayscale = is_grayscale(im, tolerance=tolerance)
+
+    # Convert into greyscale (height, width). Without tolerance, all channels are equal
+    if grayscale and im.ndim == 3:
+        with timing.span("conversion", page=filename):
+            im = to_grayscale(im, lossless=not tolerance)
+
+    # Force conversion to uint8 (e.g. for 16 bits PNG)
+    im = im.astype("uint8", copy=False)
+
+    if levels is not None and im.ndim == 2:
+        with timing.span("quantize", page=filename):
+            im = quantize(im, levels=levels, dither=dither)
+
+    return im, grayscale
+
+
+def is_double_page(im, grayscale, cover_page=False):
+    """
+    :param ndarray im: image as returned by read_page
+    :param bool grayscale:
+    :param bool cover_page: Cover page is never a double page, even if larger
+    :return: True if the image must be split in two pages
+    :rtype: bool
+    """
+
+    (height, width) = im.shape[:2]
+
+    # We don't split color images because double page in color are generally one big image.
+    return not cover_page and width > height and grayscale
+
+
+def split_page(im, double_page, japan_read=False, detect_gutter=False):
+    """
+    :param ndarray im: image as returned by read_page
+    :param bool double_page: If True, the image will be split in 2
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param bool detect_gutter: If True, split where the gutter is detected, else (or if the detection is not
+                               reliable) each page is as wide as the page ratio (see gutter.get_split_columns)
+    :return: list of pages, in reading order
+    :rtype: list(ndarray)
+    """
+
+    if not double_page:
+        return [im]
+
+    with timing.span("split"):
+        (left_end, right_start) = get_split_columns(im, detect=detect_gutter)
+
+    left_page = im[:, :left_end]
+    right_page = im[:, right_start:]
+
+    if japan_read:
+        return [right_page, left_page]
+    else:
+        return [left_page, right_page]
+
+
+def plan_page(filename, cover_page=False, tolerance=0, levels=None):
+    """
+    Classify a page from its header and a reduced preview, without decoding the full page when possible
+
+    A page can be copied as is when it's a single PNG page that needs no conversion (already 2D grayscale,
+    or in colour). Colour PNG pages have no cheap preview, they are only known once decoded (see get_output_pages).
+
+    :param str filename: path to the image
+    :param bool cover_page: Cover page is never a double page, even if larger
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param int levels: [optional] If given, grayscale pages are quantized, so they are never copied
+    :return: Number of output pages (None if the full page must be decoded to know), True if the file can be copied
+    :rtype: tuple(int, bool)
+    """
+
+    header = read_header(filename)
+    (width, height, mode, image_format) = header
+
+    if cover_page or width <= height:
+        # Single page whatever the colour, we only need to know if a conversion is needed
+        if image_format == "PNG" and mode == "L":
+            return 1, levels is None
+        else:
+            return 1, False
+
+    grayscale = guess_grayscale(filename, tolerance=tolerance, header=header)
+
+    if grayscale is None:
+        return None, False
+    elif grayscale:
+        # 2D grayscale double page
+        return 2, False
+    else:
+        # We don't split color images
+        return 1, image_format == "PNG"
+
+
+def get_output_pages(filename, im, cover_page=False, copy=True, japan_read=False, tolerance=0, detect_gutter=False,
+                     levels=None, dither=False):
+    """
+    Pages to write for a decoded file
+
+    :param filename: path to the image (or sources.ArchivePage)
+    :param ndarray im: decoded image
+    :param bool cover_page: Cover page is never a double page, even if larger
+    :param bool copy: [optional] If True, a colour PNG page is copied as is instead of being encoded again
+                      (see can_copy)
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param bool detect_gutter: [optional] If True, split double pages where the gutter is detected
+    :param int levels: [optional] If given, grayscale pages are quantized to this number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :return: pages in reading order (ndarray), or the file itself if it can be copied
+    :rtype: list
+    """
+
+    im, grayscale = prepare_page(im, filename, tolerance=tolerance, levels=levels, dither=dither)
+
+    if copy and not grayscale:
+        # Colour pages are never split nor converted
+        (width, height, mode, image_format) = read_header(filename)
+        if image_format == "PNG" and mode in ("RGB", "RGBA"):
+            return [filename]
+
+    return split_page(im, is_double_page(im, grayscale, cover_page), japan_read=japan_read,
+                      detect_gutter=detect_gutter)
+
+
+def classify_page(filename, volume_number, output_folder, file_index, cover_page=False, japan_read=False,
+                  overwrite=True, tolerance=0, detect_gutter=False, levels=None, dither=False, compress_level=None,
+                  output_specs=None, encoders=1):
+    """
+    Number of pages that will be written for this file once split (see plan_page).
+
+    When the full page must be decoded to know it, the page is processed right away, and its pages are written under
+    temporary names (see get_temporary_name), to be renamed once the page numbers are known. So no page is decoded
+    twice.
+
+    :param str filename: path to the image
+    :param int volume_number:
+    :param str output_folder:
+    :param int file_index: index of the file in the volume, for the temporary names
+    :param bool cover_page: Cover page is never a double page, even if larger
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param bool overwrite: By default, any existing image will be overwritten
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param bool detect_gutter: [optional] If True, split double pages where the gutter is detected
+    :param int levels: [optional] If given, grayscale pages are quantized to this number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param output_specs: [optional] outputs to write (see split_volume_pages)
+    :type output_specs: list(dict)
+    :param int encoders: [optional] Number of threads encoding the outputs of the page at the same time
+    :return: 1 or 2, True if the file can be copied as is (see plan_page), and the temporary files written (output by
+             output) or None if the page is not processed yet
+    :rtype: tuple(int, bool, list(str))
+    """
+
+    (nb_pages, copy) = plan_page(filename, cover_page=cover_page, tolerance=tolerance, levels=levels)
+
+    if nb_pages is not None:
+        return nb_pages, copy, None
+
+    specs = get_output_specs(output_specs)
+    pages = get_output_pages(filename, read_image(filename), cover_page=cover_page, copy=can_copy(specs),
+                             japan_read=japan_read, tolerance=tolerance, detect_gutter=detect_gutter, levels=levels,
+                             dither=dither)
+    names = [get_temporary_name(volume_number, file_index, idx) for idx in range(len(pages))]
+    paths = write_page_files(pages, specs, output_folder, volume_number, names=names, overwrite=overwrite,
+                             levels=levels, compress_level=compress_level, encoders=encoders)
+
+    return len(pages), False, paths
+
+
+def get_page_numbers(page_counts, first_page=1):
     """
-    If RGB, will test if this can safely be saved into grayscale without loss
+    From the number of output pages of each file, get the number of the first output page of each file.
+
+    :param page_counts: Number of output pages of each file of the volume, in order
+    :type page_counts: list(int)
+    :param int first_page: number of the first page of the volume
+    :return: page number of the first output page of each file
+    :rtype: list(int)
+    """
+
+    page_numbers = []
+    page_number = first_page
+    for count in page_counts:
+        page_numbers.append(page_number)
+        page_number += count
+
+    return page_numbers
+
+
+def process_page(filename, page_number, volume_number, output_folder, cover_page=False, copy=None, japan_read=False,
+                 overwrite=True, tolerance=0, detect_gutter=False, levels=None, dither=False, compress_level=None,
+                 output_specs=None, encoders=1):
+    """
+    Split one file and write the resulting page(s)
+
+    :param str filename: path to the image
+    :param int page_number: number of the first output page for this file
+    :param int volume_number:
+    :param str output_folder:
+    :param bool cover_page: Cover page is never a double page, even if larger
+    :param bool copy: [optional] If the file can be copied as is (see plan_page). Computed if not given.
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param bool overwrite: By default, any existing image will be overwritten
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param bool detect_gutter: [optional] If True, split double pages where the gutter is detected
+    :param int levels: [optional] If given, grayscale pages are quantized to this number of gray levels (16 or 4)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param output_specs: [optional] outputs to write (see split_volume_pages)
+    :type output_specs: list(dict)
+    :param int encoders: [optional] Number of threads encoding the outputs of the page at the same time
+    :return: Number of pages written
+    :rtype: int
+    """
+
+    specs = get_output_specs(output_specs)
+
+    if copy is None:
+        (nb_pages, copy) = plan_page(filename, cover_page=cover_page, tolerance=tolerance, levels=levels)
+
+    if copy and can_copy(specs):
+        pages = [filename]
+    else:
+        pages = get_output_pages(filename, read_image(filename), cover_page=cover_page, copy=can_copy(specs),
+                                 japan_read=japan_read, tolerance=tolerance, detect_gutter=detect_gutter,
+                                 levels=levels, dither=dither)
+
+    write_page_files(pages, specs, output_folder, volume_number, first_page=page_number, overwrite=overwrite,
+                     levels=levels, compress_level=compress_level, encoders=encoders)
+
+    return len(pages)
+
+
+def write_page_files(pages, specs, output_folder, volume_number, first_page=None, names=None, overwrite=True,
+                     levels=None, compress_level=None, encoders=1):
+    """
+    Write the pages of one file in the folders of the outputs (see write_outputs)
+
+    :param list pages: pages in reading order (ndarray), or source file copied as is
+    :param specs: output specs (see get_output_specs)
+    :type specs: list(dict)
+    :param str output_folder:
+    :param int volume_number:
+    :param int first_page: [optional] number of the first page
+    :param names: [optional] filename of each page, without extension, instead of their page number
+    :type names: list(str)
+    :param bool overwrite: By default, any existing image will be overwritten
+    :param int levels: [optional] Number of gray levels of quantized pages
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param int encoders: [optional] Number of threads encoding the outputs of the page at the same time
+    :return: paths of the pages written, output by output
+    :rtype: list(str)
+    """
+
+    outputs = [FolderOutput(get_spec_folder(output_folder, spec), overwrite=overwrite) for spec in specs]
+
+    if encoders > 1:
+        with ThreadPoolExecutor(max_workers=encoders) as executor:
+            return write_outputs(outputs, specs, pages, volume_number, first_page, levels=levels,
+                                 compress_level=compress_level, executor=executor, names=names)
+
+    return write_outputs(outputs, specs, pages, volume_number, first_page, levels=levels,
+                         compress_level=compress_level, names=names)
+
+
+def get_encode_options(page, levels=None, compress_level=None, spec=None):
+    """
+    :param ndarray page: page to write
+    :param int levels: [optional] Number of gray levels of quantized pages
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param dict spec: [optional] output spec (see split_volume_pages), full size PNG by default
+    :return: keyword arguments for outputs.encode_image
+    :rtype: dict
+    """
+
+    spec = spec or DEFAULT_OUTPUT
+    kwargs = {}
+    if spec["format"] in ("jpg", "jpeg"):
+        kwargs["quality"] = spec.get("quality", 85)
+        kwargs["optimize"] = True
+        return kwargs
+
+    compress_level = spec.get("compress_level", compress_level)
+    if compress_level is not None:
+        kwargs["compress_level"] = compress_level
+    if levels is not None and page.ndim == 2:
+        kwargs["bits"] = get_bits(levels)
+
+    return kwargs
+
+
+def get_output_specs(output_specs=None):
+    """
+    :param output_specs: [optional] outputs to write (see split_volume_pages)
+    :type output_specs: list(dict)
+    :return: output specs with their default values
+    :rtype: list(dict)
+    """
+
+    if not output_specs:
+        return [dict(DEFAULT_OUTPUT)]
 
-    :param ndarray image:
-    :return: if the image can be saved as grayscale or not
+    specs = [dict(DEFAULT_OUTPUT, **spec) for spec in output_specs]
+
+    folders = [spec["folder"] for spec in specs]
+    if len(set(folders)) != len(folders):
+        raise ValueError(f"Each output spec needs its own folder (got {folders})")
+
+    return specs
+
+
+def can_copy(specs):
+    """
+    :param specs: output specs (see get_output_specs)
+    :type specs: list(dict)
+    :return: True if input PNG files can be copied as is, i.e. all outputs are full size PNG files
     :rtype: bool
     """
 
-    if image.ndim == 2:
-        return True
+    return all(spec["size"] is None and spec["format"] == "png" for spec in specs)
+
+
+def get_spec_folder(output_folder, spec, archive=False):
+    """
+    :param str output_folder: output folder of the volume
+    :param dict spec: output spec (see split_volume_pages)
+    :param bool archive: [optional] If True, archives of other outputs are next to the main one (output_folder +
+                         '_' + folder + '.cbz') instead of in a sub folder
+    :return: output folder of this spec (see outputs.open_output)
+    :rtype: str
+    """
+
+    if not spec["folder"]:
+        return output_folder
+    elif archive:
+        return f"{os.path.normpath(output_folder)}_{spec['folder']}"
     else:
-        # All diffs must be 0 for the image to be grayscale
-        diff = np.diff(image, axis=2)
-        return not np.any(diff)
+        return os.path.join(output_folder, spec["folder"])
+
+
+def write_output(output, spec, name, page, index=None, levels=None, compress_level=None):
+    """
+    Resize a page for one output spec, then encode and write it
+
+    :param output: see outputs.open_output
+    :param dict spec: output spec (see split_volume_pages)
+    :param str name: page filename
+    :param page: page (ndarray), or source file copied as is (path or sources.ArchivePage)
+    :param int index: [optional] index of the page in the volume
+    :param int levels: [optional] Number of gray levels of quantized pages
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    """
+
+    if not isinstance(page, np.ndarray):
+        output.copy_file(name, page, index=index)
+        return
+
+    if spec["size"] is not None:
+        with timing.span("resize", page=name):
+            page = resize_to_fit(page, spec["size"])
+
+    output.write_image(name, page, index=index,
+                       **get_encode_options(page, levels=levels, compress_level=compress_level, spec=spec))
+
+
+def write_outputs(outputs, specs, pages, volume_number, first_page, levels=None, compress_level=None, executor=None,
+                  names=None):
+    """
+    Write the pages of one file to every output: each page is decoded once, and encoded once per output spec
+
+    :param outputs: one output per spec (see outputs.open_output)
+    :param specs: output specs (see get_output_specs)
+    :type specs: list(dict)
+    :param list pages: pages in reading order (ndarray), or source file copied as is
+    :param int volume_number:
+    :param int first_page: number of the first page
+    :param int levels: [optional] Number of gray levels of quantized pages
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param ThreadPoolExecutor executor: [optional] If given, pages are resized and encoded in its threads at the
+                                        same time (codecs and most of NumPy release the GIL)
+    :param names: [optional] filename of each page, without extension, instead of their page number (first_page is
+                  then unused)
+    :type names: list(str)
+    :return: paths of the pages written, output by output
+    :rtype: list(str)
+    """
+
+    tasks = []
+    for (output, spec) in zip(outputs, specs):
+        for (idx, page) in enumerate(pages):
+            if names is None:
+                tasks.append((output, spec, get_page_name(volume_number, first_page + idx, spec["format"]), page,
+                              first_page + idx - 1))
+            else:
+                tasks.append((output, spec, f"{names[idx]}.{spec['format']}", page, None))
+
+    def run(task):
+        (output, spec, name, page, index) = task
+        write_output(output, spec, name, page, index=index, levels=levels, compress_level=compress_level)
+        return output.get_path(name)
+
+    if executor is None:
+        return [run(task) for task in tasks]
+
+    return list(executor.map(run, tasks))
+
+
+def get_page_name(volume_number, page_number, extension="png"):
+    """
+    :param int volume_number:
+    :param int page_number:
+    :param str extension: [optional] format of the page
+    :return: filename of the output page
+    :rtype: str
+    """
+
+    return f"T{volume_number:02d}_page_{page_number:03d}.{extension}"
+
+
+def get_temporary_name(volume_number, file_index, page_index):
+    """
+    :param int volume_number:
+    :param int file_index: index of the input file in the volume
+    :param int page_index: index of the page in the file
+    :return: filename (without extension) of a page written before its page number is known (see classify_page)
+    :rtype: str
+    """
+
+    return f".T{volume_number:02d}_file_{file_index:04d}_{page_index}.tmp"
+
+
+def get_output_filenames(output_folder, volume_number, page_number, output_specs=None):
+    """
+    :param str output_folder:
+    :param int volume_number:
+    :param int page_number:
+    :param output_specs: [optional] outputs written (see split_volume_pages)
+    :type output_specs: list(dict)
+    :return: paths of the output page, one per output spec
+    :rtype: list(str)
+    """
+
+    return [os.path.join(get_spec_folder(output_folder, spec), get_page_name(volume_number, page_number,
+                                                                              spec["format"]))
+            for spec in get_output_specs(output_specs)]
+
+
+def open_manifest(output_folder, volume_number, japan_read=False, tolerance=0, detect_gutter=False, levels=None,
+                  dither=False, compress_level=None, output_specs=None):
+    """
+    Manifest of the pages already written in the output folder of a volume (see manifest.Manifest)
+
+    :param str output_folder:
+    :param int volume_number:
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param int tolerance: Maximum difference between channels for a page to be considered gray
+    :param bool detect_gutter: If True, split double pages where the gutter is detected
+    :param int levels: [optional] Number of gray levels of quantized pages
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param output_specs: [optional] outputs written (see split_volume_pages)
+    :type output_specs: list(dict)
+    :return: manifest, pages done with other parameters will be processed again
+    :rtype: Manifest
+    """
+
+    params = {"volume_number": volume_number, "japan_read": japan_read, "tolerance": tolerance,
+              "detect_gutter": detect_gutter}
+    # Only when set, so that manifests of previous versions stay valid
+    if levels is not None:
+        params.update(levels=levels, dither=dither)
+    if compress_level is not None:
+        params["compress_level"] = compress_level
+    if output_specs:
+        params["outputs"] = get_output_specs(output_specs)
 
+    return Manifest(output_folder, params=params)
 
-def split_volume_pages(filenames, volume_number, output_folder=None, japan_read=False, overwrite=True):
+
+def split_volume_pages(filenames, volume_number, output_folder=None, japan_read=False, overwrite=True, workers=1,
+                       prefetch=4, writers=2, tolerance=0, detect_gutter=False, incremental=False, archive=False,
+                       compression="store", levels=None, dither=False, compress_level=None, output_specs=None,
+                       encoders=1):
     """
+    In serial mode (workers=1), reading, transforming and writing pages overlap: pages are decoded in a
+    background thread and encoded by writer threads (see streaming.stream).
+
+    Pages are classified from their header and, for JPEG files, a reduced preview first (see plan_page). Only pages
+    that need a conversion, or whose colour is unknown, are fully decoded (once), the others are copied.
+
+    Several outputs can be written in the same pass (e.g. full size PNG pages, and small JPEG pages for a
+    preview), each page is then decoded once and resized (area averaging, see resize.py) and encoded for each output.
 
     :param filenames: list of filenames
-    :type filenames: list(str)
+    :type filenames: list(str or sources.ArchivePage)
     :param int volume_number:
     :param str output_folder:
     :param bool japan_read: If True, the first page of the double page will be the one on the right
     :param bool overwrite: By default, any existing image will be overwritten
+    :param int workers: [optional] Number of processes. 1 (default) process pages in order in this process,
+                        None use all CPUs (see split_volumes)
+    :param int prefetch: [optional] Serial mode only, maximum number of pages waiting to be transformed
+                         (and to be written)
+    :param int writers: [optional] Serial mode only, number of writer threads. With writers=1 and prefetch=1,
+                        pages are still written in order
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray.
+                          Default (0) only converts pages that are exactly gray.
+    :param bool detect_gutter: [optional] If True, split double pages where the gutter is detected, instead of
+                               using the page ratio
+    :param bool incremental: [optional] If True, pages are recorded in a manifest in the output folder, and pages
+                             already done (same input, same parameters, same page number) are skipped. This also
+                             allow to resume an interrupted run.
+    :param bool archive: [optional] If True, pages are written in a output_folder + '.cbz' archive instead of
+                         the output folder
+    :param str compression: [optional] Archive compression (see outputs.COMPRESSIONS), by default pages are stored
+    :param int levels: [optional] If given (16 or 4), grayscale pages are quantized to this number of gray levels and
+                       written as 4 bits or 2 bits PNG files (see quantize.py). Colour pages are unchanged.
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9), 6 by default
+    :param output_specs: [optional] outputs to write, by default full size PNG pages in the output folder. Each spec
+                         is a dict with keys:
+                         - folder: sub folder of the output folder, "" (default) for the output folder itself.
+                           With archive=True, output_folder + '_' + folder + '.cbz'
+                         - size: (max_width, max_height) pages are reduced to fit in, either can be None.
+                           None (default) keeps the pages full size
+                         - format: "png" (default) or "jpg"
+                         - quality: [optional] JPEG quality, 85 by default
+                         - compress_level: [optional] zlib compression level of the PNG files, for this output
+                         Full size PNG input pages are only copied if all outputs are full size PNG.
+    :type output_specs: list(dict)
+    :param int encoders: [optional] Number of threads resizing and encoding the outputs of a page at the same time.
+                         In serial mode, this is on top of the writer threads.
     :return:
     """
 
     if output_folder is None:
         output_folder = "."
 
-    # Create output folder if it doesn't exist
-    if not os.path.isdir(output_folder):
-        os.makedirs(output_folder)
+    if archive and incremental:
+        raise ValueError("Incremental processing is not possible with an archive output")
+
+    if workers != 1:
+        split_volumes([(filenames, volume_number, output_folder)], japan_read=japan_read, overwrite=overwrite,
+                      workers=workers, tolerance=tolerance, detect_gutter=detect_gutter, incremental=incremental,
+                      archive=archive, compression=compression, levels=levels, dither=dither,
+                      compress_level=compress_level, output_specs=output_specs, encoders=encoders)
+        return
+
+    specs = get_output_specs(output_specs)
+
+    manifest = None
+    if incremental:
+        manifest = open_manifest(output_folder, volume_number, japan_read=japan_read, tolerance=tolerance,
+                                 detect_gutter=detect_gutter, levels=levels, dither=dither,
+                                 compress_level=compress_level, output_specs=output_specs)
 
     cover_page = True  # Flag to prevent first page to be split
     page_number = 1
-    for filename in filenames:
-        print(f"\rProcessing page {filename}      ", end="")
-        im = imageio.imread(filename)
+    nb_skipped = 0
 
-        grayscale = is_grayscale(im)
+    def load(idx, filename):
+        (nb_pages, copy) = plan_page(filename, cover_page=(idx == 0), tolerance=tolerance, levels=levels)
 
-        if im.ndim == 2:
-            (height, width) = im.shape
-        elif im.ndim == 3:
-            (height, width, dummy) = im.shape
-        else:
-            ValueError(f"Unexpected file format for {filename} (ndim = {im.ndim})")
+        if copy and can_copy(specs):
+            return None
 
-        # Convert into greyscale (height, width)
-        if grayscale and im.ndim == 3:
-            im = im.mean(axis=2)
+        return read_image(filename)
 
-        # Force conversion to uint8 because the mean transform it into float
-        # For an unknown reason, adding dtype into the mean mess things up
-        im = im.astype("uint8")
+    def read(item):
+        (idx, filename) = item
 
-        double_page = False
-        # Cover page is never a double page, even if larger
-        # We don't split color images because double page in color are generally one big image.
-        if not cover_page and width > height and grayscale:
-            double_page = True
+        if manifest is not None:
+            entry = manifest.get(filename)
+            if entry is not None:
+                # Probably nothing to do, to be confirmed once we know the page number
+                return entry
 
-        pages = []
-        if not double_page:
-            pages.append(im)
-        else:
-            # new value come from JapFlap scantrad ratio ; old: 0.6857142857142857
-            new_width = int(height * 0.68518518518)
-
-            left_page = im[:, :new_width]
-            right_page = im[:, width - new_width:]
+        return load(idx, filename)
 
-            if japan_read:
-                pages.append(right_page)
-                pages.append(left_page)
-            else:
-                pages.append(left_page)
-                pages.append(right_page)
+    def transform(item, data):
+        nonlocal cover_page, page_number, nb_skipped
+        (idx, filename) = item
 
-        for page in pages:
-            out_file = os.path.join(output_folder, f"T{volume_number:02d}_page_{page_number:03d}.png")
-            # https://imageio.readthedocs.io/en/stable/format_png-pil.html
+        if isinstance(data, dict):
+            if data["page_number"] == page_number:
+                # One path per page and per output
+                page_number += len(data["outputs"]) // len(specs)
+                nb_skipped += 1
+                cover_page = False
+                return []
 
-            if os.path.isfile(out_file) and overwrite:
-                os.remove(out_file)
+            # Page numbers changed because of a previous page
+            data = load(idx, filename)
 
-            imageio.imsave(out_file, page)
-            page_number += 1
+        print(f"\rProcessing page {filename}      ", end="")
+        first_page = page_number
+        if data is None:
+            # Nothing to change, the file is copied
+            pages = [filename]
+        else:
+            pages = get_output_pages(filename, data, cover_page=cover_page, copy=can_copy(specs),
+                                     japan_read=japan_read, tolerance=tolerance, detect_gutter=detect_gutter,
+                                     levels=levels, dither=dither)
+        page_number += len(pages)
 
         # After the first loop, all other pages are not a cover page
         cover_page = False
-    print(f"\rFinished writting {page_number-1} pages.                       ")
 
-japan_read = False  # If false, first page is the left one, else it's the right one
-input_folder = "G:/Manga/Dragon Ball"
-output_folder = "G:/Manga/Dragon_Ball_tmp"
+        # All pages of one file are written by the same writer, so the file can be recorded once they are done
+        return [(filename, first_page, pages)]
+
+    def write(item):
+        (filename, first_page, pages) = item
+        paths = write_outputs(outputs, specs, pages, volume_number, first_page, levels=levels,
+                              compress_level=compress_level, executor=executor)
+
+        if manifest is not None:
+            manifest.record(filename, paths, page_number=first_page)
+
+    try:
+        with timing.volume(volume_number), ExitStack() as stack:
+            outputs = [stack.enter_context(open_output(get_spec_folder(output_folder, spec, archive=archive),
+                                                       archive=archive, overwrite=overwrite, compression=compression))
+                       for spec in specs]
+            executor = None
+            if encoders > 1:
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=encoders))
+
+            stream(enumerate(filenames), read, transform, write, prefetch=prefetch, writers=writers)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    if nb_skipped:
+        print(f"\rFinished writting {page_number-1} pages ({nb_skipped} files unchanged).            ")
+    else:
+        print(f"\rFinished writting {page_number-1} pages.                       ")
+
+
+def split_volumes(volumes, japan_read=False, overwrite=True, workers=None, tolerance=0, detect_gutter=False,
+                  incremental=False, archive=False, compression="store", levels=None, dither=False,
+                  compress_level=None, output_specs=None, encoders=1):
+    """
+    Split several volumes, spreading volumes and pages across a pool of processes.
+
+    Output filenames depend on the number of double pages before each file. They are computed
+    up front, in a first parallel pass that classify pages (see plan_page), so that the pages can then be
+    written in any order while giving the exact same files as the serial version. Pages that must be decoded to be
+    classified are written during this first pass under temporary names, then renamed (see classify_page).
+
+    :param volumes: list of (filenames, volume_number, output_folder)
+    :type volumes: list(tuple(list(str), int, str))
+    :param bool japan_read: If True, the first page of the double page will be the one on the right
+    :param bool overwrite: By default, any existing image will be overwritten
+    :param int workers: [optional] Number of processes. By default, use all CPUs. 1 means serial processing.
+    :param int tolerance: [optional] Maximum difference between channels for a page to be considered gray
+    :param bool detect_gutter: [optional] If True, split double pages where the gutter is detected
+    :param bool incremental: [optional] If True, skip pages already done (see split_volume_pages)
+    :param bool archive: [optional] If True, each volume is written in a output_folder + '.cbz' archive. In parallel,
+                         each volume is then processed by one process.
+    :param str compression: [optional] Archive compression (see outputs.COMPRESSIONS), by default pages are stored
+    :param int levels: [optional] If given (16 or 4), grayscale pages are quantized (see split_volume_pages)
+    :param bool dither: [optional] If True, quantize with ordered dithering
+    :param int compress_level: [optional] zlib compression level of the PNG files (0-9)
+    :param output_specs: [optional] outputs to write (see split_volume_pages)
+    :type output_specs: list(dict)
+    :param int encoders: [optional] Number of threads encoding the outputs of a page in each process
+    :return:
+    """
+
+    specs = get_output_specs(output_specs)
+
+    if workers == 1:
+        for (filenames, volume_number, output_folder) in volumes:
+            print(f"Processing Volume {volume_number:02d}")
+            split_volume_pages(filenames, volume_number, output_folder=output_folder, japan_read=japan_read,
+                               overwrite=overwrite, tolerance=tolerance, detect_gutter=detect_gutter,
+                               incremental=incremental, archive=archive, compression=compression, levels=levels,
+                               dither=dither, compress_level=compress_level, output_specs=output_specs,
+                               encoders=encoders)
+        return
+
+    if archive:
+        # An archive is written sequentially, volumes are spread across processes instead of pages
+        process = partial(split_volume_pages, japan_read=japan_read, overwrite=overwrite, tolerance=tolerance,
+                          detect_gutter=detect_gutter, incremental=incremental, archive=archive,
+                          compression=compression, levels=levels, dither=dither, compress_level=compress_level,
+                          output_specs=output_specs, encoders=encoders)
+        with ProcessPoolExecutor(max_workers=workers, **page_cache.get_pool_kwargs()) as executor:
+            list(executor.map(process, [volume[0] for volume in volumes], [volume[1] for volume in volumes],
+                              [volume[2] for volume in volumes]))
+        return
+
+    # One job per input file, in volume then reading order
+    jobs = []
+    for (filenames, volume_number, output_folder) in volumes:
+        if output_folder is None:
+            output_folder = "."
+
+        if not os.path.isdir(output_folder):
+            os.makedirs(output_folder)
+
+        for (idx, filename) in enumerate(filenames):
+            # First page of each volume is the cover page
+            jobs.append((filename, volume_number, output_folder, idx == 0))
+
+    filenames = [job[0] for job in jobs]
+    cover_pages = [job[3] for job in jobs]
+    file_indexes = [idx for volume in volumes for idx in range(len(volume[0]))]
+    temporary_files = []
+
+    manifests = {}
+    entries = [None] * len(jobs)
+    if incremental:
+        for (volume_filenames, volume_number, output_folder) in volumes:
+            manifests[volume_number] = open_manifest(output_folder or ".", volume_number, japan_read=japan_read,
+                                                     tolerance=tolerance, detect_gutter=detect_gutter, levels=levels,
+                                                     dither=dither, compress_level=compress_level,
+                                                     output_specs=output_specs)
+        entries = [manifests[job[1]].get(job[0]) for job in jobs]
+
+        # The number of pages of a file is only known if it's still (or still not) the cover page
+        entries = [entry if entry is not None and (entry["page_number"] == 1) == job[3] else None
+                   for (entry, job) in zip(entries, jobs)]
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    # A few chunks per process, to limit the inter-process overhead while keeping all processes busy
+    chunksize = max(1, len(jobs) // (4 * workers))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, **page_cache.get_pool_kwargs()) as executor:
+
+            # Files in the manifest already know their number of pages
+            plans = [(len(entry["outputs"]) // len(specs), None, None) if entry is not None else None
+                     for entry in entries]
+            todo = [idx for idx in range(len(jobs)) if entries[idx] is None]
+
+            # Pages that must be decoded to be counted are written at the same time, under temporary names
+            print(f"Classifying {len(todo)} files")
+            process = partial(classify_page, japan_read=japan_read, overwrite=overwrite, tolerance=tolerance,
+                              detect_gutter=detect_gutter, levels=levels, dither=dither, compress_level=compress_level,
+                              output_specs=output_specs, encoders=encoders)
+            results = executor.map(process, [filenames[idx] for idx in todo], [jobs[idx][1] for idx in todo],
+                                   [jobs[idx][2] for idx in todo], [file_indexes[idx] for idx in todo],
+                                   [cover_pages[idx] for idx in todo], chunksize=chunksize)
+            for (idx, plan) in zip(todo, results):
+                plans[idx] = plan
+                if plan[2] is not None:
+                    temporary_files.extend(plan[2])
+            page_counts = [plan[0] for plan in plans]
+
+            # Page numbering restart at 1 for each volume
+            page_numbers = []
+            idx = 0
+            for (volume_filenames, volume_number, output_folder) in volumes:
+                nb_files = len(volume_filenames)
+                page_numbers.extend(get_page_numbers(page_counts[idx:idx + nb_files]))
+                idx += nb_files
+
+            # Pages already written get their name
+            written = [idx for idx in range(len(jobs)) if plans[idx][2] is not None]
+            print(f"Classified {len(todo)} files ({len(written)} decoded, and written at the same time)")
+            for idx in written:
+                (filename, volume_number, output_folder, cover_page) = jobs[idx]
+                paths = [os.path.join(get_spec_folder(output_folder, spec),
+                                      get_page_name(volume_number, page_numbers[idx] + page, spec["format"]))
+                         for spec in specs for page in range(page_counts[idx])]
+                for (tmp_file, path) in zip(plans[idx][2], paths):
+                    os.replace(tmp_file, path)
+
+                if incremental:
+                    manifests[volume_number].record(filename, paths, page_number=page_numbers[idx])
+
+            # Files already done, unless a previous page changed their page numbers
+            todo = [idx for idx in range(len(jobs)) if plans[idx][2] is None
+                    and (entries[idx] is None or entries[idx]["page_number"] != page_numbers[idx])]
+
+            print(f"Writing {sum(page_counts[idx] for idx in todo + written)} pages "
+                  f"({len(jobs) - len(todo) - len(written)} files unchanged)")
+            process = partial(process_page, japan_read=japan_read, overwrite=overwrite, tolerance=tolerance,
+                              detect_gutter=detect_gutter, levels=levels, dither=dither, compress_level=compress_level,
+                              output_specs=output_specs, encoders=encoders)
+            nb_written = executor.map(process, [filenames[idx] for idx in todo], [page_numbers[idx] for idx in todo],
+                                      [jobs[idx][1] for idx in todo], [jobs[idx][2] for idx in todo],
+                                      [cover_pages[idx] for idx in todo], [plans[idx][1] for idx in todo],
+                                      chunksize=chunksize)
+
+            for (idx, nb_pages) in zip(todo, nb_written):
+                (filename, volume_number, output_folder, cover_page) = jobs[idx]
+                if page_counts[idx] != nb_pages:
+                    raise RuntimeError(f"{filename} gave {nb_pages} pages instead of {page_counts[idx]}")
+
+                if incremental:
+                    out_files = [path for page in range(nb_pages)
+                                 for path in get_output_filenames(output_folder, volume_number,
+                                                                  page_numbers[idx] + page, output_specs)]
+                    manifests[volume_number].record(filename, out_files, page_number=page_numbers[idx])
+    finally:
+        # Pages of an interrupted run that were not renamed
+        for tmp_file in temporary_files:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+
+        for manifest in manifests.values():
+            manifest.close()
+
+    print(f"Finished writting {sum(page_counts)} pages for {len(volumes)} volume(s).")
+
+
+if __name__ == "__main__":
+    japan_read = False  # If false, first page is the left one, else it's the right one
+    input_folder = "G:/Manga/Dragon Ball"
+    output_folder = "G:/Manga/Dragon_Ball_tmp"
+    workers = None  # Number of processes, None means all CPUs, 1 means serial
+    detect_gutter = False  # If True, split double pages where the gutter is detected instead of a fixed ratio
+    incremental = True  # If True, only process pages that changed since the last run
+    archive = False  # If True, each volume is written in a .cbz file instead of a folder (not incremental)
+    levels = None  # 16 or 4 to quantize grayscale pages into 4 bits or 2 bits PNG files (smaller, for e-readers)
+    dither = False  # If True, quantize with ordered dithering
+    # Outputs written in the same pass, e.g. add small JPEG pages for a preview:
+    # [{}, {"folder": "preview", "size": (None, 400), "format": "jpg", "quality": 80}]
+    output_specs = None  # None means full size PNG pages only
+    encoders = 1  # Number of threads encoding the outputs of a page at the same time
+    cache_folder = None  # If set, decoded pages are cached in this folder, to try other parameters faster
+    profile = False  # If True, print the time spent in each step and save a trace (see timing.py)
+
+    if profile:
+        # Steps are only recorded in the current process
+        workers = 1
+        timing.enable()
+
+    if cache_folder is not None:
+        page_cache.enable(cache_folder)
+
+    # Volumes as folders, or as archives (T1.cbz)
+    # The index is kept with the outputs, it's reused while the input folder is unchanged
+    index = scan_library(input_folder, volume_pattern=VOLUME_PATTERN, extensions=(".png",), max_depth=1,
+                         index_file=os.path.join(output_folder, ".library.json"))
+
+    volumes = []
+    for (name, files) in index.items():
+        volume_number = get_volume_number(name, VOLUME_PATTERN)
+        volumes.append((files, volume_number, os.path.join(output_folder, f"T{volume_number:02d}")))
 
-for volume_number in range(1, 43):
-    print(f"Processing Volume {volume_number:02d}")
-    files = glob.glob(os.path.join(input_folder, f"T{volume_number}", "*.png"))
-    files.sort()
+    split_volumes(volumes, japan_read=japan_read, workers=workers, detect_gutter=detect_gutter,
+                  incremental=incremental and not archive, archive=archive, levels=levels, dither=dither,
+                  output_specs=output_specs, encoders=encoders)
 
-    split_volume_pages(files, volume_number, output_folder=os.path.join(output_folder, f"T{volume_number:02d}"))
+    if profile:
+        timing.print_summary()
+        timing.save_trace("split_doublepages_trace.json")
 
 # Double page: (1061, 1292)
-# single page: (1063, 650)
\ No newline at end of file
+# single page: (1063, 650)
@@ -0,0 +1,128 @@
+"""
+Bounded-queue pipeline to overlap disk I/O (decode, encode) with the NumPy work on pages.
+
+A reader thread reads items ahead of time, the transform is done in the calling thread, in order,
+and writer threads save the results. Queues are bounded so a slow stage block the previous ones
+(backpressure): at most prefetch pages wait to be transformed, and at most prefetch pages wait
+to be written.
+
+"""
+import queue
+import threading
+
+# Marker sent to the writer threads when there's nothing left to write
+_DONE = object()
+
+# Time (s) between two checks of the stop flag when a queue is full or empty
+_POLL = 0.1
+
+
+def _put(fifo, obj, stop):
+    """
+    Blocking put that gives up if the pipeline is stopped (so that a thread never stay stuck on a full queue)
+
+    :return: True if obj was added to the queue
+    :rtype: bool
+    """
+
+    while not stop.is_set():
+        try:
+            fifo.put(obj, timeout=_POLL)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _get(fifo, stop):
+    """
+    Blocking get that gives up if the pipeline is stopped
+
+    :return: next object of the queue, _DONE if the pipeline is stopped
+    """
+
+    while not stop.is_set():
+        try:
+            return fifo.get(timeout=_POLL)
+        except queue.Empty:
+            continue
+
+    return _DONE
+
+
+def stream(items, read, transform, write, prefetch=4, writers=2):
+    """
+    Run read -> transform -> write on each item, with read and write in background threads.
+
+    Peak memory is bounded to about 2 * prefetch + writers + 1 pages in flight.
+
+    :param items: iterable of inputs (e.g. filenames)
+    :param read: function(item) -> data, run in the reader thread, in order
+    :param transform: function(item, data) -> list of outputs, run in the calling thread, in order
+    :param write: function(output), run in one of the writer threads, in any order
+    :param int prefetch: Maximum number of pages waiting in each queue
+    :param int writers: Number of writer threads
+    :return:
+    """
+
+    if prefetch < 1:
+        raise ValueError(f"prefetch must be at least 1 (got {prefetch})")
+    if writers < 1:
+        raise ValueError(f"writers must be at least 1 (got {writers})")
+
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            for item in items:
+                if not _put(read_queue, (item, read(item)), stop):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        _put(read_queue, _DONE, stop)
+
+    def writer():
+        while True:
+            output = _get(write_queue, stop)
+            if output is _DONE:
+                return
+            try:
+                write(output)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+
+    threads = [threading.Thread(target=reader, name="stream-reader", daemon=True)]
+    threads.extend(threading.Thread(target=writer, name=f"stream-writer-{idx}", daemon=True)
+                   for idx in range(writers))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            obj = _get(read_queue, stop)
+            if obj is _DONE:
+                break
+
+            (item, data) = obj
+            for output in transform(item, data):
+                if not _put(write_queue, output, stop):
+                    break
+
+        for idx in range(writers):
+            _put(write_queue, _DONE, stop)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
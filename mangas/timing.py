@@ -0,0 +1,256 @@
+"""
+Opt-in timing of the steps of the manga scripts, to know if a slow run is I/O bound or CPU bound.
+
+Disabled by default: span() then returns a shared do-nothing context manager, so the instrumented code costs
+nothing. Once enabled, each step of each page is recorded (start, duration, thread, page, volume), with the
+number of bytes read and written:
+    - read, write: filesystem (or archive) time, category 'io'
+    - decode, grayscale_test, conversion, split, autoclean, encode: category 'cpu'
+Threads overlap, so the total of the steps can be larger than the wall time.
+
+Only the current process is recorded: with a process pool, use workers=1 to get all the steps.
+
+Usage:
+    timing.enable()
+    split_volume_pages(...)
+    timing.print_summary()
+    timing.save_trace("trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+IO_STEPS = ("read", "write")
+
+_recorder = None
+_null = contextlib.nullcontext()
+
+
+class _Recorder:
+    def __init__(self):
+        self.start = time.perf_counter_ns()
+        self.events = []
+        self.bytes = {"read": 0, "written": 0}
+        # Per volume: {volume_number: {"read": ..., "written": ...}}
+        self.volume_bytes = {}
+        self.volume = None
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, args):
+        event = (name, start, end, threading.get_ident(), self.volume, args)
+        with self.lock:
+            self.events.append(event)
+
+    def add_bytes(self, kind, nb_bytes):
+        with self.lock:
+            self.bytes[kind] += nb_bytes
+            volume_bytes = self.volume_bytes.setdefault(self.volume, {"read": 0, "written": 0})
+            volume_bytes[kind] += nb_bytes
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "args", "start")
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+def enable():
+    """
+    Start recording (previous records are discarded)
+    """
+
+    global _recorder
+    _recorder = _Recorder()
+
+
+def disable():
+    """
+    Stop recording and discard the records
+    """
+
+    global _recorder
+    _recorder = None
+
+
+def is_enabled():
+    """
+    :return: True if steps are recorded
+    :rtype: bool
+    """
+
+    return _recorder is not None
+
+
+def span(name, **args):
+    """
+    Context manager that records the time spent in a step
+
+    :param str name: name of the step (e.g. 'decode')
+    :param args: [optional] details saved in the trace (e.g. page=filename)
+    :return: context manager
+    """
+
+    if _recorder is None:
+        return _null
+
+    return _Span(_recorder, name, args)
+
+
+def add_bytes(kind, nb_bytes):
+    """
+    :param str kind: 'read' or 'written'
+    :param int nb_bytes:
+    """
+
+    if _recorder is not None:
+        _recorder.add_bytes(kind, nb_bytes)
+
+
+@contextlib.contextmanager
+def volume(volume_number):
+    """
+    Steps recorded inside are attributed to this volume (volumes are expected to be processed one at a time)
+
+    :param int volume_number:
+    """
+
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+
+    previous = recorder.volume
+    recorder.volume = volume_number
+    try:
+        with span("volume", volume=volume_number):
+            yield
+    finally:
+        recorder.volume = previous
+
+
+def get_summary():
+    """
+    :return: wall time (s), bytes read and written, and per step and per volume: number of calls and total time (s)
+    :rtype: dict
+    """
+
+    if _recorder is None:
+        raise RuntimeError("Timing is not enabled, call timing.enable() first")
+
+    with _recorder.lock:
+        events = list(_recorder.events)
+        end = time.perf_counter_ns()
+        summary = {
+            "wall": (end - _recorder.start) / 1e9,
+            "bytes": dict(_recorder.bytes),
+            "steps": {},
+            "volumes": {},
+        }
+        volume_bytes = {key: dict(value) for (key, value) in _recorder.volume_bytes.items()}
+
+    for (name, start, stop, tid, volume_number, args) in events:
+        duration = (stop - start) / 1e9
+        if name == "volume":
+            summary["volumes"].setdefault(volume_number, {"wall": 0., "steps": {}})["wall"] += duration
+            continue
+
+        step = summary["steps"].setdefault(name, {"count": 0, "time": 0.})
+        step["count"] += 1
+        step["time"] += duration
+
+        if volume_number is not None:
+            steps = summary["volumes"].setdefault(volume_number, {"wall": 0., "steps": {}})["steps"]
+            steps[name] = steps.get(name, 0.) + duration
+
+    for (volume_number, nb_bytes) in volume_bytes.items():
+        if volume_number is not None:
+            summary["volumes"].setdefault(volume_number, {"wall": 0., "steps": {}})["bytes"] = nb_bytes
+
+    return summary
+
+
+def print_summary():
+    """
+    Print the time spent in each step, I/O against CPU, and the time of each volume
+    """
+
+    summary = get_summary()
+    wall = summary["wall"]
+
+    print(f"{'Step':16s} {'calls':>7s} {'total (s)':>10s} {'mean (ms)':>10s} {'% wall':>7s}")
+    io_time = 0.
+    cpu_time = 0.
+    for (name, step) in sorted(summary["steps"].items(), key=lambda item: -item[1]["time"]):
+        print(f"{name:16s} {step['count']:7d} {step['time']:10.3f} {1e3 * step['time'] / step['count']:10.2f} "
+              f"{step['time'] / wall:7.1%}")
+        if name in IO_STEPS:
+            io_time += step["time"]
+        else:
+            cpu_time += step["time"]
+
+    read = summary["bytes"]["read"]
+    written = summary["bytes"]["written"]
+    print(f"Wall time: {wall:.3f} s, I/O: {io_time:.3f} s, CPU: {cpu_time:.3f} s")
+    print(f"Read {read / 2**20:.1f} MiB ({read / 2**20 / wall:.1f} MiB/s), "
+          f"written {written / 2**20:.1f} MiB ({written / 2**20 / wall:.1f} MiB/s)")
+
+    if summary["volumes"]:
+        names = sorted({name for volume_summary in summary["volumes"].values() for name in volume_summary["steps"]})
+        print(f"{'Volume':>6s} {'wall (s)':>9s} {'read MiB':>9s} {'write MiB':>9s} "
+              + " ".join(f"{name[:12]:>12s}" for name in names))
+        for (volume_number, volume_summary) in sorted(summary["volumes"].items()):
+            steps = volume_summary["steps"]
+            nb_bytes = volume_summary.get("bytes", {"read": 0, "written": 0})
+            print(f"{volume_number:6d} {volume_summary['wall']:9.3f} {nb_bytes['read'] / 2**20:9.1f} "
+                  f"{nb_bytes['written'] / 2**20:9.1f} " + " ".join(f"{steps.get(name, 0.):12.3f}" for name in names))
+
+
+def save_trace(filename):
+    """
+    Save the records in the Chrome trace event format (JSON)
+
+    :param str filename:
+    """
+
+    if _recorder is None:
+        raise RuntimeError("Timing is not enabled, call timing.enable() first")
+
+    with _recorder.lock:
+        events = list(_recorder.events)
+        nb_bytes = dict(_recorder.bytes)
+        origin = _recorder.start
+
+    pid = os.getpid()
+    trace_events = []
+    for (name, start, stop, tid, volume_number, args) in events:
+        event_args = {key: str(value) for (key, value) in args.items()}
+        if volume_number is not None:
+            event_args["volume"] = volume_number
+
+        trace_events.append({
+            "name": name,
+            "cat": "io" if name in IO_STEPS else "cpu",
+            "ph": "X",
+            # Microseconds
+            "ts": (start - origin) / 1e3,
+            "dur": (stop - start) / 1e3,
+            "pid": pid,
+            "tid": tid,
+            "args": event_args,
+        })
+
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"bytes": nb_bytes}}, f)
@@ -0,0 +1,223 @@
+"""
+Trim the white or black margins of scanned pages.
+
+The background is the median colour of the border of the page. On a downsampled copy, each row and each column is
+reduced to its number of pixels that differ from the background: the content is between the first and the last
+rows (and columns) with enough of them, so isolated specks of dust are ignored. The page is then cropped around
+the content plus a safety margin, as a slice of the original image (no copy).
+
+To keep the page sizes consistent across a volume, the box of each page can be enlarged to a common size (the largest
+content of the volume for its orientation, see get_trim_sizes), around the content of the page, and the page is padded
+with its background when the box is larger than the page. A box is never reduced: pages with more content than the
+common size (e.g. a full bleed illustration) keep their own box, no content is ever cut.
+
+"""
+import numpy as np
+
+from grayscale import is_grayscale
+from gutter import get_split_columns
+from preview import JPEG_MARGIN, read_header, read_preview
+
+# Difference with the background (0-255) above which a pixel is content
+THRESHOLD = 32
+
+# Fraction of the pixels of a row (or column) that must be content for the row to be content
+MIN_FRACTION = 0.005
+
+# Safety margin kept around the content, in pixels
+MARGIN = 8
+
+
+def get_background(image):
+    """
+    :param ndarray image: (height, width) or (height, width, channels)
+    :return: median value of the pixels on the border of the image, one per channel
+    :rtype: ndarray
+    """
+
+    border = np.concatenate([image[0], image[-1], image[1:-1, 0], image[1:-1, -1]])
+
+    return np.median(border, axis=0)
+
+
+def get_content_box(image, step=4, threshold=THRESHOLD, min_fraction=MIN_FRACTION):
+    """
+    :param ndarray image: (height, width) or (height, width, channels)
+    :param int step: [optional] downsampling factor, in both directions
+    :param int threshold: [optional] Difference with the background above which a pixel is content
+    :param float min_fraction: [optional] Fraction of content pixels for a row (or column) to be content
+    :return: top, bottom, left, right (bottom and right excluded) of the content in the image. The whole image
+             for a blank page.
+    :rtype: tuple(int, int, int, int)
+    """
+
+    (height, width) = image.shape[:2]
+
+    # Strided view, only the selected pixels are converted
+    small = image[::step, ::step].astype(np.int16)
+    diff = np.abs(small - get_background(small))
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+    content = diff > threshold
+
+    rows = np.count_nonzero(content, axis=1) > min_fraction * content.shape[1]
+    columns = np.count_nonzero(content, axis=0) > min_fraction * content.shape[0]
+    if not rows.any() or not columns.any():
+        return 0, height, 0, width
+
+    # The content starts after the previous sampled row (column), and ends before the next one
+    top = max(0, int(np.argmax(rows)) * step - step + 1)
+    bottom = min(height, (rows.size - int(np.argmax(rows[::-1]))) * step)
+    left = max(0, int(np.argmax(columns)) * step - step + 1)
+    right = min(width, (columns.size - int(np.argmax(columns[::-1]))) * step)
+
+    return top, bottom, left, right
+
+
+def _fit(start, end, length, limit):
+    # Grow [start, end[ to length around its centre, shifted to stay in [0, limit[. If it's longer than limit, it's
+    # centred on [0, limit[ instead (outside on both sides). A longer [start, end[ is kept as is.
+    if end - start >= length:
+        return start, end
+    elif length > limit:
+        start = (limit - length) // 2
+    else:
+        start = min(max(0, (start + end - length) // 2), limit - length)
+
+    return start, start + length
+
+
+def expand_box(box, shape, margin=MARGIN, size=None):
+    """
+    :param tuple box: top, bottom, left, right of the content (see get_content_box)
+    :param tuple shape: (height, width, ...) of the image
+    :param int margin: [optional] pixels added on each side of the content
+    :param tuple size: [optional] (height, width) minimum size of the box, to keep pages of the same size. The box
+                       is enlarged around its centre, never reduced, so no content is cut. Where the size is larger
+                       than the image, the box goes outside of the image, centred on it.
+    :return: top, bottom, left, right, inside the image unless size is larger than the image
+    :rtype: tuple(int, int, int, int)
+    """
+
+    (height, width) = shape[:2]
+    (top, bottom, left, right) = box
+
+    top = max(0, top - margin)
+    bottom = min(height, bottom + margin)
+    left = max(0, left - margin)
+    right = min(width, right + margin)
+
+    if size is not None:
+        (top, bottom) = _fit(top, bottom, size[0], height)
+        (left, right) = _fit(left, right, size[1], width)
+
+    return top, bottom, left, right
+
+
+def trim(image, margin=MARGIN, size=None, step=4, threshold=THRESHOLD, min_fraction=MIN_FRACTION):
+    """
+    :param ndarray image: (height, width) or (height, width, channels)
+    :param int margin: [optional] pixels kept on each side of the content
+    :param tuple size: [optional] (height, width) minimum size of the trimmed page (see expand_box)
+    :param int step: [optional] downsampling factor used to find the content
+    :param int threshold: [optional] Difference with the background above which a pixel is content
+    :param float min_fraction: [optional] Fraction of content pixels for a row (or column) to be content
+    :return: trimmed page, a view of the image (a padded copy if size is larger than the image)
+    :rtype: ndarray
+    """
+
+    (height, width) = image.shape[:2]
+    box = get_content_box(image, step=step, threshold=threshold, min_fraction=min_fraction)
+    (top, bottom, left, right) = expand_box(box, image.shape, margin=margin, size=size)
+
+    if top >= 0 and left >= 0 and bottom <= height and right <= width:
+        return image[top:bottom, left:right]
+
+    # The box is larger than the image, the missing part is filled with the background
+    page = np.empty((bottom - top, right - left) + image.shape[2:], dtype=image.dtype)
+    page[...] = np.round(get_background(image)).astype(image.dtype)
+    rows = slice(max(0, top), min(height, bottom))
+    columns = slice(max(0, left), min(width, right))
+    page[rows.start - top:rows.stop - top, columns.start - left:columns.stop - left] = image[rows, columns]
+
+    return page
+
+
+def get_orientation(shape):
+    """
+    :param tuple shape: (height, width, ...) of a page
+    :return: "landscape" for pages wider than tall (double pages), "portrait" otherwise
+    :rtype: str
+    """
+
+    return "landscape" if shape[1] > shape[0] else "portrait"
+
+
+def _get_common_length(lengths, limits):
+    # Largest length that doesn't fill its page, the largest page if they all do
+    partial = lengths < limits
+    if partial.any():
+        return int(lengths[partial].max())
+
+    return int(limits.max())
+
+
+def get_trim_sizes(filenames, margin=MARGIN, threshold=THRESHOLD, min_fraction=MIN_FRACTION, split=True,
+                   detect_gutter=False):
+    """
+    Common size of the trimmed pages of a volume, for portrait and landscape pages. Content boxes are found on reduced
+    previews (see preview.read_preview): JPEG pages are only partially decoded, other formats (e.g. PNG) are fully
+    decoded, then reduced.
+
+    The size is the largest box (content plus margin) of the pages with the same orientation, leaving out the boxes
+    that fill their page in that direction (e.g. a full bleed illustration): they have nothing to trim and would
+    prevent trimming every other page. They are kept whole by trim, larger than the common size. If all pages are
+    full, it's the size of the largest page.
+
+    :param filenames: pages of the volume (path or sources.ArchivePage). Leave out the cover page, that often has
+                      no margin.
+    :param int margin: [optional] pixels kept on each side of the content
+    :param int threshold: [optional] Difference with the background above which a pixel is content
+    :param float min_fraction: [optional] Fraction of content pixels for a row (or column) to be content
+    :param bool split: [optional] If True, pages are trimmed after being split: grayscale double pages count as
+                       their two pages, cut where split_doublepages.split_page cuts them
+    :param bool detect_gutter: [optional] detect_gutter option of the split (see gutter.get_split_columns)
+    :return: orientation (see get_orientation): (height, width) of the trimmed pages, to give to trim
+    :rtype: dict
+    """
+
+    boxes = {}
+
+    def add(preview, height, width):
+        # preview of a page of (height, width) pixels
+        scale_y = height / preview.shape[0]
+        scale_x = width / preview.shape[1]
+        (top, bottom, left, right) = get_content_box(preview, step=1, threshold=threshold,
+                                                     min_fraction=min_fraction)
+        # One more preview pixel on each side, the full page content can be slightly larger than in the preview
+        box = (int((top - 1) * scale_y), int(np.ceil((bottom + 1) * scale_y)), int((left - 1) * scale_x),
+               int(np.ceil((right + 1) * scale_x)))
+        (top, bottom, left, right) = expand_box(box, (height, width), margin=margin)
+
+        orientation = get_orientation((height, width))
+        boxes.setdefault(orientation, []).append((bottom - top, right - left, height, width))
+
+    for filename in filenames:
+        (width, height, mode, image_format) = read_header(filename)
+        preview = read_preview(filename)
+
+        if split and width > height and is_grayscale(preview, tolerance=JPEG_MARGIN):
+            gray = preview if preview.ndim == 2 else preview[:, :, 0]
+            (left_end, right_start) = get_split_columns(gray, detect=detect_gutter, step=1)
+            scale_x = width / preview.shape[1]
+            add(preview[:, :left_end], height, round(left_end * scale_x))
+            add(preview[:, right_start:], height, width - round(right_start * scale_x))
+        else:
+            add(preview, height, width)
+
+    sizes = {}
+    for (orientation, values) in boxes.items():
+        (box_heights, box_widths, heights, widths) = np.array(values).T
+        sizes[orientation] = (_get_common_length(box_heights, heights), _get_common_length(box_widths, widths))
+
+    return sizes